@@ -3,18 +3,17 @@ require_once 'config.php';
 require_once 'security_headers.php';
 
 $coinId = intval($_GET['id'] ?? 0);
-$coins = getCoins();
-$totalCoins = count($coins);
+$totalCoins = getCoinCount();
+$coin = getCoin($coinId);
 
-if ($coinId < 0 || $coinId >= $totalCoins) {
+if (!$coin) {
     header('Location: index.php');
     exit;
 }
 
-$coinImages = $coins[$coinId];
 $prevCoin = $coinId > 0 ? $coinId - 1 : null;
 $nextCoin = $coinId < $totalCoins - 1 ? $coinId + 1 : null;
-$meta = getCoinMetadata($coinId);
+$meta = $coin['meta'];
 ?>
 <!DOCTYPE html>
 <html lang="fr">
@@ -32,7 +31,7 @@ $meta = getCoinMetadata($coinId);
         h1 { margin-bottom: 30px; }
         .photos { display: grid; grid-template-columns: repeat(auto-fit, minmax(400px, 1fr)); gap: 20px; margin-bottom: 30px; }
         .photo-wrapper { text-align: center; }
-        .photo-wrapper img { width: 100%; max-width: 500px; cursor: pointer; border-radius: 8px; transition: transform 0.2s; }
+        .photo-wrapper img { width: 100%; height: auto; max-width: 500px; cursor: pointer; border-radius: 8px; transition: transform 0.2s; }
         .photo-wrapper img:hover { transform: scale(1.02); }
         .photo-label { margin-top: 10px; color: #999; }
         .legend { background: #2a2a2a; padding: 20px; border-radius: 8px; }
@@ -65,11 +64,17 @@ $meta = getCoinMetadata($coinId);
         ?></h1>
 
         <div class="photos">
-            <?php foreach ($coinImages as $idx => $img): ?>
+            <?php foreach ($coin['photos'] as $idx => $photo): ?>
                 <div class="photo-wrapper">
-                    <img src="<?= PICTURES_URL . '/' . $img ?>"
-                         alt="<?= $idx === 0 ? 'Face' : 'Pile' ?>"
-                         onclick="openLightbox(<?= $coinId ?>, <?= $idx ?>)">
+                    <?php $medium = getRendition($photo, 'medium'); ?>
+                    <picture>
+                        <?php if ($medium['webp']): ?>
+                            <source srcset="<?= htmlspecialchars($medium['webp']) ?>" type="image/webp">
+                        <?php endif; ?>
+                        <img src="<?= htmlspecialchars($medium['jpg']) ?>" <?= imageSizeAttributes($photo) ?>
+                             alt="<?= $idx === 0 ? 'Face' : 'Pile' ?>"
+                             onclick="openLightbox(<?= $coinId ?>, <?= $idx ?>)">
+                    </picture>
                     <div class="photo-label"><?= $idx === 0 ? 'Face' : 'Pile' ?></div>
                 </div>
             <?php endforeach; ?>
@@ -1,14 +1,49 @@
 <?php
 // Configuration centralisée
 
-define('PICTURES_DIR', __DIR__ . '/../pictures/2025-11-02_19h15');
-define('PICTURES_URL', '/pictures/2025-11-02_19h15');
+// Répertoire des séances de photos (sous-répertoires datés AAAA-MM-JJ_HHhMM)
+define('PICTURES_DIR', getenv('COINS_PICTURES_DIR') ?: __DIR__ . '/../pictures');
+define('PICTURES_URL', '/pictures');
+define('SESSIONS_FILE', __DIR__ . '/sessions.json');
+define('SESSION_PATTERN', '/^\d{4}-\d{2}-\d{2}_\d{2}h\d{2}$/');
 define('METADATA_FILE', __DIR__ . '/coins_metadata.json');
+define('RENDITIONS_DIR', __DIR__ . '/cache/renditions');
+define('RENDITIONS_URL', '/gallery/cache/renditions');
 
+// Index précalculé par scripts/gallery_index.py: les pages ne lisent que les fragments affichés
+define('INDEX_DIR', __DIR__ . '/cache/index');
+define('FACETS', ['country', 'currency', 'year']);
+// Pièces par page de la grille (= SHARD_SIZE: une page sans filtre lit un seul fragment)
+define('PAGE_SIZE', 100);
+
+// Paires de photos ("séance/photo.jpg") indexées par id de pièce, toutes séances confondues.
+// Les ids viennent du registre tenu par scripts/sessions.py; sans registre, chaque
+// séance est découpée en paires dans l'ordre, séance après séance.
+// Ne sert plus qu'en l'absence de l'index précalculé (voir getCoin).
 function getCoins() {
-    $images = array_values(array_filter(scandir(PICTURES_DIR), fn($f) => preg_match('/\.jpg$/i', $f)));
-    sort($images);
-    return array_chunk($images, 2);
+    $coins = [];
+    if (file_exists(SESSIONS_FILE)) {
+        $data = json_decode(file_get_contents(SESSIONS_FILE), true);
+        foreach ($data['sessions'] ?? [] as $session => $info) {
+            foreach ($info['pairs'] as [$id, $face, $pile]) {
+                $coins[$id] = ["$session/$face", "$session/$pile"];
+            }
+        }
+        ksort($coins);
+        return $coins;
+    }
+
+    $sessions = array_filter(scandir(PICTURES_DIR), fn($d) => preg_match(SESSION_PATTERN, $d) && is_dir(PICTURES_DIR . "/$d"));
+    foreach ($sessions as $session) {
+        $images = array_values(array_filter(scandir(PICTURES_DIR . "/$session"), fn($f) => preg_match('/^[^.].*\.jpg$/i', $f)));
+        sort($images);
+        foreach (array_chunk($images, 2) as $pair) {
+            if (count($pair) === 2) {
+                $coins[] = ["$session/$pair[0]", "$session/$pair[1]"];
+            }
+        }
+    }
+    return $coins;
 }
 
 function getMetadata() {
@@ -26,10 +61,314 @@ function getMetadata() {
     return $indexed;
 }
 
-function getCoinMetadata($coinId) {
-    static $metadata = null;
-    if ($metadata === null) {
+function getRenditionsIndex() {
+    static $index = null;
+    if ($index === null) {
+        $index = [];
+        $file = RENDITIONS_DIR . '/index.json';
+        if (file_exists($file)) {
+            $data = json_decode(file_get_contents($file), true);
+            $index = $data['images'] ?? [];
+        }
+    }
+    return $index;
+}
+
+// URLs JPEG/WebP d'une déclinaison (thumb, medium, full) d'une photo d'une pièce
+// (entrée de getCoin), avec repli sur la photo d'origine
+function getRendition($photo, $variant) {
+    $files = $photo['renditions'][$variant] ?? null;
+    if (!$files) {
+        return ['jpg' => PICTURES_URL . '/' . $photo['path'], 'webp' => null];
+    }
+    return [
+        'jpg' => RENDITIONS_URL . '/' . $files['jpg'],
+        'webp' => isset($files['webp']) ? RENDITIONS_URL . '/' . $files['webp'] : null,
+    ];
+}
+
+// Attributs width/height d'une photo quand ses dimensions sont connues (réserve la place avant chargement)
+function imageSizeAttributes($photo) {
+    if (empty($photo['width']) || empty($photo['height'])) {
+        return '';
+    }
+    return sprintf('width="%d" height="%d"', $photo['width'], $photo['height']);
+}
+
+// Index précalculé
+
+function readJsonFile($file) {
+    $data = @file_get_contents($file);
+    return $data === false ? null : json_decode($data, true);
+}
+
+function writeJsonFile($file, $data) {
+    $tmp = $file . '.' . getmypid() . '.tmp';
+    if (file_put_contents($tmp, json_encode($data, JSON_UNESCAPED_UNICODE | JSON_UNESCAPED_SLASHES)) === false) {
+        return false;
+    }
+    return rename($tmp, $file);
+}
+
+// Fichiers dont l'index est dérivé (mêmes noms que dans scripts/gallery_index.py)
+function indexSources() {
+    return [
+        'sessions' => SESSIONS_FILE,
+        'metadata' => METADATA_FILE,
+        'renditions' => RENDITIONS_DIR . '/index.json',
+    ];
+}
+
+// Signature [taille, date en s] d'une source, null si elle n'existe pas (le manifeste
+// note la date en ns; PHP n'a que la seconde)
+function sourceSignature($file) {
+    clearstatcache(true, $file);
+    return file_exists($file) ? [filesize($file), filemtime($file)] : null;
+}
+
+// Vrai si une source a changé depuis la construction de l'index (JSON édité à la main,
+// nouvelle séance...) ou si le manifeste ne dit pas d'où il vient
+function isIndexStale($manifest) {
+    if (!isset($manifest['sources'])) {
+        return true;
+    }
+    foreach (indexSources() as $name => $file) {
+        $recorded = $manifest['sources'][$name] ?? null;
+        $current = sourceSignature($file);
+        if ($recorded === null || $current === null) {
+            if ($recorded !== $current) {
+                return true;
+            }
+            continue;
+        }
+        if ($current[0] !== $recorded[0] || $current[1] !== intdiv($recorded[1], 1000000000)) {
+            return true;
+        }
+    }
+    return false;
+}
+
+// Manifeste de l'index (nombre de pièces, séances, valeurs des filtres), null sans index.
+// Un index périmé est ignoré: les pages repartent des sources (plus lent) jusqu'à sa mise à jour
+function getIndexManifest() {
+    static $manifest = false;
+    if ($manifest === false) {
+        $manifest = readJsonFile(INDEX_DIR . '/manifest.json');
+        if ($manifest && isIndexStale($manifest)) {
+            error_log('Galerie: index périmé (sources modifiées depuis sa construction), '
+                . 'lancer python scripts/gallery_index.py');
+            $manifest = null;
+        }
+    }
+    return $manifest;
+}
+
+function shardFile($coinId, $manifest) {
+    return INDEX_DIR . sprintf('/coins/%05d.json', intdiv($coinId, $manifest['shard_size']));
+}
+
+function facetFile($field, $value) {
+    return INDEX_DIR . "/facets/$field/" . substr(sha1($value), 0, 16) . '.json';
+}
+
+// Libellé affiché d'une pièce (même règle que scripts/gallery_index.py)
+function coinLabel($coinId, $meta) {
+    if (!empty($meta['country']) && !empty($meta['value'])) {
+        return "{$meta['country']} - {$meta['value']}";
+    }
+    return 'Pièce #' . ($coinId + 1);
+}
+
+function facetValue($meta, $field) {
+    $value = $meta[$field] ?? null;
+    return $value === null || $value === '' ? null : (string)$value;
+}
+
+// Sans index: toutes les pièces au format de l'index, calculées depuis les sources
+function getLegacyEntries() {
+    static $entries = null;
+    if ($entries === null) {
+        $entries = [];
         $metadata = getMetadata();
+        $renditions = getRenditionsIndex();
+        foreach (getCoins() as $id => $images) {
+            $photos = [];
+            foreach ($images as $image) {
+                $rendition = $renditions[$image] ?? [];
+                $photos[] = [
+                    'path' => $image,
+                    'width' => $rendition['width'] ?? null,
+                    'height' => $rendition['height'] ?? null,
+                    'renditions' => $rendition['renditions'] ?? null,
+                ];
+            }
+            $meta = $metadata[$id] ?? null;
+            $entries[$id] = [
+                'id' => $id,
+                'session' => explode('/', $images[0])[0],
+                'label' => coinLabel($id, $meta),
+                'photos' => $photos,
+                'meta' => $meta,
+            ];
+        }
     }
-    return $metadata[$coinId] ?? null;
+    return $entries;
+}
+
+function getCoinCount() {
+    $manifest = getIndexManifest();
+    return $manifest ? $manifest['count'] : count(getLegacyEntries());
+}
+
+// Pièce: id, séance, libellé, photos (chemin, dimensions, déclinaisons) et métadonnées, ou null
+function getCoin($coinId) {
+    static $shards = [];
+    $manifest = getIndexManifest();
+    if (!$manifest) {
+        return getLegacyEntries()[$coinId] ?? null;
+    }
+    if ($coinId < 0 || $coinId >= $manifest['count']) {
+        return null;
+    }
+    $file = shardFile($coinId, $manifest);
+    if (!isset($shards[$file])) {
+        $shards[$file] = readJsonFile($file) ?? [];
+    }
+    return $shards[$file][$coinId % $manifest['shard_size']] ?? null;
+}
+
+// Valeurs proposées par les filtres: ['country' => [...], 'currency' => [...], 'year' => [...], 'session' => [...]]
+function getFacets() {
+    $manifest = getIndexManifest();
+    $facets = array_fill_keys(FACETS, []);
+    if ($manifest) {
+        foreach (FACETS as $field) {
+            // Clés numériques (années) converties en entiers par json_decode
+            $facets[$field] = array_map('strval', array_keys($manifest['facets'][$field] ?? []));
+        }
+        $facets['session'] = array_column($manifest['sessions'], 'name');
+    } else {
+        foreach (getLegacyEntries() as $entry) {
+            foreach (FACETS as $field) {
+                $value = facetValue($entry['meta'], $field);
+                if ($value !== null) {
+                    $facets[$field][$value] = true;
+                }
+            }
+            $facets['session'][$entry['session']] = true;
+        }
+        $facets = array_map('array_keys', $facets);
+    }
+    return $facets;
+}
+
+// Ids des pièces d'une valeur de filtre (croissants)
+function getFacetIds($field, $value) {
+    $manifest = getIndexManifest();
+    if ($field === 'session') {
+        $ids = [];
+        foreach ($manifest['sessions'] as $session) {
+            if ($session['name'] === $value) {
+                foreach ($session['ids'] as [$first, $last]) {
+                    $ids = array_merge($ids, range($first, $last));
+                }
+            }
+        }
+        return $ids;
+    }
+    return readJsonFile(facetFile($field, $value)) ?? [];
+}
+
+// Une page de pièces répondant aux filtres ([champ => valeur]): [nombre total, pièces de la page]
+function findCoins($filters, $offset, $limit) {
+    $filters = array_filter($filters, fn($value) => $value !== '' && $value !== null);
+    $manifest = getIndexManifest();
+
+    if (!$manifest) {
+        $matches = array_values(array_filter(getLegacyEntries(), function ($entry) use ($filters) {
+            foreach ($filters as $field => $value) {
+                $actual = $field === 'session' ? $entry['session'] : facetValue($entry['meta'], $field);
+                if ($actual !== (string)$value) {
+                    return false;
+                }
+            }
+            return true;
+        }));
+        return [count($matches), array_slice($matches, $offset, $limit)];
+    }
+
+    if (!$filters) {
+        $total = $manifest['count'];
+        $ids = $offset < $total ? range($offset, min($offset + $limit, $total) - 1) : [];
+    } else {
+        $ids = null;
+        foreach ($filters as $field => $value) {
+            $facetIds = getFacetIds($field, (string)$value);
+            $ids = $ids === null ? $facetIds : array_values(array_intersect($ids, $facetIds));
+        }
+        $total = count($ids);
+        $ids = array_slice($ids, $offset, $limit);
+    }
+    return [$total, array_values(array_filter(array_map('getCoin', $ids)))];
+}
+
+// Reporte dans l'index une modification de métadonnées faite depuis la galerie (fragment de la
+// pièce, fichiers et compteurs des filtres), en attendant la prochaine mise à jour par
+// scripts/gallery_index.py qui recalcule l'ensemble. $manifest est celui lu avant l'écriture
+// du JSON: l'index n'est mis à jour que s'il était à jour
+function updateIndexedCoin($coin, $manifest) {
+    if (!$manifest) {
+        return;
+    }
+    $coinId = $coin['id'];
+    $file = shardFile($coinId, $manifest);
+    $shard = readJsonFile($file);
+    $slot = $coinId % $manifest['shard_size'];
+    if (!isset($shard[$slot])) {
+        return;
+    }
+    $previous = $shard[$slot]['meta'];
+    $shard[$slot]['meta'] = $coin;
+    $shard[$slot]['label'] = coinLabel($coinId, $coin);
+
+    foreach (FACETS as $field) {
+        $before = facetValue($previous, $field);
+        $after = facetValue($coin, $field);
+        if ($before === $after) {
+            continue;
+        }
+        $counts = $manifest['facets'][$field] ?? [];
+        if ($before !== null) {
+            $ids = array_values(array_diff(readJsonFile(facetFile($field, $before)) ?? [], [$coinId]));
+            if ($ids) {
+                writeJsonFile(facetFile($field, $before), $ids);
+                $counts[$before] = count($ids);
+            } else {
+                @unlink(facetFile($field, $before));
+                unset($counts[$before]);
+            }
+        }
+        if ($after !== null) {
+            $ids = readJsonFile(facetFile($field, $after)) ?? [];
+            $ids[] = $coinId;
+            $ids = array_values(array_unique($ids));
+            sort($ids);
+            @mkdir(dirname(facetFile($field, $after)), 0755, true);
+            writeJsonFile(facetFile($field, $after), $ids);
+            $counts[$after] = count($ids);
+        }
+        ksort($counts, SORT_STRING);
+        $manifest['facets'][$field] = $counts;
+    }
+    foreach (FACETS as $field) {
+        // Rester un objet JSON même vide ou à clés numériques
+        $manifest['facets'][$field] = (object)($manifest['facets'][$field] ?? []);
+    }
+
+    // Le JSON vient d'être réécrit avec cette pièce: l'index reste à jour
+    $signature = sourceSignature(METADATA_FILE);
+    $manifest['sources']['metadata'] = [$signature[0], $signature[1] * 1000000000];
+
+    writeJsonFile($file, $shard);
+    writeJsonFile(INDEX_DIR . '/manifest.json', $manifest);
 }
@@ -179,6 +179,8 @@ if ($action === 'update') {
     }
 
     $metadata = getMetadata();
+    // Fraîcheur de l'index évaluée avant d'écrire le JSON (voir updateIndexedCoin)
+    $manifest = getIndexManifest();
 
     if (isset($metadata[$coinId])) {
         // Vérifier si modification effective
@@ -212,6 +214,7 @@ if ($action === 'update') {
                     $response['message'] = 'Erreur de sauvegarde';
                     http_response_code(500);
                 } else {
+                    updateIndexedCoin($metadata[$coinId], $manifest);
                     $response['success'] = true;
                     $response['message'] = 'Métadonnées mises à jour';
                 }
@@ -2,30 +2,12 @@
 require_once 'config.php';
 require_once 'security_headers.php';
 
-// Récupérer tous les coins et métadonnées
-$coins = getCoins();
-$allMetadata = getMetadata();
-
-// Extraire les valeurs uniques pour les filtres
-$countries = [];
-$currencies = [];
-$years = [];
-
-foreach ($allMetadata as $meta) {
-    if (isset($meta['country']) && $meta['country']) {
-        $countries[$meta['country']] = true;
-    }
-    if (isset($meta['currency']) && $meta['currency']) {
-        $currencies[$meta['currency']] = true;
-    }
-    if (isset($meta['year']) && $meta['year']) {
-        $years[$meta['year']] = true;
-    }
-}
-
-$countries = array_keys($countries);
-$currencies = array_keys($currencies);
-$years = array_keys($years);
+// Valeurs des filtres (manifeste de l'index, sans lire les pièces)
+$facets = getFacets();
+$countries = $facets['country'];
+$currencies = $facets['currency'];
+$years = $facets['year'];
+$sessions = $facets['session'];
 
 sort($countries);
 sort($currencies);
@@ -35,6 +17,7 @@ rsort($years); // Années décroissantes
 $filterCountry = '';
 $filterCurrency = '';
 $filterYear = '';
+$filterSession = '';
 
 if (isset($_GET['country']) && in_array($_GET['country'], $countries, true)) {
     $filterCountry = $_GET['country'];
@@ -45,6 +28,25 @@ if (isset($_GET['currency']) && in_array($_GET['currency'], $currencies, true))
 if (isset($_GET['year']) && in_array($_GET['year'], $years, true)) {
     $filterYear = $_GET['year'];
 }
+if (isset($_GET['session']) && in_array($_GET['session'], $sessions, true)) {
+    $filterSession = $_GET['session'];
+}
+
+// Page demandée: seules ses pièces sont lues
+$filters = ['country' => $filterCountry, 'currency' => $filterCurrency, 'year' => $filterYear, 'session' => $filterSession];
+$page = max(0, intval($_GET['page'] ?? 1) - 1);
+[$displayedCount, $pageCoins] = findCoins($filters, $page * PAGE_SIZE, PAGE_SIZE);
+$pageCount = max(1, (int)ceil($displayedCount / PAGE_SIZE));
+$totalCoins = getCoinCount();
+
+// Lien vers une autre page avec les mêmes filtres
+function pageUrl($filters, $page) {
+    $params = array_filter($filters, fn($value) => $value !== '');
+    if ($page > 0) {
+        $params['page'] = $page + 1;
+    }
+    return $params ? '?' . http_build_query($params) : 'index.php';
+}
 ?>
 <!DOCTYPE html>
 <html lang="fr">
@@ -99,6 +101,9 @@ if (isset($_GET['year']) && in_array($_GET['year'], $years, true)) {
         .coin-info h3 { font-size: 14px; color: #999; }
         .coin-info p { font-size: 12px; color: #777; margin-top: 5px; }
         .no-results { text-align: center; color: #999; padding: 40px; }
+        .pagination { display: flex; justify-content: center; align-items: center; gap: 20px; margin: 30px auto; color: #999; font-size: 14px; }
+        .pagination a { color: #fff; text-decoration: none; padding: 8px 16px; background: #3a3a3a; border-radius: 5px; }
+        .pagination a:hover { background: #4a4a4a; }
     </style>
 </head>
 <body>
@@ -141,39 +146,39 @@ if (isset($_GET['year']) && in_array($_GET['year'], $years, true)) {
             </select>
         </div>
 
+        <div>
+            <label for="session">Séance:</label>
+            <select id="session" name="session">
+                <option value="">Toutes</option>
+                <?php foreach ($sessions as $session): ?>
+                    <option value="<?= htmlspecialchars($session) ?>" <?= $filterSession === $session ? 'selected' : '' ?>>
+                        <?= htmlspecialchars($session) ?>
+                    </option>
+                <?php endforeach; ?>
+            </select>
+        </div>
+
         <button onclick="resetFilters()">Réinitialiser</button>
 
         <span class="filter-count" id="filterCount"></span>
     </div>
 
     <div class="grid" id="coinGrid">
-        <?php
-        $displayedCount = 0;
-        foreach ($coins as $index => $coinImages):
-            $meta = getCoinMetadata($index);
-
-            // Appliquer les filtres
-            $show = true;
-            if ($filterCountry && (!$meta || ($meta['country'] ?? '') !== $filterCountry)) {
-                $show = false;
-            }
-            if ($filterCurrency && (!$meta || ($meta['currency'] ?? '') !== $filterCurrency)) {
-                $show = false;
-            }
-            if ($filterYear && (!$meta || ($meta['year'] ?? '') !== $filterYear)) {
-                $show = false;
-            }
-
-            if (!$show) continue;
-            $displayedCount++;
-
-            $label = $meta ? "{$meta['country']} - {$meta['value']}" : "Pièce #" . ($index + 1);
+        <?php foreach ($pageCoins as $coin):
+            $meta = $coin['meta'];
+            $label = $coin['label'];
         ?>
-            <a href="coin.php?id=<?= $index ?>" class="coin-card">
-                <img src="<?= PICTURES_URL . '/' . $coinImages[0] ?>" alt="<?= htmlspecialchars($label) ?>">
+            <a href="coin.php?id=<?= $coin['id'] ?>" class="coin-card">
+                <?php $thumb = getRendition($coin['photos'][0], 'thumb'); ?>
+                <picture>
+                    <?php if ($thumb['webp']): ?>
+                        <source srcset="<?= htmlspecialchars($thumb['webp']) ?>" type="image/webp">
+                    <?php endif; ?>
+                    <img src="<?= htmlspecialchars($thumb['jpg']) ?>" alt="<?= htmlspecialchars($label) ?>" loading="lazy">
+                </picture>
                 <div class="coin-info">
                     <h3><?= htmlspecialchars($label) ?></h3>
-                    <?php if ($meta && $meta['year']): ?>
+                    <?php if ($meta && !empty($meta['year'])): ?>
                         <p><?= htmlspecialchars($meta['year']) ?></p>
                     <?php endif; ?>
                 </div>
@@ -185,16 +190,30 @@ if (isset($_GET['year']) && in_array($_GET['year'], $years, true)) {
         <?php endif; ?>
     </div>
 
+    <?php if ($pageCount > 1): ?>
+        <nav class="pagination">
+            <?php if ($page > 0): ?>
+                <a href="<?= htmlspecialchars(pageUrl($filters, $page - 1)) ?>">‹ Précédente</a>
+            <?php endif; ?>
+            <span>Page <?= $page + 1 ?> / <?= $pageCount ?></span>
+            <?php if ($page < $pageCount - 1): ?>
+                <a href="<?= htmlspecialchars(pageUrl($filters, $page + 1)) ?>">Suivante ›</a>
+            <?php endif; ?>
+        </nav>
+    <?php endif; ?>
+
     <script>
         function updateFilters() {
             const country = document.getElementById('country').value;
             const currency = document.getElementById('currency').value;
             const year = document.getElementById('year').value;
+            const session = document.getElementById('session').value;
 
             const params = new URLSearchParams();
             if (country) params.set('country', country);
             if (currency) params.set('currency', currency);
             if (year) params.set('year', year);
+            if (session) params.set('session', session);
 
             const url = params.toString() ? '?' + params.toString() : 'index.php';
             window.location.href = url;
@@ -207,10 +226,11 @@ if (isset($_GET['year']) && in_array($_GET['year'], $years, true)) {
         document.getElementById('country').addEventListener('change', updateFilters);
         document.getElementById('currency').addEventListener('change', updateFilters);
         document.getElementById('year').addEventListener('change', updateFilters);
+        document.getElementById('session').addEventListener('change', updateFilters);
 
         // Afficher le nombre de résultats
         const count = <?= $displayedCount ?>;
-        const total = <?= count($coins) ?>;
+        const total = <?= $totalCoins ?>;
         const countText = count === total
             ? `${total} pièce${total > 1 ? 's' : ''}`
             : `${count} / ${total} pièce${total > 1 ? 's' : ''}`;
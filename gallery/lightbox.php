@@ -5,16 +5,15 @@ require_once 'security_headers.php';
 $coinId = intval($_GET['coin'] ?? 0);
 $photoIndex = intval($_GET['photo'] ?? 0);
 
-$coins = getCoins();
-$totalCoins = count($coins);
+$totalCoins = getCoinCount();
+$coin = getCoin($coinId);
 
-if ($coinId < 0 || $coinId >= $totalCoins) {
+if (!$coin || !isset($coin['photos'][$photoIndex])) {
     header('Location: index.php');
     exit;
 }
 
-$coinImages = $coins[$coinId];
-$photosPerCoin = count($coinImages);
+$photosPerCoin = count($coin['photos']);
 
 // Calculer navigation
 $prevPhoto = null;
@@ -25,7 +24,7 @@ if ($photoIndex > 0) {
     $prevPhoto = ['coin' => $coinId, 'photo' => $photoIndex - 1];
 } elseif ($coinId > 0) {
     // Dernière photo de la pièce précédente
-    $prevPhoto = ['coin' => $coinId - 1, 'photo' => count($coins[$coinId - 1]) - 1];
+    $prevPhoto = ['coin' => $coinId - 1, 'photo' => count(getCoin($coinId - 1)['photos'] ?? [1]) - 1];
 }
 
 if ($photoIndex < $photosPerCoin - 1) {
@@ -36,7 +35,7 @@ if ($photoIndex < $photosPerCoin - 1) {
     $nextPhoto = ['coin' => $coinId + 1, 'photo' => 0];
 }
 
-$currentImage = $coinImages[$photoIndex];
+$currentPhoto = $coin['photos'][$photoIndex];
 ?>
 <!DOCTYPE html>
 <html lang="fr">
@@ -65,6 +64,8 @@ $currentImage = $coinImages[$photoIndex];
             justify-content: center;
         }
         .lightbox img {
+            width: auto;
+            height: auto;
             max-width: 95%;
             max-height: 95vh;
             object-fit: contain;
@@ -118,7 +119,13 @@ $currentImage = $coinImages[$photoIndex];
     <div class="lightbox">
         <a href="coin.php?id=<?= $coinId ?>" class="close">×</a>
 
-        <img src="<?= PICTURES_URL . '/' . $currentImage ?>" alt="Pièce <?= $coinId + 1 ?>">
+        <?php $full = getRendition($currentPhoto, 'full'); ?>
+        <picture>
+            <?php if ($full['webp']): ?>
+                <source srcset="<?= htmlspecialchars($full['webp']) ?>" type="image/webp">
+            <?php endif; ?>
+            <img src="<?= htmlspecialchars($full['jpg']) ?>" <?= imageSizeAttributes($currentPhoto) ?> alt="Pièce <?= $coinId + 1 ?>">
+        </picture>
 
         <?php if ($prevPhoto): ?>
             <a href="lightbox.php?coin=<?= $prevPhoto['coin'] ?>&photo=<?= $prevPhoto['photo'] ?>" class="nav-arrow prev">‹</a>
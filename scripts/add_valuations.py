@@ -3,17 +3,29 @@
 """
 Script interactif pour ajouter des cotations aux pièces de monnaie
 Ouvre automatiquement Numista pour recherche et permet la saisie manuelle
+
+Mode par lots (sans saisie):
+    python scripts/add_valuations.py --export a_coter.csv --parts 3
+    python scripts/add_valuations.py --import a_coter-1.csv a_coter-2.csv a_coter-3.csv
+
+L'export liste les pièces sans cotation avec l'URL de recherche Numista
+prête à ouvrir et les colonnes de cotation à remplir. L'import (CSV ou
+JSONL, par id de pièce) valide tous les enregistrements d'abord puis les
+applique en une seule transaction et un seul export: une erreur n'applique
+rien.
 """
 
+import re
+import csv
+import sys
 import json
 import webbrowser
 import urllib.parse
 from datetime import datetime
 from pathlib import Path
 
-# Chemins
-METADATA_FILE = Path(__file__).parent.parent / "gallery" / "coins_metadata.json"
-BACKUP_DIR = Path(__file__).parent.parent / "gallery" / "backups"
+from metadata_store import MetadataStore
+from gallery_index import refresh_index
 
 # Sources de cotation disponibles
 SOURCES = {
@@ -23,34 +35,34 @@ SOURCES = {
     "4": {"name": "Autre source fiable", "base_url": ""}
 }
 
+# Schéma du champ valuation (voir README_COTATIONS.md)
+VALUATION_FIELDS = ("price", "currency", "condition", "source_name", "source_url", "notes", "last_updated")
+REQUIRED_FIELDS = ("price", "currency", "condition", "source_name", "source_url", "last_updated")
+CONDITIONS = ("TB", "TTB", "SUP", "SPL", "FDC")
+PRICE = re.compile(r"^\d+(?:[.,]\d+)?(?:\s*-\s*\d+(?:[.,]\d+)?)?$")
+CURRENCY = re.compile(r"^[A-Z]{3}$")
+
+# Colonnes descriptives de l'export CSV (ignorées à l'import)
+COIN_COLUMNS = ("country", "currency", "value", "year")
+EXPORT_COLUMNS = ("id",) + tuple(f"coin_{field}" for field in COIN_COLUMNS) + ("numista_url",) + VALUATION_FIELDS
+
+# Valeurs pré-remplies dans l'export
+EXPORT_DEFAULTS = {"currency": "EUR", "source_name": "Numista"}
+
 def load_metadata():
-    """Charge les métadonnées des pièces"""
-    with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def save_metadata(data):
-    """Sauvegarde les métadonnées avec backup"""
-    # Créer le dossier de backup si nécessaire
-    BACKUP_DIR.mkdir(exist_ok=True)
-
-    # Backup de l'ancien fichier
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_file = BACKUP_DIR / f"coins_metadata_backup_{timestamp}.json"
-
-    if METADATA_FILE.exists():
-        with open(METADATA_FILE, 'r', encoding='utf-8') as f:
-            backup_data = f.read()
-        with open(backup_file, 'w', encoding='utf-8') as f:
-            f.write(backup_data)
-        print(f"✓ Backup créé: {backup_file.name}")
-
-    # Sauvegarde du nouveau fichier
-    with open(METADATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=4)
+    """Ouvre la base des métadonnées (réimporte les modifications faites côté galerie)"""
+    return MetadataStore()
+
+def save_metadata(store):
+    """Exporte la base vers le JSON de la galerie (l'historique est tenu par la base)"""
+    store.export_json()
+    refresh_index()
     print(f"✓ Métadonnées sauvegardées")
+    if store.history:
+        print(f"✓ Historique: {store.history.path.relative_to(Path(__file__).parent.parent)}")
 
-def open_search(coin):
-    """Ouvre une recherche automatique sur Numista"""
+def numista_search(coin):
+    """Requête et URL de recherche Numista pré-remplies pour une pièce"""
     # Construire la requête de recherche
     search_parts = []
 
@@ -67,10 +79,14 @@ def open_search(coin):
     encoded_query = urllib.parse.quote(search_query)
 
     # URL de recherche Numista
-    search_url = f"https://fr.numista.com/catalogue/index.php?r={encoded_query}&cat=y"
+    return search_query, f"https://fr.numista.com/catalogue/index.php?r={encoded_query}&cat=y"
+
+def open_search(coin):
+    """Ouvre une recherche automatique sur Numista"""
+    query, search_url = numista_search(coin)
 
     print(f"\n🔍 Ouverture de la recherche dans le navigateur...")
-    print(f"   Requête: {search_query}")
+    print(f"   Requête: {query}")
     webbrowser.open(search_url)
 
 def display_coin(coin, index, total):
@@ -166,8 +182,224 @@ def get_valuation_data(coin):
 
     return valuation
 
+def read_records(path):
+    """Enregistrements (numéro de ligne, champs) d'un fichier CSV ou JSONL"""
+    path = Path(path)
+    if path.suffix.lower() in (".jsonl", ".ndjson"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    try:
+                        record = json.loads(line)
+                    except ValueError as e:
+                        record = e
+                    yield line_number, record
+        return
+
+    # utf-8-sig et séparateur détecté: fichiers réenregistrés par un tableur (« ; » en français)
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        for row in reader:
+            yield reader.line_num, row
+
+def validate_valuation(fields, today):
+    """
+    Valide une cotation selon le schéma documenté
+
+    Returns:
+        Tuple (cotation normalisée ou None, liste d'erreurs)
+    """
+    unknown = sorted(set(fields) - set(VALUATION_FIELDS))
+    errors = [f"champ inconnu '{name}'" for name in unknown]
+    values = {name: str(fields.get(name) or "").strip() for name in VALUATION_FIELDS}
+    values["currency"] = values["currency"].upper()
+    values["condition"] = values["condition"].upper()
+    values["last_updated"] = values["last_updated"] or today
+
+    for name in REQUIRED_FIELDS:
+        if not values[name]:
+            errors.append(f"{name} manquant")
+    if values["price"] and not PRICE.match(values["price"]):
+        errors.append(f"prix invalide '{values['price']}' (ex: '2.50' ou '1-3')")
+    if values["currency"] and not CURRENCY.match(values["currency"]):
+        errors.append(f"devise invalide '{values['currency']}' (code ISO: EUR, USD...)")
+    if values["condition"] and values["condition"] not in CONDITIONS:
+        errors.append(f"état invalide '{values['condition']}' ({', '.join(CONDITIONS)})")
+    url = urllib.parse.urlparse(values["source_url"])
+    if values["source_url"] and (url.scheme not in ("http", "https") or not url.netloc):
+        errors.append(f"URL invalide '{values['source_url']}'")
+    try:
+        datetime.strptime(values["last_updated"], "%Y-%m-%d")
+    except ValueError:
+        errors.append(f"date invalide '{values['last_updated']}' (YYYY-MM-DD)")
+
+    if errors:
+        return None, errors
+    # Ordre des champs du schéma, notes seulement si renseignées
+    return {name: values[name] for name in VALUATION_FIELDS if values[name] or name != "notes"}, []
+
+def load_bulk(paths, known_ids):
+    """
+    Lit et valide en une passe les cotations de fichiers CSV/JSONL
+
+    Une ligne sans prix ni URL (pièce pas encore cotée dans un export) est
+    ignorée; toute autre ligne doit être une cotation complète et valide.
+
+    Returns:
+        Tuple ({id: cotation}, nombre de lignes ignorées, liste d'erreurs)
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    valuations = {}
+    origins = {}
+    skipped = 0
+    errors = []
+
+    for path in paths:
+        for line_number, record in read_records(path):
+            where = f"{Path(path).name}:{line_number}"
+            if isinstance(record, Exception) or not isinstance(record, dict):
+                errors.append(f"{where}: enregistrement illisible ({record})")
+                continue
+            # JSONL: {"id": N, "valuation": {...}} ou champs à plat; CSV: colonnes à plat
+            fields = record.get("valuation") if "valuation" in record else {
+                name: value for name, value in record.items() if name in VALUATION_FIELDS
+            }
+            fields = fields or {}
+            if not isinstance(fields, dict):
+                errors.append(f"{where}: valuation doit être un objet")
+                continue
+            if not str(fields.get("price") or "").strip() and not str(fields.get("source_url") or "").strip():
+                skipped += 1
+                continue
+
+            try:
+                coin_id = int(str(record.get("id", "")).strip())
+            except ValueError:
+                errors.append(f"{where}: id invalide '{record.get('id')}'")
+                continue
+            where = f"{where} (id {coin_id})"
+            if coin_id not in known_ids:
+                errors.append(f"{where}: pièce inconnue")
+                continue
+            if coin_id in origins:
+                errors.append(f"{where}: pièce déjà cotée en {origins[coin_id]}")
+                continue
+
+            valuation, problems = validate_valuation(fields, today)
+            errors.extend(f"{where}: {problem}" for problem in problems)
+            if valuation:
+                valuations[coin_id] = valuation
+                origins[coin_id] = where.split(" ")[0]
+
+    return valuations, skipped, errors
+
+def import_valuations(store, paths, replace=False, dry_run=False):
+    """Importe des cotations en une seule transaction et un seul export (rien si une erreur)"""
+    valuations, skipped, errors = load_bulk(paths, store.ids())
+    print(f"✓ {len(valuations)} cotations lues, {skipped} lignes sans cotation ignorées")
+    if errors:
+        print(f"❌ {len(errors)} erreurs, aucune cotation importée:")
+        for error in errors:
+            print(f"   {error}")
+        return 1
+
+    coins = []
+    kept = 0
+    for coin_id, valuation in sorted(valuations.items()):
+        coin = store.get(coin_id)
+        if coin.get("valuation") == valuation:
+            continue
+        if coin.get("valuation") and not replace:
+            kept += 1
+            continue
+        coin["valuation"] = valuation
+        coins.append(coin)
+    if kept:
+        print(f"⚠️  {kept} pièces déjà cotées conservées (--replace pour les remplacer)")
+
+    if dry_run:
+        print(f"🔍 Simulation: {len(coins)} pièces seraient mises à jour")
+        return 0
+    if not coins:
+        print("✓ Aucune modification effectuée")
+        return 0
+
+    store.put_many(coins)
+    save_metadata(store)
+    print(f"✅ {len(coins)} cotations importées")
+    return 0
+
+def export_row(coin):
+    """Ligne d'export d'une pièce: description, recherche Numista et cotation à remplir"""
+    row = {"id": coin["id"], "numista_url": numista_search(coin)[1]}
+    for field in COIN_COLUMNS:
+        row[f"coin_{field}"] = coin.get(field) or ""
+    for field in VALUATION_FIELDS:
+        row[field] = EXPORT_DEFAULTS.get(field, "")
+    return row
+
+def export_valuations(store, path, parts=1):
+    """Exporte les pièces sans cotation en un ou plusieurs fichiers CSV/JSONL à compléter"""
+    path = Path(path)
+    coins = [coin for coin in store.all() if not coin.get("valuation")]
+    if not coins:
+        print("✓ Toutes les pièces ont une cotation")
+        return 0
+
+    parts = max(1, min(parts, len(coins)))
+    # Parts d'ids consécutifs: une personne garde les pièces d'une même séance
+    size = -(-len(coins) // parts)
+    for number in range(parts):
+        chunk = coins[number * size:(number + 1) * size]
+        target = path if parts == 1 else path.with_name(f"{path.stem}-{number + 1}{path.suffix}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(target.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            if path.suffix.lower() in (".jsonl", ".ndjson"):
+                for coin in chunk:
+                    row = export_row(coin)
+                    record = {"id": row["id"], "coin": {field: coin.get(field) for field in COIN_COLUMNS},
+                              "numista_url": row["numista_url"],
+                              "valuation": {field: row[field] for field in VALUATION_FIELDS}}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            else:
+                writer = csv.DictWriter(f, fieldnames=EXPORT_COLUMNS)
+                writer.writeheader()
+                writer.writerows(export_row(coin) for coin in chunk)
+        tmp_path.replace(target)
+        print(f"📄 {target}: {len(chunk)} pièces (ids {chunk[0]['id']}-{chunk[-1]['id']})")
+
+    print(f"✓ {len(coins)} pièces sans cotation exportées")
+    return 0
+
 def main():
     """Fonction principale"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Ajout de cotations aux pièces (interactif, ou par lots)")
+    parser.add_argument('--import', dest='import_files', nargs='+', metavar='FICHIER',
+                        help='Importer des cotations depuis des fichiers CSV ou JSONL (par id de pièce)')
+    parser.add_argument('--replace', action='store_true',
+                        help='Remplacer les cotations existantes lors de l\'import')
+    parser.add_argument('--dry-run', action='store_true', help='Valider l\'import sans rien enregistrer')
+    parser.add_argument('--export', metavar='FICHIER',
+                        help='Exporter les pièces sans cotation (CSV ou JSONL) avec l\'URL de recherche Numista')
+    parser.add_argument('--parts', type=int, default=1,
+                        help='Découper l\'export en N fichiers (FICHIER-1, FICHIER-2...)')
+    args = parser.parse_args()
+
+    if args.import_files or args.export:
+        with load_metadata() as store:
+            if args.export:
+                return export_valuations(store, args.export, args.parts)
+            return import_valuations(store, args.import_files, args.replace, args.dry_run)
+
     print("="*80)
     print("AJOUT DE COTATIONS AUX PIÈCES DE MONNAIE")
     print("="*80)
@@ -175,9 +407,13 @@ def main():
     print("Pour chaque pièce, le navigateur ouvrira une recherche Numista.")
     print("Vous pourrez alors copier l'URL et saisir la cotation.\n")
 
-    # Charger les métadonnées
-    coins = load_metadata()
-    print(f"✓ {len(coins)} pièces chargées")
+    # Ouvrir la base des métadonnées
+    with load_metadata() as store:
+        process_coins(store)
+
+def process_coins(store):
+    """Sélectionne les pièces puis saisit leurs cotations une par une"""
+    print(f"✓ {len(store)} pièces chargées")
 
     # Options de démarrage
     print("\nOptions:")
@@ -189,15 +425,16 @@ def main():
 
     # Filtrer les pièces selon le choix
     if choice == "1":
-        coins_to_process = coins
+        coins_to_process = store.all()
     elif choice == "2":
-        coins_to_process = [c for c in coins if not c.get('valuation')]
+        coins_to_process = [c for c in store.all() if not c.get('valuation')]
         print(f"✓ {len(coins_to_process)} pièces sans cotation")
     elif choice == "3":
         coin_id = input("ID de la pièce: ").strip()
         try:
             coin_id = int(coin_id)
-            coins_to_process = [c for c in coins if c['id'] == coin_id]
+            coin = store.get(coin_id)
+            coins_to_process = [coin] if coin else []
             if not coins_to_process:
                 print(f"❌ Aucune pièce avec l'ID {coin_id}")
                 return
@@ -212,62 +449,67 @@ def main():
         print("\n✓ Aucune pièce à traiter")
         return
 
-    # Traiter chaque pièce
+    # Traiter chaque pièce: chaque cotation confirmée est enregistrée aussitôt dans la base
     modified = False
 
-    for i, coin in enumerate(coins_to_process):
-        display_coin(coin, i, len(coins_to_process))
+    try:
+        for i, coin in enumerate(coins_to_process):
+            display_coin(coin, i, len(coins_to_process))
 
-        # Demander si on veut ouvrir la recherche
-        open_search_choice = input("\nOuvrir la recherche Numista ? (o/n) [o]: ").strip().lower()
-        if not open_search_choice or open_search_choice == 'o':
-            open_search(coin)
+            # Demander si on veut ouvrir la recherche
+            open_search_choice = input("\nOuvrir la recherche Numista ? (o/n) [o]: ").strip().lower()
+            if not open_search_choice or open_search_choice == 'o':
+                open_search(coin)
 
-        # Saisir les données de cotation
-        valuation = get_valuation_data(coin)
+            # Saisir les données de cotation
+            valuation = get_valuation_data(coin)
 
-        if valuation:
-            # Trouver la pièce dans la liste originale et mettre à jour
-            for original_coin in coins:
-                if original_coin['id'] == coin['id']:
-                    original_coin['valuation'] = valuation
+            if valuation:
+                # Mettre à jour la pièce par son id (une transaction)
+                if store.update(coin['id'], {'valuation': valuation}):
                     modified = True
                     print("\n✓ Cotation ajoutée à la pièce")
-                    break
 
-        # Demander si on continue
-        if i < len(coins_to_process) - 1:
-            continue_choice = input("\nContinuer avec la pièce suivante ? (o/n/s pour sauvegarder et quitter) [o]: ").strip().lower()
-            if continue_choice == 'n':
-                break
-            elif continue_choice == 's':
-                if modified:
-                    save_metadata(coins)
-                print("\n✓ Session terminée")
-                return
+            # Demander si on continue
+            if i < len(coins_to_process) - 1:
+                continue_choice = input("\nContinuer avec la pièce suivante ? (o/n/s pour sauvegarder et quitter) [o]: ").strip().lower()
+                if continue_choice == 'n':
+                    break
+                elif continue_choice == 's':
+                    if modified:
+                        save_metadata(store)
+                        modified = False
+                    print("\n✓ Session terminée")
+                    return
+    except BaseException:
+        # Exporter aussi en cas d'interruption: la galerie voit les cotations saisies
+        if modified:
+            save_metadata(store)
+        raise
 
     # Sauvegarder les modifications
     if modified:
         print("\n" + "="*80)
-        save_metadata(coins)
+        save_metadata(store)
         print("="*80)
         print(f"\n✓ Traitement terminé !")
 
         # Statistiques
-        coins_with_valuation = sum(1 for c in coins if c.get('valuation'))
+        total = len(store)
+        coins_with_valuation = store.count_with('valuation')
         print(f"\n📊 Statistiques:")
-        print(f"  Total pièces: {len(coins)}")
+        print(f"  Total pièces: {total}")
         print(f"  Avec cotation: {coins_with_valuation}")
-        print(f"  Sans cotation: {len(coins) - coins_with_valuation}")
+        print(f"  Sans cotation: {total - coins_with_valuation}")
     else:
         print("\n✓ Aucune modification effectuée")
 
 if __name__ == "__main__":
     try:
-        main()
+        sys.exit(main())
     except KeyboardInterrupt:
         print("\n\n⚠️  Interruption par l'utilisateur")
-        print("Les modifications non sauvegardées sont perdues")
+        print("Les cotations déjà confirmées ont été enregistrées")
     except Exception as e:
         print(f"\n❌ Erreur: {e}")
         import traceback
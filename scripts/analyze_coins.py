@@ -5,34 +5,54 @@ Extrait: pays, monnaie, valeur faciale, année, commentaires.
 """
 
 import os
+import re
 import json
-import base64
+import time
+import asyncio
+import unicodedata
+from datetime import date
+from collections import Counter
 from pathlib import Path
-from anthropic import Anthropic
+from anthropic import Anthropic, AsyncAnthropic, DefaultHttpxClient, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 
+from preprocess_images import encode_b64_stream, encode_prepared, DEFAULT_MAX_EDGE, DEFAULT_QUALITY
+from result_cache import ResultCache, prompt_version, CACHE_FILE, DEFAULT_MAX_BYTES as CACHE_MAX_BYTES
+from phash_index import PhashIndex, DUPLICATE_DISTANCE
+from metadata_store import MetadataStore, JSON_FILE as OUTPUT_FILE
+from sessions import SessionRegistry, PICTURES_ROOT
+from gallery_index import refresh_index
+from metrics import METRICS, model_prices
+from photo_quality import (Quality, assess, describe, report_row, update_report, REPORT_FILE, SCREEN_MODES,
+                           DEFAULT_SCREEN, MIN_SHARPNESS)
+from api_transport import RecordTransport, ReplayTransport, RECORDINGS_DIR
+
 # Charger les variables depuis .env
 load_dotenv()
 
 # Configuration
-PICTURES_DIR = Path("pictures/2025-11-02_19h15")
-OUTPUT_FILE = Path("gallery/coins_metadata.json")
+JOURNAL_FILE = Path("gallery/coins_metadata.journal.jsonl")
+JOURNAL_FSYNC_EVERY = 10
+BATCH_STATE_FILE = Path("gallery/coins_metadata.batch.json")
+# Sorties d'un rejeu (--replay): ni la base des métadonnées, ni la galerie, ni le cache
+# des résultats ne sont touchés
+REPLAY_DIR = Path(".cache/replay")
+# Limites d'un lot Message Batches (256 Mo max côté API, marge pour l'enveloppe JSON)
+BATCH_MAX_REQUESTS = 100_000
+BATCH_MAX_BYTES = 200 * 1024 * 1024
+BATCH_POLL_START = 10
+BATCH_POLL_MAX = 300
 API_KEY_ENV = "ANTHROPIC_API_KEY"
+MODEL = "claude-sonnet-4-20250514"
+MAX_TOKENS = 1000
+# Cascade (--cascade): premier passage sur le modèle rapide, escalade vers MODEL
+# des seules réponses invalides ou douteuses (cf. check_result)
+FAST_MODEL = "claude-haiku-4-5-20251001"
+TIERS = {"fast": FAST_MODEL, "strong": MODEL}
+# Champs ajoutés après l'analyse, conservés quand une pièce est réanalysée
+PRESERVED_FIELDS = ("valuation",)
 
-def encode_image(image_path):
-    """Encode image en base64 pour l'API."""
-    with open(image_path, "rb") as f:
-        return base64.standard_b64encode(f.read()).decode("utf-8")
-
-def analyze_coin(client, face_path, pile_path, coin_id):
-    """
-    Analyse une pièce (2 photos) via Claude API.
-    Retourne un dict avec les métadonnées.
-    """
-    face_b64 = encode_image(face_path)
-    pile_b64 = encode_image(pile_path)
-
-    prompt = """Analyse ces deux photos d'une pièce de monnaie (face et pile).
+PROMPT = """Analyse ces deux photos d'une pièce de monnaie (face et pile).
 
 CRITICAL: Examine EVERY inscription with maximum attention, especially dates. Take your time to read digits carefully.
 
@@ -55,10 +75,65 @@ Rules:
 - For notes, mention only remarkable elements
 - Answer ONLY with JSON, no additional text"""
 
-    message = client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1000,
-        messages=[{
+# Change automatiquement avec le texte du prompt: invalide le cache des résultats
+PROMPT_VERSION = prompt_version(PROMPT)
+
+# Préparation des images par défaut (cf. preprocess_images.py)
+DEFAULT_PREPROCESS = {"max_edge": DEFAULT_MAX_EDGE, "quality": DEFAULT_QUALITY}
+
+# Contrôles de cohérence des réponses du modèle rapide
+REQUIRED_FIELDS = ("country", "currency", "value")
+YEAR_PATTERN = re.compile(r"^\d{4}$")
+YEAR_MIN = 1600
+EURO_FIRST_YEAR = 1999
+# Monnaies plausibles par pays (nom français, radicaux sans accents); pays absent = pas de contrôle
+COUNTRY_CURRENCIES = {
+    "france": ("franc", "centime", "euro", "cent"),
+    "belgique": ("franc", "centime", "euro", "cent"),
+    "luxembourg": ("franc", "centime", "euro", "cent"),
+    "monaco": ("franc", "centime", "euro", "cent"),
+    "suisse": ("franc", "rappen", "centime"),
+    "italie": ("lir", "centesim", "euro", "cent"),
+    "vatican": ("lir", "euro", "cent"),
+    "saint-marin": ("lir", "euro", "cent"),
+    "espagne": ("peseta", "centimo", "euro", "cent"),
+    "portugal": ("escudo", "centavo", "euro", "cent"),
+    "allemagne": ("mark", "pfennig", "euro", "cent"),
+    "autriche": ("schilling", "groschen", "euro", "cent"),
+    "pays-bas": ("gulden", "florin", "cent", "euro"),
+    "grece": ("drachm", "lept", "euro", "cent"),
+    "irlande": ("pound", "livre", "penny", "pence", "euro", "cent"),
+    "finlande": ("markka", "penni", "euro", "cent"),
+    "royaume-uni": ("pound", "livre", "sterling", "penny", "pence", "shilling"),
+    "etats-unis": ("dollar", "cent"),
+    "canada": ("dollar", "cent"),
+    "japon": ("yen",),
+}
+
+def encode_image(image_path):
+    """Encode image en base64 pour l'API."""
+    with open(image_path, "rb") as f:
+        return encode_b64_stream(f)
+
+def encode_pair(face_path, pile_path, preprocess=None):
+    """
+    Encode les deux photos d'une pièce.
+
+    Args:
+        preprocess: None pour envoyer les JPEG tels quels, ou dict
+            {"max_edge", "quality"} pour recadrer et réduire avant envoi
+    """
+    if preprocess:
+        return (encode_prepared(face_path, **preprocess),
+                encode_prepared(pile_path, **preprocess))
+    return encode_image(face_path), encode_image(pile_path)
+
+def build_request(face_b64, pile_b64, model=MODEL):
+    """Construit les paramètres de l'appel Messages pour une pièce."""
+    return {
+        "model": model,
+        "max_tokens": MAX_TOKENS,
+        "messages": [{
             "role": "user",
             "content": [
                 {
@@ -79,13 +154,14 @@ Rules:
                 },
                 {
                     "type": "text",
-                    "text": prompt
+                    "text": PROMPT
                 }
             ]
         }]
-    )
+    }
 
-    # Parse la réponse JSON
+def parse_response(message, face_path, pile_path, coin_id):
+    """Extrait les métadonnées JSON de la réponse de Claude."""
     response_text = message.content[0].text.strip()
 
     # Nettoyer si Claude ajoute des backticks markdown
@@ -93,67 +169,871 @@ Rules:
         lines = response_text.split("\n")
         response_text = "\n".join(lines[1:-1]) if len(lines) > 2 else response_text
 
-    metadata = json.loads(response_text)
+    with METRICS.stage("parse", coin=coin_id):
+        metadata = json.loads(response_text)
+    metadata["id"] = coin_id
+    metadata["images"] = [face_path.name, pile_path.name]
+
+    return metadata
+
+def normalize_name(text):
+    """Nom en minuscules sans accents, pour comparer pays et monnaies."""
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    return text.lower().strip().replace(" ", "-")
+
+def check_result(metadata, today=None):
+    """
+    Contrôle une réponse du modèle rapide avant de la retenir.
+
+    Returns:
+        Liste des raisons d'escalader la pièce vers le modèle fort (vide si
+        la réponse est retenue)
+    """
+    reasons = [f"{field} manquant" for field in REQUIRED_FIELDS
+               if not isinstance(metadata.get(field), str) or not metadata[field].strip()]
+    if reasons:
+        return reasons
+
+    year = metadata.get("year")
+    if year is None:
+        reasons.append("année illisible")
+    elif not YEAR_PATTERN.match(str(year).strip()):
+        reasons.append(f"année mal formée ({year})")
+    elif not YEAR_MIN <= int(year) <= (today or date.today()).year:
+        reasons.append(f"année hors plage ({year})")
+
+    currency = normalize_name(metadata["currency"])
+    allowed = COUNTRY_CURRENCIES.get(normalize_name(metadata["country"]))
+    if allowed and not any(stem in currency for stem in allowed):
+        reasons.append(f"monnaie {metadata['currency']} improbable pour {metadata['country']}")
+    if "euro" in currency and year is not None and str(year).isdigit() and int(year) < EURO_FIRST_YEAR:
+        reasons.append(f"euro avant {EURO_FIRST_YEAR}")
+    return reasons
+
+def fast_result(message, face_path, pile_path, coin_id):
+    """
+    Réponse du premier niveau de la cascade.
+
+    Returns:
+        Tuple (métadonnées ou None, raisons d'escalade)
+    """
+    try:
+        metadata = parse_response(message, face_path, pile_path, coin_id)
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        return None, [f"réponse invalide ({e})"]
+    metadata["tier"] = "fast"
+    return metadata, check_result(metadata)
+
+def strong_result(message, face_path, pile_path, coin_id, reasons):
+    """Réponse du modèle fort pour une pièce escaladée, avec les raisons de l'escalade."""
+    metadata = parse_response(message, face_path, pile_path, coin_id)
+    metadata["tier"] = "strong"
+    metadata["escalation"] = reasons
+    return metadata
+
+def cascade_summary(results):
+    """Ligne de résumé de la cascade: pièces retenues par niveau et raisons d'escalade."""
+    tiers = Counter(r["tier"] for r in results if "tier" in r)
+    if not tiers:
+        return None
+    reasons = Counter(reason.split(" (")[0] for r in results for reason in r.get("escalation", ()))
+    line = f"🪜 Cascade: {tiers['fast']} pièces lues par le modèle rapide, {tiers['strong']} escaladées"
+    if reasons:
+        line += " (" + ", ".join(f"{reason}: {n}" for reason, n in reasons.most_common()) + ")"
+    return line
+
+def error_entry(face_path, pile_path, coin_id, error):
+    """Entrée de résultat pour une pièce dont l'analyse a échoué."""
+    return {
+        "id": coin_id,
+        "images": [face_path.name, pile_path.name],
+        "error": str(error)
+    }
+
+def format_result(metadata):
+    """Résumé d'une ligne d'un résultat d'analyse."""
+    if "error" in metadata:
+        return f"❌ Erreur: {metadata['error']}"
+    country = metadata.get("country", "?")
+    value = metadata.get("value", "?")
+    year = metadata.get("year", "?")
+    return f"✓ {country} - {value} ({year})"
+
+def cache_key_for(cache, face_path, pile_path, preprocess=None, cascade=False):
+    """Clé de cache d'une paire pour le modèle (ou la cascade), le prompt et la préparation courants."""
+    model = f"{FAST_MODEL}>{MODEL}" if cascade else MODEL
+    return cache.key_for(face_path, pile_path, model, PROMPT_VERSION, preprocess)
+
+def cached_result(cache, key, face_path, pile_path, coin_id):
+    """Résultat en cache complété de l'id et des images de la paire, ou None."""
+    metadata = cache.get(key)
+    if metadata is None:
+        return None
     metadata["id"] = coin_id
     metadata["images"] = [face_path.name, pile_path.name]
+    return metadata
+
+def find_duplicates(index, coins, max_distance=DUPLICATE_DISTANCE):
+    """
+    Repère les pièces qui ressemblent (hash perceptuel des deux photos) à une
+    pièce analysée lors d'une autre séance.
+
+    Ce ne sont que des candidats: un dHash 64 bits ne distingue pas deux pièces
+    du même type et d'années différentes (séance réelle: deux 5 cents 1978 et
+    1979 à distance 5, un schilling et un 2 francs à distance 3). Les pièces
+    restent donc envoyées à l'API; le candidat est signalé pour vérification.
+
+    Returns:
+        Dict {id de pièce: clé de la photo correspondante}
+    """
+    candidates = {}
+    for idx, face, pile in coins:
+        match = index.find_duplicate(face, pile, max_distance)
+        if match is None:
+            continue
+        metadata, source = match
+        candidates[idx] = source
+        print(f"🔁 Pièce #{idx+1}: doublon possible de {source} {format_result(metadata)}, analysée quand même")
+    return candidates
+
+
+def screen_coins(coins, min_sharpness=None, skip=False):
+    """
+    Contrôle qualité des deux photos de chaque pièce (voir photo_quality).
+    Avec skip, une pièce dont une photo est floue, mal exposée ou sans pièce
+    n'est pas envoyée à l'API; sinon elle est seulement signalée.
+
+    Returns:
+        Tuple (pièces à analyser, lignes du rapport des photos à refaire)
+    """
+    remaining, rows = [], []
+    for idx, face, pile in coins:
+        rejected = []
+        for path in (face, pile):
+            try:
+                with METRICS.stage("screen", coin=idx) as event:
+                    quality = assess(path, min_sharpness)
+                    event["read"] = os.path.getsize(path)
+            except Exception as e:
+                # Photo tronquée ou illisible: à refaire, sans interrompre le contrôle
+                quality = Quality([f"illisible ({e})"], 0.0, 0.0, 0.0, 0.0, None)
+            if quality.reasons:
+                rejected.append(report_row(path, quality, idx))
+                print(f"📸 Pièce #{idx+1}: {path.name} à refaire ({describe(quality)})")
+        rows += rejected
+        if not (rejected and skip):
+            remaining.append((idx, face, pile))
+    return remaining, rows
+
+def send_request(client, face_b64, pile_b64, coin_id, model=MODEL):
+    """Un appel Messages, mesuré (aller-retour, octets envoyés, tokens et coût)."""
+    with METRICS.stage("api", coin=coin_id, model=model) as event:
+        event["written"] = len(face_b64) + len(pile_b64)
+        message = client.messages.create(**build_request(face_b64, pile_b64, model))
+    METRICS.usage(message.model, message.usage, coin=coin_id)
+    return message
 
+async def send_request_async(client, face_b64, pile_b64, coin_id, model=MODEL):
+    """Version asynchrone de send_request (client AsyncAnthropic)."""
+    # Temps CPU non mesuré: la boucle fait tourner les autres requêtes pendant l'attente
+    with METRICS.stage("api", cpu=False, coin=coin_id, model=model) as event:
+        event["written"] = len(face_b64) + len(pile_b64)
+        message = await client.messages.create(**build_request(face_b64, pile_b64, model))
+    METRICS.usage(message.model, message.usage, coin=coin_id)
+    return message
+
+def analyze_coin(client, face_path, pile_path, coin_id, preprocess=None, cache=None, payload=None, cascade=False):
+    """
+    Analyse une pièce (2 photos) via Claude API.
+    Retourne un dict avec les métadonnées.
+
+    Avec un ResultCache, une paire déjà analysée (mêmes octets, modèle et
+    prompt) est servie depuis le cache sans appel API.
+
+    payload: images (face, pile) déjà encodées en base64 selon preprocess,
+    par exemple par le pipeline; sinon elles sont encodées depuis les fichiers.
+
+    cascade: interroger d'abord FAST_MODEL et n'envoyer à MODEL que les
+    réponses rejetées par check_result (mêmes images); le niveau retenu est
+    noté dans "tier".
+    """
+    if cache:
+        key = cache_key_for(cache, face_path, pile_path, preprocess, cascade)
+        metadata = cached_result(cache, key, face_path, pile_path, coin_id)
+        if metadata:
+            return metadata
+
+    face_b64, pile_b64 = payload or encode_pair(face_path, pile_path, preprocess)
+
+    if cascade:
+        message = send_request(client, face_b64, pile_b64, coin_id, FAST_MODEL)
+        metadata, reasons = fast_result(message, face_path, pile_path, coin_id)
+        if reasons:
+            message = send_request(client, face_b64, pile_b64, coin_id)
+            metadata = strong_result(message, face_path, pile_path, coin_id, reasons)
+    else:
+        message = send_request(client, face_b64, pile_b64, coin_id)
+        metadata = parse_response(message, face_path, pile_path, coin_id)
+    if cache:
+        cache.put(key, metadata)
     return metadata
 
+async def analyze_coin_async(client, face_path, pile_path, coin_id, preprocess=None, cache=None, payload=None,
+                             cascade=False):
+    """
+    Version asynchrone d'analyze_coin (client AsyncAnthropic).
+    L'encodage base64 tourne dans un thread pour ne pas bloquer la boucle.
+    """
+    if cache:
+        key = await asyncio.to_thread(cache_key_for, cache, face_path, pile_path, preprocess, cascade)
+        metadata = cached_result(cache, key, face_path, pile_path, coin_id)
+        if metadata:
+            return metadata
+
+    face_b64, pile_b64 = payload or await asyncio.to_thread(encode_pair, face_path, pile_path, preprocess)
+
+    if cascade:
+        message = await send_request_async(client, face_b64, pile_b64, coin_id, FAST_MODEL)
+        metadata, reasons = fast_result(message, face_path, pile_path, coin_id)
+        if reasons:
+            message = await send_request_async(client, face_b64, pile_b64, coin_id)
+            metadata = strong_result(message, face_path, pile_path, coin_id, reasons)
+    else:
+        message = await send_request_async(client, face_b64, pile_b64, coin_id)
+        metadata = parse_response(message, face_path, pile_path, coin_id)
+    if cache:
+        cache.put(key, metadata)
+    return metadata
+
+async def analyze_all_async(client, coins, concurrency, on_result=None, preprocess=None, cache=None,
+                            cascade=False):
+    """
+    Analyse toutes les pièces avec au plus `concurrency` requêtes en vol.
+
+    Chaque tâche encode ses images pendant que les autres attendent l'API.
+    Les résultats sont rangés par id de pièce: l'ordre de sortie est le même
+    qu'en mode séquentiel, quel que soit l'ordre d'arrivée des réponses.
+
+    Args:
+        coins: Liste de tuples (id, face, pile)
+        on_result: Appelée avec chaque résultat dès son arrivée
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = {}
+    total = len(coins)
+
+    async def worker(idx, face, pile):
+        async with semaphore:
+            try:
+                metadata = await analyze_coin_async(client, face, pile, idx, preprocess, cache, cascade=cascade)
+            except Exception as e:
+                metadata = error_entry(face, pile, idx, e)
+        results[idx] = metadata
+        if on_result:
+            on_result(metadata)
+        print(f"[{len(results)}/{total}] Pièce #{idx+1}: {format_result(metadata)}", flush=True)
+
+    await asyncio.gather(*(worker(idx, face, pile) for idx, face, pile in coins))
+
+    return [results[idx] for idx in sorted(results)]
+
+def create_client(transport=None, asynchronous=False):
+    """
+    Client Messages (synchrone ou asyncio).
+
+    Args:
+        transport: Transport HTTP à la place du réseau (voir api_transport),
+            None = client par défaut du SDK
+    """
+    api_key = os.getenv(API_KEY_ENV)
+    if transport is None:
+        return (AsyncAnthropic if asynchronous else Anthropic)(api_key=api_key)
+    # Le rejeu n'a besoin ni de réseau ni de clé
+    api_key = api_key or "replay"
+    if asynchronous:
+        return AsyncAnthropic(api_key=api_key, http_client=DefaultAsyncHttpxClient(transport=transport))
+    return Anthropic(api_key=api_key, http_client=DefaultHttpxClient(transport=transport))
+
+async def run_async(coins, concurrency, on_result=None, preprocess=None, cache=None, cascade=False,
+                    transport=None):
+    """Ouvre un client asynchrone le temps de l'analyse puis le ferme proprement."""
+    async with create_client(transport, asynchronous=True) as client:
+        return await analyze_all_async(client, coins, concurrency, on_result, preprocess, cache, cascade)
+
+def analyze_all(client, coins, on_result=None, preprocess=None, cache=None, cascade=False):
+    """
+    Analyse séquentielle: une requête bloquante par pièce.
+
+    Args:
+        coins: Liste de tuples (id, face, pile)
+        on_result: Appelée avec chaque résultat dès son arrivée
+    """
+    results = []
+    total = len(coins)
+    for n, (idx, face, pile) in enumerate(coins):
+        print(f"[{n+1}/{total}] Analyse pièce #{idx+1}...", end=" ", flush=True)
+
+        try:
+            metadata = analyze_coin(client, face, pile, idx, preprocess, cache, cascade=cascade)
+        except Exception as e:
+            metadata = error_entry(face, pile, idx, e)
+
+        results.append(metadata)
+        if on_result:
+            on_result(metadata)
+
+        # Afficher le résultat
+        print(format_result(metadata))
+
+    return results
+
+def batch_custom_id(coin_id):
+    """Identifiant de requête dans un lot, relié à l'id de la pièce."""
+    return f"coin-{coin_id}"
+
+def build_batches(coins, preprocess=None):
+    """
+    Prépare les requêtes de lot et les découpe selon les limites de l'API.
+
+    Yields:
+        Listes de requêtes {"custom_id", "params"}
+    """
+    batch = []
+    batch_bytes = 0
+    for idx, face, pile in coins:
+        face_b64, pile_b64 = encode_pair(face, pile, preprocess)
+        size = len(face_b64) + len(pile_b64) + len(PROMPT) + 1024
+        if batch and (len(batch) >= BATCH_MAX_REQUESTS or batch_bytes + size > BATCH_MAX_BYTES):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append({"custom_id": batch_custom_id(idx), "params": build_request(face_b64, pile_b64)})
+        batch_bytes += size
+    if batch:
+        yield batch
+
+def submit_batches(client, coins, preprocess=None, state_file=BATCH_STATE_FILE):
+    """
+    Soumet toutes les pièces en un ou plusieurs lots.
+    Les ids de lot sont enregistrés (state_file) pour pouvoir reprendre le suivi après une interruption.
+    """
+    batch_ids = []
+    for requests in build_batches(coins, preprocess):
+        batch = client.messages.batches.create(requests=requests)
+        batch_ids.append(batch.id)
+        print(f"📦 Lot {batch.id} soumis ({len(requests)} pièces)")
+        with open(state_file, "w", encoding="utf-8") as f:
+            json.dump({"batch_ids": batch_ids}, f)
+    return batch_ids
+
+def wait_for_batch(client, batch_id, poll_start=BATCH_POLL_START, poll_max=BATCH_POLL_MAX):
+    """Attend la fin d'un lot en espaçant les interrogations (backoff exponentiel)."""
+    delay = poll_start
+    while True:
+        batch = client.messages.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        done = counts.succeeded + counts.errored + counts.canceled + counts.expired
+        print(f"⏳ {batch_id}: {batch.processing_status} "
+              f"({done}/{done + counts.processing} terminées)", flush=True)
+        if batch.processing_status == "ended":
+            return batch
+        time.sleep(delay)
+        delay = min(delay * 2, poll_max)
+
+def collect_batch_results(client, batch_id, coins_by_id, on_result=None):
+    """
+    Relie les résultats d'un lot aux pièces via custom_id.
+    Les résultats ont la même forme que ceux d'analyze_coin.
+    """
+    results = []
+    for entry in client.messages.batches.results(batch_id):
+        idx = int(entry.custom_id.split("-", 1)[1])
+        if idx not in coins_by_id:
+            continue
+        face, pile = coins_by_id[idx]
+
+        if entry.result.type == "succeeded":
+            message = entry.result.message
+            METRICS.usage(message.model, message.usage, batch=True, coin=idx)
+            try:
+                metadata = parse_response(message, face, pile, idx)
+            except Exception as e:
+                metadata = error_entry(face, pile, idx, e)
+        elif entry.result.type == "errored":
+            metadata = error_entry(face, pile, idx, entry.result.error.error.message)
+        else:
+            metadata = error_entry(face, pile, idx, f"requête {entry.result.type}")
+
+        results.append(metadata)
+        if on_result:
+            on_result(metadata)
+        print(f"Pièce #{idx+1}: {format_result(metadata)}")
+    return results
+
+def analyze_batch(client, coins, on_result=None, preprocess=None, poll_start=BATCH_POLL_START, cache=None,
+                  resume=False, state_file=BATCH_STATE_FILE):
+    """
+    Analyse via l'API Message Batches: soumission groupée, suivi, puis récupération.
+
+    Avec resume, les lots d'un suivi interrompu sont repris au lieu d'en
+    soumettre de nouveaux, puis les pièces qu'ils ne couvrent pas sont
+    soumises. Sans resume, ces lots sont abandonnés. Les paires présentes dans
+    le cache ne sont pas soumises.
+    """
+    results = []
+    keys = {}
+    if cache:
+        pending = []
+        for idx, face, pile in coins:
+            keys[idx] = cache_key_for(cache, face, pile, preprocess)
+            metadata = cached_result(cache, keys[idx], face, pile, idx)
+            if metadata:
+                results.append(metadata)
+                if on_result:
+                    on_result(metadata)
+            else:
+                pending.append((idx, face, pile))
+        if results:
+            print(f"💾 {len(results)} pièces servies par le cache")
+        coins = pending
+
+    if state_file.exists() and not resume:
+        # Lots d'un autre jeu de pièces: leurs résultats ne correspondraient pas à celles-ci
+        print(f"⚠️  Lots d'une exécution précédente abandonnés: {state_file} est supprimé "
+              f"(utiliser --batch --resume pour les reprendre)")
+        state_file.unlink()
+
+    coins_by_id = {idx: (face, pile) for idx, face, pile in coins}
+
+    def collect(batch_ids):
+        for batch_id in batch_ids:
+            wait_for_batch(client, batch_id, poll_start)
+            for metadata in collect_batch_results(client, batch_id, coins_by_id, on_result):
+                if cache and metadata["id"] in keys:
+                    cache.put(keys[metadata["id"]], metadata)
+                results.append(metadata)
+                coins_by_id.pop(metadata["id"], None)
+
+    if state_file.exists():
+        with open(state_file, "r", encoding="utf-8") as f:
+            batch_ids = json.load(f)["batch_ids"]
+        print(f"↩️  Reprise du suivi de {len(batch_ids)} lot(s) déjà soumis")
+        collect(batch_ids)
+        # Les pièces absentes des lots repris sont soumises à leur tour
+        coins = [(idx, face, pile) for idx, (face, pile) in coins_by_id.items()]
+    if coins:
+        collect(submit_batches(client, coins, preprocess, state_file))
+
+    state_file.unlink(missing_ok=True)
+    return results
+
+class ResultsJournal:
+    """
+    Journal JSONL en ajout seul: une ligne par résultat, écrite dès son arrivée.
+
+    Les écritures sont synchronisées sur disque (fsync) par lots de
+    `fsync_every` lignes et à la fermeture: un crash ne perd au plus que le
+    dernier lot, et jamais les lignes déjà synchronisées.
+    """
+
+    def __init__(self, path=JOURNAL_FILE, fsync_every=JOURNAL_FSYNC_EVERY, append=True):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True)
+        self.file = open(self.path, "a" if append else "w", encoding="utf-8")
+        self.fsync_every = fsync_every
+        self.pending = 0
+
+    def append(self, result):
+        self.file.write(json.dumps(result, ensure_ascii=False) + "\n")
+        self.pending += 1
+        if self.pending >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def close(self):
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_journal(path=JOURNAL_FILE):
+    """
+    Relit le journal et renvoie le dernier résultat connu par id de pièce.
+    Une dernière ligne tronquée (crash pendant l'écriture) est ignorée.
+    """
+    results = {}
+    if not Path(path).exists():
+        return results
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            results[result["id"]] = result
+    return results
+
+def write_metadata(results, store):
+    """
+    Enregistre les résultats dans la base des métadonnées (une transaction)
+    puis exporte le JSON de la galerie.
+
+    Les cotations déjà saisies sont conservées, et un échec n'écrase pas
+    une analyse réussie précédente.
+    """
+    merged = []
+    for result in results:
+        previous = store.get(result["id"])
+        if previous and "error" in result and "error" not in previous:
+            continue
+        kept = {k: previous[k] for k in PRESERVED_FIELDS if previous and k in previous}
+        merged.append({**result, **kept})
+    with METRICS.stage("save"):
+        store.put_many(merged)
+        store.export_json()
+        refresh_index()
+
+def write_replay_results(results, path):
+    """Écrit les résultats d'un rejeu dans un JSON à part (fichier temporaire puis renommage)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
 def main():
-    # Vérifier la clé API
-    if not os.getenv(API_KEY_ENV):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Analyse les pièces via Claude API et écrit les métadonnées JSON"
+    )
+    parser.add_argument(
+        '--concurrency', '-c',
+        type=int,
+        default=1,
+        help='Nombre de requêtes simultanées (défaut: 1 = séquentiel, >1 = mode asyncio)'
+    )
+    parser.add_argument(
+        '--session',
+        metavar='NOM',
+        help='Analyser une seule séance (ex: 2025-11-02_19h15, défaut: toutes)'
+    )
+    parser.add_argument(
+        '--all',
+        action='store_true',
+        help='Réanalyser aussi les pièces déjà analysées avec succès'
+    )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Reprendre depuis le journal: ignorer les pièces réussies, relancer les erreurs'
+    )
+    parser.add_argument(
+        '--max-edge',
+        type=int,
+        default=DEFAULT_MAX_EDGE,
+        help=f'Recadrer sur la pièce et réduire à ce grand côté avant envoi (défaut: {DEFAULT_MAX_EDGE}, 0 = photos brutes)'
+    )
+    parser.add_argument(
+        '--quality',
+        type=int,
+        default=DEFAULT_QUALITY,
+        help=f'Qualité JPEG des images préparées (défaut: {DEFAULT_QUALITY})'
+    )
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='Soumettre toute la session via l\'API Message Batches (moitié prix, résultats différés)'
+    )
+    parser.add_argument(
+        '--cascade',
+        action='store_true',
+        help=f'Lire d\'abord chaque pièce avec {FAST_MODEL}, et ne passer à {MODEL} que les réponses douteuses'
+    )
+    parser.add_argument(
+        '--poll-interval',
+        type=float,
+        default=BATCH_POLL_START,
+        help=f'Premier intervalle de suivi des lots en secondes, doublé à chaque essai (défaut: {BATCH_POLL_START})'
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Ne pas consulter ni alimenter le cache des résultats'
+    )
+    parser.add_argument(
+        '--cache-max-mb',
+        type=float,
+        default=CACHE_MAX_BYTES / 1024 / 1024,
+        help=f'Taille maximale du cache des résultats en Mo (défaut: {CACHE_MAX_BYTES // 1024 // 1024})'
+    )
+    parser.add_argument(
+        '--no-dedup',
+        action='store_true',
+        help='Ne pas signaler les pièces déjà photographiées lors d\'une autre séance'
+    )
+    parser.add_argument(
+        '--dedup-distance',
+        type=int,
+        default=DUPLICATE_DISTANCE,
+        help=f'Distance de Hamming maximale entre hash perceptuels de doublons (défaut: {DUPLICATE_DISTANCE})'
+    )
+    parser.add_argument(
+        '--record',
+        nargs='?',
+        const=RECORDINGS_DIR,
+        type=Path,
+        metavar='DIR',
+        help=f'Enregistrer les réponses de l\'API pour les rejouer (défaut: {RECORDINGS_DIR})'
+    )
+    parser.add_argument(
+        '--replay',
+        nargs='?',
+        const=RECORDINGS_DIR,
+        type=Path,
+        metavar='DIR',
+        help='Rejouer les réponses enregistrées, sans réseau ni coût (avec --no-cache --all pour tout mesurer)'
+    )
+    parser.add_argument(
+        '--replay-latency',
+        type=float,
+        default=None,
+        metavar='SEC',
+        help='Délai fixe de chaque réponse rejouée (défaut: durée enregistrée)'
+    )
+    parser.add_argument(
+        '--replay-errors',
+        type=float,
+        default=0.0,
+        metavar='TAUX',
+        help='Part des tentatives rejouées qui reçoivent une erreur 529 (ex: 0.05)'
+    )
+    parser.add_argument(
+        '--replay-429',
+        type=float,
+        default=0.0,
+        metavar='TAUX',
+        help='Part des tentatives rejouées qui reçoivent un 429 (ex: 0.1)'
+    )
+    parser.add_argument(
+        '--replay-seed',
+        type=int,
+        default=0,
+        help='Graine des fautes injectées (défaut: 0)'
+    )
+    parser.add_argument(
+        '--screen',
+        choices=SCREEN_MODES,
+        default=DEFAULT_SCREEN,
+        help='Contrôle qualité (netteté, exposition, pièce): off, report = signaler les photos à refaire '
+             f'dans le rapport, skip = ne pas envoyer leurs pièces à l\'API (défaut: {DEFAULT_SCREEN})'
+    )
+    parser.add_argument(
+        '--min-sharpness',
+        type=float,
+        default=None,
+        help=f'Netteté minimale du contrôle qualité (variance du laplacien, défaut: {MIN_SHARPNESS:.0f})'
+    )
+    args = parser.parse_args()
+
+    preprocess = {"max_edge": args.max_edge, "quality": args.quality} if args.max_edge else None
+    if args.cascade and args.batch:
+        print("❌ Erreur: --cascade n'est pas disponible en mode --batch")
+        return 1
+    if args.record and args.replay:
+        print("❌ Erreur: --record et --replay sont incompatibles")
+        return 1
+
+    transport = None
+    if args.record:
+        transport = RecordTransport(args.record)
+    elif args.replay:
+        if not args.replay.is_dir():
+            print(f"❌ Erreur: aucun enregistrement dans {args.replay} (lancer d'abord avec --record)")
+            return 1
+        transport = ReplayTransport(args.replay, args.replay_latency, args.replay_errors, args.replay_429,
+                                    args.replay_seed)
+
+    # Un rejeu écrit journal, état des lots, cache et résultats dans REPLAY_DIR: les
+    # réponses enregistrées n'écrasent jamais les analyses ni les corrections, et
+    # n'entrent pas dans le cache relu par une vraie analyse
+    journal_file, state_file, output_file, cache_file = JOURNAL_FILE, BATCH_STATE_FILE, OUTPUT_FILE, CACHE_FILE
+    if args.replay:
+        REPLAY_DIR.mkdir(parents=True, exist_ok=True)
+        journal_file, state_file, output_file, cache_file = (
+            REPLAY_DIR / path.name for path in (JOURNAL_FILE, BATCH_STATE_FILE, OUTPUT_FILE, CACHE_FILE))
+
+    # Vérifier la clé API (inutile en rejeu)
+    if not os.getenv(API_KEY_ENV) and not args.replay:
         print(f"❌ Erreur: Variable d'environnement {API_KEY_ENV} non définie")
         print(f"\nCrée un fichier .env avec:")
         print(f"  {API_KEY_ENV}=ta-clé-api")
         return 1
 
-    # Initialiser le client
-    client = Anthropic(api_key=os.getenv(API_KEY_ENV))
-
-    # Charger les images
-    images = sorted([f for f in PICTURES_DIR.glob("*.jpg")])
-    if not images:
-        print(f"❌ Aucune image trouvée dans {PICTURES_DIR}")
+    # Paires de toutes les séances (ids définitifs attribués par le registre)
+    registry = SessionRegistry()
+    added = registry.scan()
+    registry.save()
+    if added:
+        print(f"📷 {len(added)} nouvelles paires enregistrées")
+    all_coins = registry.pairs()
+    coins = registry.pairs(args.session) if args.session else all_coins
+    if not coins:
+        print(f"❌ Aucune paire de photos trouvée dans {PICTURES_ROOT / (args.session or '')}")
         return 1
 
-    # Grouper par paires
-    coins = [(images[i], images[i+1]) for i in range(0, len(images), 2)]
+    # Par défaut, seules les pièces pas encore analysées avec succès
+    if not args.all:
+        with MetadataStore() as store:
+            analyzed = store.analyzed_ids()
+        coins = [coin for coin in coins if coin[0] not in analyzed]
+        if not coins:
+            print("✅ Toutes les pièces sont déjà analysées (--all pour tout réanalyser)")
+            return 0
     total = len(coins)
+    images = [path for _, face, pile in coins for path in (face, pile)]
 
-    print(f"🪙 Analyse de {total} pièces ({len(images)} photos)")
-    print(f"📁 Sortie: {OUTPUT_FILE}")
-    print(f"💰 Coût estimé: ~${total * 0.015:.2f} (Sonnet 4)\n")
+    # Reprise: conserver les succès du journal, relancer le reste
+    done = {}
+    if args.resume:
+        wanted = {coin[0] for coin in coins}
+        done = {idx: r for idx, r in read_journal(journal_file).items() if "error" not in r and idx in wanted}
+        coins = [coin for coin in coins if coin[0] not in done]
+        print(f"↩️  Reprise: {len(done)} pièces déjà analysées, {len(coins)} restantes")
+    elif journal_file.exists():
+        print(f"⚠️  Nouveau journal: {journal_file} est réinitialisé (utiliser --resume pour reprendre)")
 
-    # Analyser chaque pièce
-    results = []
-    for idx, (face, pile) in enumerate(coins):
-        print(f"[{idx+1}/{total}] Analyse pièce #{idx+1}...", end=" ", flush=True)
+    print(f"🪙 Analyse de {len(coins)} pièces ({len(images)} photos)")
+    print(f"📁 Sortie: {output_file}")
+    cost_per_coin = 0.0075 if args.batch else 0.015
+    if args.replay:
+        print(f"🎞️  Rejeu de {args.replay}: aucun appel facturé, base des métadonnées, galerie et cache des résultats "
+              f"inchangés\n")
+    elif args.cascade:
+        # Minimum sans escalade: même volume de tokens au prix du modèle rapide
+        cost_per_coin *= model_prices(FAST_MODEL)[0] / model_prices(MODEL)[0]
+        print(f"💰 Coût estimé: ~${len(coins) * cost_per_coin:.2f} + escalades (cascade Haiku 4.5 → Sonnet 4, "
+              f"coût réel en fin d'analyse)\n")
+    else:
+        print(f"💰 Coût estimé: ~${len(coins) * cost_per_coin:.2f} (Sonnet 4{', lot -50%' if args.batch else ''}, "
+              f"coût réel en fin d'analyse)\n")
+    # Métriques d'un rejeu à part: son coût simulé ne se mêle pas au coût réel
+    METRICS.start("analyze_coins_replay" if args.replay else "analyze_coins", simulated=bool(args.replay))
 
-        try:
-            metadata = analyze_coin(client, face, pile, idx)
-            results.append(metadata)
+    cache = None if args.no_cache else ResultCache(cache_file, max_bytes=int(args.cache_max_mb * 1024 * 1024))
 
-            # Afficher le résultat
-            country = metadata.get("country", "?")
-            value = metadata.get("value", "?")
-            year = metadata.get("year", "?")
-            print(f"✓ {country} - {value} ({year})")
+    # Index des hash perceptuels: mise à jour incrémentale avant la recherche de doublons
+    index = None
+    if not args.no_dedup:
+        index = PhashIndex()
+        hashed = index.update([path for _, face, pile in all_coins for path in (face, pile)])
+        if hashed:
+            print(f"🔑 {hashed} photos ajoutées à l'index perceptuel")
+        # Rattacher aussi les métadonnées déjà produites pour les séances connues
+        pairs = {idx: (face, pile) for idx, face, pile in all_coins}
+        with MetadataStore() as store:
+            for entry in store.all():
+                face, pile = pairs.get(entry["id"], (None, None))
+                if face and face.exists() and pile.exists():
+                    index.attach(face, pile, entry)
 
-        except Exception as e:
-            print(f"❌ Erreur: {e}")
-            results.append({
-                "id": idx,
-                "images": [face.name, pile.name],
-                "error": str(e)
-            })
-
-    # Sauvegarder les résultats
-    OUTPUT_FILE.parent.mkdir(exist_ok=True)
-    with open(OUTPUT_FILE, "w", encoding="utf-8") as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    # Analyser chaque pièce, chaque résultat étant journalisé dès son arrivée
+    candidates = {}
+    skipped_count = 0
+    try:
+        with ResultsJournal(journal_file, append=args.resume) as journal:
+            if index:
+                candidates = find_duplicates(index, coins, args.dedup_distance)
+                if candidates:
+                    print(f"🔁 {len(candidates)} doublons possibles, à vérifier (possible_duplicate_of)\n")
+            if args.screen != "off":
+                # Les pièces écartées sont à nouveau contrôlées au prochain passage
+                checked = [path for _, face, pile in coins for path in (face, pile)]
+                screened = len(coins)
+                coins, reshoot = screen_coins(coins, args.min_sharpness, skip=args.screen == "skip")
+                update_report(checked, reshoot)
+                skipped_count = screened - len(coins)
+                if skipped_count:
+                    print(f"📸 {skipped_count} pièces à refaire, sans appel API (voir {REPORT_FILE})\n")
+                elif reshoot:
+                    print(f"📸 {len({row['coin'] for row in reshoot})} pièces à refaire, analysées quand même "
+                          f"(voir {REPORT_FILE})\n")
+            if args.batch:
+                client = create_client(transport)
+                new_results = analyze_batch(client, coins, journal.append, preprocess, args.poll_interval, cache,
+                                            args.resume, state_file)
+            elif args.concurrency > 1:
+                print(f"⚡ Mode asynchrone: {args.concurrency} requêtes simultanées\n")
+                new_results = asyncio.run(run_async(coins, args.concurrency, journal.append, preprocess, cache,
+                                                    args.cascade, transport))
+            else:
+                client = create_client(transport)
+                new_results = analyze_all(client, coins, journal.append, preprocess, cache, args.cascade)
+    except KeyboardInterrupt:
+        if cache:
+            cache.close()
+        if index:
+            index.close()
+        print(f"\n⚠️  Interrompu: les résultats reçus sont dans {journal_file}")
+        if state_file.exists():
+            print("   Les lots soumis continuent côté API: relancer avec --batch --resume pour les récupérer")
+        else:
+            print("   Relancer avec --resume pour terminer sans repayer les pièces déjà analysées")
+        summary = METRICS.finish()
+        if summary:
+            print(f"\n{summary}")
+        return 130
+
+    # Rattacher les nouveaux résultats à leurs photos pour les prochaines séances (pas ceux d'un rejeu)
+    if index:
+        if not args.replay:
+            pairs = {idx: (face, pile) for idx, face, pile in coins}
+            for r in new_results:
+                index.attach(*pairs[r["id"]], r)
+        index.close()
+
+    # Compacter journal + nouveaux résultats dans la base, puis exporter le JSON
+    for r in new_results:
+        if r["id"] in candidates:
+            r["possible_duplicate_of"] = candidates[r["id"]]
+    done.update((r["id"], r) for r in new_results)
+    results = [done[idx] for idx in sorted(done)]
+    if args.replay:
+        write_replay_results(results, output_file)
+    else:
+        with MetadataStore() as store:
+            write_metadata(results, store)
+
+    success_count = len([r for r in results if 'error' not in r])
+    error_count = total - success_count - skipped_count
+    if not error_count:
+        journal_file.unlink(missing_ok=True)
 
-    print(f"\n✅ Terminé! Métadonnées sauvegardées dans {OUTPUT_FILE}")
-    print(f"📊 {len([r for r in results if 'error' not in r])}/{total} pièces analysées avec succès")
+    print(f"\n✅ Terminé! Métadonnées sauvegardées dans {output_file}")
+    print(f"📊 {success_count}/{total} pièces analysées avec succès")
+    if skipped_count:
+        print(f"📸 {skipped_count} pièces à reprendre en photo: voir {REPORT_FILE}")
+    cascade = cascade_summary(new_results)
+    if cascade:
+        print(cascade)
+    if cache:
+        print(cache.summary())
+        cache.close()
+    if transport:
+        print(transport.summary())
+    if error_count:
+        print(f"↩️  Relancer avec --resume pour réessayer les {error_count} erreurs")
+    summary = METRICS.finish()
+    if summary:
+        print(f"\n{summary}")
 
     return 0
 
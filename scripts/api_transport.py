@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Transport HTTP d'enregistrement et de rejeu des appels à l'API, pour mesurer
+l'analyse (analyze_coins.py) hors ligne, sans coût et de façon reproductible.
+
+- Enregistrement (RecordTransport): les requêtes partent vers l'API (ou le
+  serveur de test); chaque réponse 2xx est gardée sur disque sous l'empreinte
+  de sa requête: méthode, chemin et corps JSON canonique, sans l'hôte ni les
+  en-têtes, si bien qu'un enregistrement fait contre le serveur de test se
+  rejoue sur l'URL par défaut.
+- Rejeu (ReplayTransport): les réponses sont servies depuis le disque, sans
+  réseau, après la latence enregistrée (ou une latence fixe), avec des 429
+  et des erreurs 529 injectées à un taux donné. Le SDK les traite comme en
+  production (nouvelles tentatives, en-tête retry-after). Le tirage dépend
+  de la graine, de l'empreinte et du numéro de tentative: un même rejeu
+  injecte les mêmes fautes quel que soit l'ordre des requêtes.
+
+Une empreinte peut avoir plusieurs réponses (suivi d'un lot: in_progress
+puis ended): elles sont rejouées dans l'ordre, la dernière se répète.
+
+Usage (contenu d'un enregistrement):
+    python scripts/api_transport.py .cache/api_recordings
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import hashlib
+import threading
+from collections import Counter
+from pathlib import Path
+
+from anthropic import DEFAULT_CONNECTION_LIMITS
+
+try:
+    # Client HTTP des versions récentes du SDK (les anciennes utilisent httpx)
+    import httpx2 as httpx
+except ImportError:
+    import httpx
+
+RECORDINGS_DIR = Path(".cache/api_recordings")
+# En-têtes liés au transfert d'origine: le corps est stocké décodé
+DROPPED_HEADERS = ("content-encoding", "content-length", "transfer-encoding", "connection")
+# Délai demandé par les fautes injectées (en-tête retry-after), en secondes
+RETRY_AFTER = 1.0
+
+
+def fingerprint(request, body):
+    """Empreinte d'une requête: méthode, chemin (avec la query) et corps JSON canonique."""
+    try:
+        body = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+    except ValueError:
+        pass
+    digest = hashlib.sha256(f"{request.method} {request.url.raw_path.decode('ascii')}\n".encode("utf-8"))
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def error_response(request, status, kind, message, retry_after=None):
+    """Réponse d'erreur au format de l'API."""
+    headers = {"content-type": "application/json", "request-id": f"req_replay_{status}"}
+    if retry_after is not None:
+        headers["retry-after"] = f"{retry_after:g}"
+    else:
+        headers["x-should-retry"] = "false"
+    body = {"type": "error", "error": {"type": kind, "message": message}}
+    return httpx.Response(status, headers=headers, content=json.dumps(body).encode("utf-8"), request=request)
+
+
+class Recordings:
+    """Réponses enregistrées: une fiche JSON par empreinte dans un répertoire."""
+
+    def __init__(self, directory=RECORDINGS_DIR):
+        self.directory = Path(directory)
+        self.lock = threading.Lock()
+        # Fiches lues ou écrites pendant cette exécution
+        self.entries = {}
+
+    def path(self, key):
+        return self.directory / f"{key}.json"
+
+    def load(self, key):
+        """Fiche d'une empreinte, ou None si elle n'a jamais été enregistrée."""
+        with self.lock:
+            if key not in self.entries:
+                try:
+                    with open(self.path(key), "r", encoding="utf-8") as f:
+                        self.entries[key] = json.load(f)
+                except FileNotFoundError:
+                    return None
+            return self.entries[key]
+
+    def record(self, key, request, body, exchange):
+        """
+        Ajoute une réponse à la fiche d'une empreinte et la réécrit.
+
+        La première réponse d'une exécution remplace la fiche existante: un
+        nouvel enregistrement rafraîchit les réponses au lieu de les cumuler.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                try:
+                    model = json.loads(body).get("model")
+                except (ValueError, AttributeError):
+                    model = None
+                entry = self.entries[key] = {
+                    "method": request.method,
+                    "path": request.url.raw_path.decode("ascii"),
+                    "model": model,
+                    "exchanges": [],
+                }
+            entry["exchanges"].append(exchange)
+
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.path(key)
+            tmp_path = path.with_name(path.name + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+
+
+class RecordTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """Transport réel (synchrone et asyncio) qui enregistre les réponses 2xx."""
+
+    def __init__(self, directory=RECORDINGS_DIR):
+        self.recordings = Recordings(directory)
+        self.transport = None
+        self.async_transport = None
+        self.recorded = 0
+
+    def handle_request(self, request):
+        if self.transport is None:
+            self.transport = httpx.HTTPTransport(limits=DEFAULT_CONNECTION_LIMITS)
+        body = request.read()
+        start = time.perf_counter()
+        response = self.transport.handle_request(request)
+        try:
+            content = response.read()
+        finally:
+            response.close()
+        return self.keep(request, body, response, content, time.perf_counter() - start)
+
+    async def handle_async_request(self, request):
+        if self.async_transport is None:
+            self.async_transport = httpx.AsyncHTTPTransport(limits=DEFAULT_CONNECTION_LIMITS)
+        body = await request.aread()
+        start = time.perf_counter()
+        response = await self.async_transport.handle_async_request(request)
+        try:
+            content = await response.aread()
+        finally:
+            await response.aclose()
+        return self.keep(request, body, response, content, time.perf_counter() - start)
+
+    def keep(self, request, body, response, content, elapsed):
+        """Enregistre une réponse reçue et la renvoie, corps déjà décodé."""
+        headers = [(name, value) for name, value in response.headers.items()
+                   if name.lower() not in DROPPED_HEADERS]
+        if 200 <= response.status_code < 300:
+            self.recordings.record(fingerprint(request, body), request, body, {
+                "status": response.status_code,
+                "headers": headers,
+                "body": content.decode("utf-8"),
+                "elapsed": round(elapsed, 6),
+            })
+            self.recorded += 1
+        return httpx.Response(response.status_code, headers=headers, content=content, request=request)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    async def aclose(self):
+        if self.async_transport is not None:
+            await self.async_transport.aclose()
+
+    def summary(self):
+        return f"🎞️  Enregistrement: {self.recorded} réponses dans {self.recordings.directory}"
+
+
+class ReplayTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    Transport sans réseau qui sert les réponses enregistrées.
+
+    Args:
+        directory: Répertoire des enregistrements
+        latency: Délai avant chaque réponse en secondes (None = durée enregistrée)
+        error_rate: Part des tentatives qui reçoivent une erreur 529 (overloaded_error)
+        rate_limit_rate: Part des tentatives qui reçoivent un 429 (rate_limit_error)
+        seed: Graine des tirages
+        retry_after: Délai demandé par les fautes injectées (en-tête retry-after)
+    """
+
+    def __init__(self, directory=RECORDINGS_DIR, latency=None, error_rate=0.0, rate_limit_rate=0.0,
+                 seed=0, retry_after=RETRY_AFTER):
+        self.recordings = Recordings(directory)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.attempts = Counter()
+        self.served = Counter()
+        self.stats = Counter()
+
+    def plan(self, request, body):
+        """
+        Choisit la réponse d'une tentative.
+
+        Returns:
+            Tuple (réponse, délai en secondes); les fautes répondent aussitôt
+        """
+        key = fingerprint(request, body)
+        with self.lock:
+            attempt = self.attempts[key]
+            self.attempts[key] += 1
+        draw = random.Random(f"{self.seed}:{key}:{attempt}").random()
+
+        entry = self.recordings.load(key)
+        if entry is None:
+            self.count("missing")
+            return error_response(request, 404, "not_found_error",
+                                  f"Aucun enregistrement pour {request.method} {request.url.path} "
+                                  f"(empreinte {key[:12]}): réenregistrer avec --record"), 0.0
+        if draw < self.rate_limit_rate:
+            self.count("rate_limited")
+            return error_response(request, 429, "rate_limit_error", "Limite de débit simulée (rejeu)",
+                                  self.retry_after), 0.0
+        if draw < self.rate_limit_rate + self.error_rate:
+            self.count("errors")
+            return error_response(request, 529, "overloaded_error", "Surcharge simulée (rejeu)",
+                                  self.retry_after), 0.0
+
+        with self.lock:
+            exchanges = entry["exchanges"]
+            exchange = exchanges[min(self.served[key], len(exchanges) - 1)]
+            self.served[key] += 1
+        self.count("replayed")
+        response = httpx.Response(exchange["status"], headers=exchange["headers"],
+                                  content=exchange["body"].encode("utf-8"), request=request)
+        return response, exchange["elapsed"] if self.latency is None else self.latency
+
+    def count(self, outcome):
+        with self.lock:
+            self.stats[outcome] += 1
+
+    def handle_request(self, request):
+        response, delay = self.plan(request, request.read())
+        if delay:
+            time.sleep(delay)
+        return response
+
+    async def handle_async_request(self, request):
+        response, delay = self.plan(request, await request.aread())
+        if delay:
+            await asyncio.sleep(delay)
+        return response
+
+    def summary(self):
+        s = self.stats
+        line = (f"🎞️  Rejeu: {s['replayed']} réponses, {s['rate_limited']} 429 et "
+                f"{s['errors']} erreurs injectés")
+        if s["missing"]:
+            line += f", {s['missing']} requêtes sans enregistrement"
+        return line
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Contenu d'un enregistrement des appels à l'API")
+    parser.add_argument('directory', nargs='?', type=Path, default=RECORDINGS_DIR,
+                        help=f'Répertoire des enregistrements (défaut: {RECORDINGS_DIR})')
+    args = parser.parse_args()
+
+    paths = sorted(args.directory.glob("*.json"))
+    if not paths:
+        print(f"❌ Aucun enregistrement dans {args.directory}")
+        return 1
+
+    requests, elapsed, size = Counter(), Counter(), 0
+    for path in paths:
+        size += path.stat().st_size
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        kind = f"{entry['method']} {entry['path'].split('?')[0]}" if not entry.get("model") else entry["model"]
+        requests[kind] += 1
+        elapsed[kind] += sum(exchange["elapsed"] for exchange in entry["exchanges"]) / len(entry["exchanges"])
+
+    print(f"📁 {args.directory}: {len(paths)} requêtes enregistrées, {size / 1024 / 1024:.1f} Mo")
+    for kind, count in requests.most_common():
+        print(f"   {kind:<48} {count:>6}  latence moyenne {elapsed[kind] / count * 1000:>8.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Benchmark du recadrage: compare crop_image_to_square à l'ancienne version
+(exif_transpose sur l'image entière puis recadrage), avec et sans détection
+de la pièce.
+
+Chaque variante tourne dans un processus neuf pour mesurer le pic mémoire
+(ru_maxrss) sans être faussée par l'autre.
+"""
+
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import multiprocessing
+from functools import partial
+from pathlib import Path
+from PIL import Image, ImageCms, ImageDraw, ImageOps
+
+from crop_images import crop_image_to_square, EXIF_ORIENTATION_TAG
+
+
+def crop_image_to_square_legacy(image_path, output_path=None, target_size=1848):
+    """Version d'origine de crop_image_to_square, conservée comme référence."""
+    try:
+        with Image.open(image_path) as img:
+            img = ImageOps.exif_transpose(img)
+
+            width, height = img.size
+
+            if width >= target_size and height >= target_size:
+                left = (width - target_size) // 2
+                top = (height - target_size) // 2
+                right = left + target_size
+                bottom = top + target_size
+
+                cropped_img = img.crop((left, top, right, bottom))
+
+                save_path = output_path if output_path else image_path
+                cropped_img.save(save_path, quality=95, optimize=True)
+
+                return True, f"✓ {image_path.name}: {width}x{height} → {target_size}x{target_size}"
+            else:
+                return False, f"✗ {image_path.name}: dimensions insuffisantes ({width}x{height})"
+
+    except Exception as e:
+        return False, f"✗ {image_path.name}: erreur - {str(e)}"
+
+
+VARIANTS = {
+    'legacy': crop_image_to_square_legacy,
+    'planned': partial(crop_image_to_square, detect=False),
+    'detected': crop_image_to_square,
+}
+
+
+def make_sample(path, orientation, width=1848, height=4000):
+    """Génère une photo synthétique type appareil (EXIF + profil ICC)."""
+    # Stockée en paysage si l'orientation implique une rotation de 90°
+    raw_size = (height, width) if orientation in (5, 6, 7, 8) else (width, height)
+    img = Image.new('RGB', raw_size, (200, 200, 195))
+    draw = ImageDraw.Draw(img)
+    cx, cy = raw_size[0] // 2, raw_size[1] // 2
+    draw.ellipse((cx - 600, cy - 600, cx + 600, cy + 600), fill=(150, 120, 60))
+    for i in range(0, raw_size[0], 37):
+        draw.line((i, 0, raw_size[0] - i, raw_size[1]), fill=(i % 255, 90, 40))
+
+    exif = img.getexif()
+    exif[EXIF_ORIENTATION_TAG] = orientation
+    icc = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    img.save(path, quality=92, exif=exif.tobytes(), icc_profile=icc)
+
+
+def run_variant(name, sources, target_size):
+    """Exécuté dans un processus dédié: recadre chaque source et mesure."""
+    crop = VARIANTS[name]
+    out_dir = Path(tempfile.mkdtemp(prefix=f'bench_{name}_'))
+    try:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        for source in sources:
+            success, message = crop(Path(source), out_dir / Path(source).name, target_size)
+            if not success:
+                raise RuntimeError(message)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        with Image.open(out_dir / Path(sources[0]).name) as sample:
+            kept_exif = bool(sample.getexif())
+            kept_icc = bool(sample.info.get('icc_profile'))
+    finally:
+        shutil.rmtree(out_dir)
+
+    return {
+        'wall': wall,
+        'cpu': cpu,
+        'maxrss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'exif': kept_exif,
+        'icc': kept_icc,
+    }
+
+
+def baseline_rss(_):
+    """Pic mémoire d'un processus qui n'a fait qu'importer les modules."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Compare le recadrage planifié à l'ancienne version (temps CPU et pic mémoire)"
+    )
+    parser.add_argument('--images', type=int, default=10, help="Nombre d'images synthétiques (défaut: 10)")
+    parser.add_argument('--orientation', type=int, default=6, choices=range(1, 9),
+                        help='Orientation EXIF des images générées (défaut: 6, portrait tourné)')
+    parser.add_argument('--size', type=int, default=1848, help='Taille du carré final (défaut: 1848)')
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='bench_crop_'))
+    try:
+        print(f"Génération de {args.images} images 1848x4000 (orientation {args.orientation})...")
+        sources = []
+        for i in range(args.images):
+            path = work_dir / f'sample_{i:03d}.jpg'
+            make_sample(path, args.orientation)
+            sources.append(str(path))
+
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(1) as pool:
+            base_kb = pool.apply(baseline_rss, (None,))
+
+        results = {}
+        for name in VARIANTS:
+            with ctx.Pool(1) as pool:
+                results[name] = pool.apply(run_variant, (name, sources, args.size))
+    finally:
+        shutil.rmtree(work_dir)
+
+    print(f"\n{'Variante':<10} {'ms/image':>10} {'CPU ms/image':>13} {'Pic mémoire':>12}  EXIF  ICC")
+    print('-' * 60)
+    for name, r in results.items():
+        peak_mb = (r['maxrss_kb'] - base_kb) / 1024
+        print(f"{name:<10} {r['wall'] * 1000 / args.images:>10.1f} {r['cpu'] * 1000 / args.images:>13.1f} "
+              f"{peak_mb:>9.1f} Mo  {'oui' if r['exif'] else 'non':<5} {'oui' if r['icc'] else 'non'}")
+
+    legacy, planned = results['legacy'], results['planned']
+    print(f"\nGain CPU: x{legacy['cpu'] / planned['cpu']:.2f}, "
+          f"gain mémoire: x{(legacy['maxrss_kb'] - base_kb) / max(planned['maxrss_kb'] - base_kb, 1):.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
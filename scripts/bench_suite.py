@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Banc d'essai des chemins critiques: recadrage (crop_image_to_square),
+encodage pour l'API (encode_image, encode_prepared) et base des métadonnées
+(chargement, export JSON, mise à jour d'une pièce) sur 1k, 10k et 100k
+pièces fictives.
+
+Les données sont synthétiques: une séance de photos 1848x4000 type appareil
+(voir bench_crop.make_sample) et des métadonnées réalistes
+(coin_search.synthetic_coins). Chaque cas tourne dans un processus neuf pour
+mesurer son pic mémoire au-delà de l'occupation après les imports (voir
+peak_rss_kb); le temps retenu est le meilleur de --repeat passes.
+
+Les résultats sont écrits en JSON (.cache/bench/AAAAMMJJ-HHMMSS.json par
+défaut); --compare signale les régressions entre deux exécutions et sort
+en erreur s'il y en a.
+
+Usage:
+    python scripts/bench_suite.py
+    python scripts/bench_suite.py --sizes 1000 10000 --images 5 --output avant.json
+    python scripts/bench_suite.py --compare avant.json apres.json --threshold 10
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+from pathlib import Path
+
+RESULTS_DIR = Path(".cache/bench")
+RESULTS_VERSION = 1
+
+# Tailles des jeux de métadonnées et nombre de photos par défaut
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_IMAGES = 10
+
+# Mises à jour d'une pièce mesurées par passe
+UPDATES = 200
+
+# Seuil de régression par défaut (%), et écart mémoire ignoré en dessous (Mo)
+DEFAULT_THRESHOLD = 10.0
+MEMORY_NOISE_MB = 5.0
+
+
+# Cas mesurés (exécutés dans un processus dédié)
+# Chaque cas reçoit son répertoire de travail et renvoie le nombre
+# d'éléments traités et la durée de la passe.
+
+def case_crop(work_dir, images):
+    from crop_images import crop_image_to_square
+
+    out_dir = work_dir / "cropped"
+    out_dir.mkdir(exist_ok=True)
+    start = time.perf_counter()
+    for source in images:
+        success, message = crop_image_to_square(source, out_dir / source.name)
+        if not success:
+            raise RuntimeError(message)
+    return len(images), time.perf_counter() - start
+
+
+def case_encode(work_dir, images):
+    from analyze_coins import encode_image
+
+    start = time.perf_counter()
+    for source in images:
+        encode_image(source)
+    return len(images), time.perf_counter() - start
+
+
+def case_encode_prepared(work_dir, images):
+    from preprocess_images import encode_prepared
+
+    start = time.perf_counter()
+    for source in images:
+        encode_prepared(source)
+    return len(images), time.perf_counter() - start
+
+
+def open_store(work_dir, history=False):
+    from metadata_store import MetadataStore
+
+    return MetadataStore(work_dir / "coins_metadata.sqlite3", work_dir / "coins_metadata.json",
+                         history_dir=work_dir / "history" if history else None)
+
+
+def case_metadata_load(work_dir, size):
+    start = time.perf_counter()
+    with open_store(work_dir) as store:
+        coins = store.all()
+    return len(coins), time.perf_counter() - start
+
+
+def case_metadata_save(work_dir, size):
+    with open_store(work_dir) as store:
+        start = time.perf_counter()
+        store.export_json()
+        return size, time.perf_counter() - start
+
+
+def case_metadata_update(work_dir, size):
+    # Avec l'historique, comme les scripts (analyze_coins, add_valuations)
+    rng = random.Random(size)
+    with open_store(work_dir, history=True) as store:
+        start = time.perf_counter()
+        for i in range(UPDATES):
+            store.update(rng.randrange(size), {"notes": f"bench {i}"})
+        return UPDATES, time.perf_counter() - start
+
+
+CASES = {
+    "crop": case_crop,
+    "encode": case_encode,
+    "encode_prepared": case_encode_prepared,
+    "metadata_load": case_metadata_load,
+    "metadata_save": case_metadata_save,
+    "metadata_update": case_metadata_update,
+}
+IMAGE_CASES = ("crop", "encode", "encode_prepared")
+
+
+def import_modules():
+    import crop_images, analyze_coins, preprocess_images, metadata_store  # noqa: F401
+
+
+def peak_rss_kb():
+    """
+    Pic mémoire du processus (Ko). Sous Linux VmHWM, remis à zéro au
+    lancement du programme: ru_maxrss, lui, hérite du pic du processus
+    parent à travers fork + exec.
+    """
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset_peak():
+    """Ramène le pic mémoire à l'occupation courante (Linux), sans effet ailleurs."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def run_case(name, source_dir, param, repeat):
+    """Exécuté dans un processus dédié: meilleure de `repeat` passes sur une copie des données."""
+    # Pic mémoire mesuré au-delà de celui des imports
+    import_modules()
+    reset_peak()
+    base_kb = peak_rss_kb()
+    work_dir = Path(tempfile.mkdtemp(prefix=f"bench_{name}_"))
+    try:
+        if name in IMAGE_CASES:
+            param = [Path(path) for path in param]
+        else:
+            for path in Path(source_dir).iterdir():
+                shutil.copy2(path, work_dir / path.name)
+        best = None
+        for _ in range(repeat):
+            items, seconds = CASES[name](work_dir, param)
+            best = seconds if best is None else min(best, seconds)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "items": items,
+        "seconds": best,
+        "peak_kb": peak_rss_kb() - base_kb,
+    }
+
+
+def make_session(directory, count):
+    """Séance synthétique de photos 1848x4000 (orientation EXIF variée, comme l'appareil)."""
+    from bench_crop import make_sample
+
+    directory.mkdir(parents=True, exist_ok=True)
+    images = []
+    for i in range(count):
+        path = directory / f"2025010{i % 2 + 1}_1200{i:02d}.jpg"
+        make_sample(path, (6, 1, 8)[i % 3])
+        images.append(path)
+    return images
+
+
+def make_metadata(directory, size):
+    """Base et JSON de `size` pièces fictives, comme après une analyse puis un export."""
+    from coin_search import synthetic_coins
+
+    directory.mkdir(parents=True, exist_ok=True)
+    with open_store(directory) as store:
+        store.put_many(synthetic_coins(size))
+        store.export_json()
+
+
+def host_info():
+    import numpy
+    import PIL
+
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "pillow": PIL.__version__,
+        "cpus": os.cpu_count(),
+    }
+
+
+def run_suite(cases, sizes, images, repeat):
+    """
+    Exécute les cas demandés.
+
+    Returns:
+        Dict {"cas/paramètre": {items, seconds, ms_per_item, per_second, peak_mb}}
+    """
+    ctx = multiprocessing.get_context("spawn")
+    work_dir = Path(tempfile.mkdtemp(prefix="bench_suite_"))
+    results = {}
+    try:
+        runs = []
+        if any(name in IMAGE_CASES for name in cases):
+            print(f"🖼️  Génération de {images} photos 1848x4000...")
+            session = [str(path) for path in make_session(work_dir / "session", images)]
+            runs += [(name, f"{name}/{images}", None, session) for name in cases if name in IMAGE_CASES]
+        for size in sizes:
+            if any(name not in IMAGE_CASES for name in cases):
+                print(f"🗃️  Génération de {size} pièces fictives...")
+                data_dir = work_dir / f"metadata_{size}"
+                make_metadata(data_dir, size)
+                runs += [(name, f"{name}/{size}", str(data_dir), size) for name in cases if name not in IMAGE_CASES]
+
+        for name, key, source_dir, param in runs:
+            with ctx.Pool(1) as pool:
+                result = pool.apply(run_case, (name, source_dir, param, repeat))
+            seconds = result["seconds"]
+            results[key] = {
+                "items": result["items"],
+                "seconds": seconds,
+                "ms_per_item": seconds * 1000 / result["items"],
+                "per_second": result["items"] / seconds if seconds else None,
+                "peak_mb": result["peak_kb"] / 1024,
+            }
+            print(f"   {key:<24} {results[key]['ms_per_item']:>10.3f} ms/élément "
+                  f"{results[key]['per_second']:>10.0f} /s {results[key]['peak_mb']:>8.1f} Mo")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(old_path, new_path, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare deux exécutions: temps par élément et pic mémoire de chaque cas.
+
+    Returns:
+        Liste des régressions (cas, mesure, ancien, nouveau)
+    """
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    if old.get("host", {}).get("platform") != new.get("host", {}).get("platform"):
+        print("⚠️  Exécutions sur des machines différentes: comparaison indicative")
+
+    limit = 1 + threshold / 100
+    regressions = []
+    print(f"{'Cas':<24} {'ms/élément':>21} {'écart':>8}  {'pic mémoire (Mo)':>19} {'écart':>8}")
+    print("-" * 86)
+    for key in sorted(set(old["results"]) | set(new["results"])):
+        before, after = old["results"].get(key), new["results"].get(key)
+        if not before or not after:
+            missing = "(absent de l'ancien)" if not before else "(absent du nouveau)"
+            print(f"{key:<24} {missing:>21}")
+            continue
+        time_ratio = after["ms_per_item"] / before["ms_per_item"] if before["ms_per_item"] else 1
+        memory_delta = after["peak_mb"] - before["peak_mb"]
+        memory_ratio = after["peak_mb"] / before["peak_mb"] if before["peak_mb"] else 1
+        flags = ""
+        if time_ratio > limit:
+            regressions.append((key, "ms_per_item", before["ms_per_item"], after["ms_per_item"]))
+            flags += " ❌ temps"
+        elif time_ratio < 1 / limit:
+            flags += " ✅ temps"
+        if memory_ratio > limit and memory_delta > MEMORY_NOISE_MB:
+            regressions.append((key, "peak_mb", before["peak_mb"], after["peak_mb"]))
+            flags += " ❌ mémoire"
+        elif memory_ratio < 1 / limit and -memory_delta > MEMORY_NOISE_MB:
+            flags += " ✅ mémoire"
+        print(f"{key:<24} {before['ms_per_item']:>10.3f} → {after['ms_per_item']:<8.3f} {(time_ratio - 1) * 100:>+7.1f}%"
+              f"  {before['peak_mb']:>8.1f} → {after['peak_mb']:<8.1f} {(memory_ratio - 1) * 100:>+7.1f}%{flags}")
+
+    if regressions:
+        print(f"\n❌ {len(regressions)} régressions au-delà de {threshold:g}%")
+    else:
+        print(f"\n✅ Aucune régression au-delà de {threshold:g}%")
+    return regressions
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Banc d'essai du recadrage, de l'encodage et des métadonnées")
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES),
+                        help='Cas à mesurer (défaut: tous)')
+    parser.add_argument('--sizes', nargs='+', type=int, default=list(DEFAULT_SIZES),
+                        help='Nombres de pièces des jeux de métadonnées (défaut: 1000 10000 100000)')
+    parser.add_argument('--images', type=int, default=DEFAULT_IMAGES,
+                        help=f'Photos de la séance synthétique (défaut: {DEFAULT_IMAGES})')
+    parser.add_argument('--repeat', type=int, default=3, help='Passes par cas, la meilleure est retenue (défaut: 3)')
+    parser.add_argument('--output', type=Path, help='Fichier JSON des résultats (défaut: .cache/bench/<date>.json)')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('ANCIEN', 'NOUVEAU'),
+                        help='Comparer deux fichiers de résultats')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f'Écart signalé comme régression, en %% (défaut: {DEFAULT_THRESHOLD:g})')
+    args = parser.parse_args()
+
+    if args.compare:
+        return 1 if compare(*args.compare, threshold=args.threshold) else 0
+
+    started = datetime.now()
+    results = run_suite(args.cases, args.sizes, args.images, max(1, args.repeat))
+    output = args.output or RESULTS_DIR / f"{started:%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "version": RESULTS_VERSION,
+        "started": started.isoformat(timespec="seconds"),
+        "host": host_info(),
+        "params": {"sizes": args.sizes, "images": args.images, "repeat": args.repeat, "updates": UPDATES},
+        "results": results,
+    }
+    tmp_path = output.with_name(output.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, output)
+    print(f"\n📄 Résultats: {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Génère les déclinaisons des photos pour la galerie (vignette 256px, 800px,
+pleine taille) en JPEG et WebP, dans un cache adressé par contenu.
+
+Un index JSON (gallery/cache/renditions/index.json) associe chaque photo
+(chemin relatif à pictures/) à ses déclinaisons; les pages PHP le lisent
+pour servir la plus petite image adaptée.
+"""
+
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image, ImageOps
+
+from crop_images import file_sha256
+from sessions import PICTURES_ROOT
+from gallery_index import refresh_index
+
+ROOT_DIR = Path(__file__).parent.parent
+PICTURES_DIR = PICTURES_ROOT
+CACHE_DIR = ROOT_DIR / "gallery" / "cache" / "renditions"
+INDEX_NAME = "index.json"
+INDEX_VERSION = 1
+
+# Déclinaisons: nom -> plus grand côté en pixels (None = pleine taille)
+RENDITIONS = {
+    "thumb": 256,
+    "medium": 800,
+    "full": None,
+}
+
+# Formats de sortie: extension -> paramètres d'enregistrement Pillow
+FORMATS = {
+    "jpg": {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True},
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+}
+
+EXTENSIONS = {'.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG'}
+
+
+def rendition_path(digest, name, ext):
+    """Chemin relatif (au cache) d'une déclinaison, dérivé du hash de la source."""
+    return f"{digest[:2]}/{digest[:20]}_{name}.{ext}"
+
+
+def image_key(source, pictures_dir=PICTURES_DIR):
+    """Clé d'index d'une photo: chemin relatif à pictures/ (ex: 2025-11-02_19h15/xxx.jpg)."""
+    source = Path(source).resolve()
+    try:
+        return source.relative_to(PICTURES_DIR.resolve()).as_posix()
+    except ValueError:
+        return source.relative_to(Path(pictures_dir).resolve()).as_posix()
+
+
+def load_index(cache_dir=CACHE_DIR):
+    """Charge l'index des déclinaisons (vide si absent ou illisible)."""
+    try:
+        with open(cache_dir / INDEX_NAME, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != INDEX_VERSION:
+        return {}
+    return data.get('images', {})
+
+
+def save_index(images, cache_dir=CACHE_DIR):
+    """Écrit l'index des déclinaisons de façon atomique."""
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    index_path = cache_dir / INDEX_NAME
+    tmp_path = index_path.with_name(index_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': INDEX_VERSION, 'images': images}, f, separators=(',', ':'), sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+
+def renditions_exist(entry, cache_dir=CACHE_DIR):
+    """Vérifie que tous les fichiers référencés par une entrée sont présents."""
+    renditions = entry.get('renditions', {})
+    if set(renditions) != set(RENDITIONS):
+        return False
+    return all(
+        set(files) == set(FORMATS) and all((cache_dir / rel).exists() for rel in files.values())
+        for files in renditions.values()
+    )
+
+
+def decode(source, max_edge):
+    """
+    Décode une photo orientée selon son EXIF.
+
+    Pour les déclinaisons réduites, le mode draft du décodeur JPEG décode
+    directement à 1/2, 1/4 ou 1/8 de la résolution, sans passer par
+    l'image complète.
+    """
+    with Image.open(source) as img:
+        if max_edge:
+            img.draft('RGB', (max_edge, max_edge))
+        icc_profile = img.info.get('icc_profile')
+        img = ImageOps.exif_transpose(img)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    if max_edge:
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    return img, icc_profile
+
+
+def build_renditions(source, digest, cache_dir=CACHE_DIR):
+    """
+    Produit toutes les déclinaisons d'une photo dans le cache.
+
+    Returns:
+        Dict {déclinaison: {extension: chemin relatif}} et dimensions pleine taille
+    """
+    renditions = {}
+    full_size = None
+
+    for name, max_edge in RENDITIONS.items():
+        img, icc_profile = decode(source, max_edge)
+        if max_edge is None:
+            full_size = img.size
+        renditions[name] = write_rendition(img, digest, name, icc_profile, cache_dir)
+
+    return renditions, full_size
+
+
+def renditions_from_frame(frame, digest, icc_profile=None, cache_dir=CACHE_DIR):
+    """
+    Produit les déclinaisons à partir d'une image déjà décodée et orientée
+    (pipeline à décodage unique), sans relire la photo.
+
+    Returns:
+        Dict {déclinaison: {extension: chemin relatif}}
+    """
+    if frame.mode not in ('RGB', 'L'):
+        frame = frame.convert('RGB')
+    renditions = {}
+    for name, max_edge in RENDITIONS.items():
+        img = frame
+        if max_edge and max(frame.size) > max_edge:
+            img = frame.copy()
+            img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        renditions[name] = write_rendition(img, digest, name, icc_profile, cache_dir)
+    return renditions
+
+
+def write_rendition(img, digest, name, icc_profile=None, cache_dir=CACHE_DIR):
+    """Écrit une déclinaison dans chaque format (si absente du cache) et renvoie {extension: chemin relatif}."""
+    files = {}
+    for ext, params in FORMATS.items():
+        rel = rendition_path(digest, name, ext)
+        target = cache_dir / rel
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            # Nom propre au processus: deux photos identiques peuvent être déclinées en parallèle
+            tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+            extra = {'icc_profile': icc_profile} if icc_profile else {}
+            img.save(tmp, **params, **extra)
+            os.replace(tmp, target)
+        files[ext] = rel
+    return files
+
+
+def index_entry(source, digest, renditions, size):
+    """Entrée d'index d'une photo et de ses déclinaisons."""
+    stat = source.stat()
+    return {
+        'sha256': digest,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'width': size[0],
+        'height': size[1],
+        'renditions': renditions,
+    }
+
+
+def process_image(source, cache_dir=CACHE_DIR):
+    """Worker: calcule le hash d'une photo et génère ses déclinaisons."""
+    try:
+        digest = file_sha256(source)
+        renditions, size = build_renditions(source, digest, cache_dir)
+        return True, index_entry(source, digest, renditions, size), f"✓ {source.name}"
+    except Exception as e:
+        return False, None, f"✗ {source.name}: erreur - {str(e)}"
+
+
+def is_fresh(source, entry, cache_dir=CACHE_DIR):
+    """Une photo est à jour si sa taille et sa date n'ont pas changé et que ses fichiers existent."""
+    if not entry:
+        return False
+    stat = source.stat()
+    return (
+        stat.st_size == entry.get('size')
+        and stat.st_mtime_ns == entry.get('mtime_ns')
+        and renditions_exist(entry, cache_dir)
+    )
+
+
+def prune_cache(images, cache_dir=CACHE_DIR):
+    """Supprime les fichiers du cache qui ne sont plus référencés par l'index."""
+    referenced = {
+        rel
+        for entry in images.values()
+        for files in entry['renditions'].values()
+        for rel in files.values()
+    }
+    removed = 0
+    for path in cache_dir.glob('*/*'):
+        if path.is_file() and path.relative_to(cache_dir).as_posix() not in referenced:
+            path.unlink()
+            removed += 1
+    return removed
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Génère les vignettes et versions WebP des photos pour la galerie"
+    )
+    parser.add_argument(
+        'directory',
+        nargs='?',
+        default=str(PICTURES_DIR),
+        help='Répertoire des photos (défaut: pictures)'
+    )
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='Nombre de processus en parallèle (défaut: 1, 0 = tous les cœurs)'
+    )
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help='Supprimer les déclinaisons qui ne correspondent plus à aucune photo'
+    )
+    args = parser.parse_args()
+
+    pictures_dir = Path(args.directory)
+    if not pictures_dir.exists():
+        print(f"Erreur: le répertoire {pictures_dir} n'existe pas")
+        return 1
+
+    jobs = args.jobs or os.cpu_count() or 1
+    images = load_index()
+
+    sources = sorted(f for f in pictures_dir.rglob('*') if f.suffix in EXTENSIONS and f.is_file())
+    keys = {source: image_key(source, pictures_dir) for source in sources}
+    stale = [source for source in sources if not is_fresh(source, images.get(keys[source]))]
+
+    print(f"🖼️  {len(sources)} photos, {len(sources) - len(stale)} déjà à jour, {len(stale)} à générer")
+
+    success_count = 0
+    error_count = 0
+
+    if stale:
+        if jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            results = executor.map(process_image, stale, chunksize=4)
+        else:
+            executor = None
+            results = map(process_image, stale)
+
+        try:
+            for source, (success, entry, message) in zip(stale, results):
+                print(message)
+                if success:
+                    images[keys[source]] = entry
+                    success_count += 1
+                else:
+                    error_count += 1
+        finally:
+            if executor:
+                executor.shutdown()
+            save_index(images)
+
+    # Oublier les photos supprimées du répertoire traité: ses clés absentes du parcours. Les
+    # clés des autres répertoires (dont celles d'un répertoire hors de pictures/) restent
+    scope = image_key(pictures_dir, pictures_dir)
+    prefix = "" if scope == "." else scope + "/"
+    seen = set(keys.values())
+    for key in [k for k in images if k.startswith(prefix) and k not in seen and not (PICTURES_DIR / k).exists()]:
+        del images[key]
+    save_index(images)
+    refresh_index()
+
+    if args.prune:
+        removed = prune_cache(images)
+        print(f"🧹 {removed} fichiers orphelins supprimés du cache")
+
+    print(f"\n✅ Terminé: {success_count} générées, {error_count} erreurs")
+    print(f"📁 Index: {CACHE_DIR / INDEX_NAME}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
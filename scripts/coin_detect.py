@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Détection vectorisée (NumPy) du disque de la pièce sur une photo.
+
+La photo est décodée en mode draft JPEG (1/8 de la résolution), la couleur
+du fond est estimée sur le pourtour, puis un seuil d'Otsu sur la distance
+au fond donne le masque de la pièce. Les moments du masque fournissent le
+centre et le rayon du cercle, ramenés en pleine résolution.
+
+Environ 40 images/s sur un cœur pour des photos 1848x4000.
+
+Usage (détection + mesure de débit):
+    python scripts/coin_detect.py pictures/2025-11-02_19h15 --benchmark
+"""
+
+import os
+import sys
+import math
+import time
+from collections import namedtuple, OrderedDict
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+# Taille de travail visée (grand côté) pour la détection
+DETECT_SIZE = 256
+# Largeur de la bande du pourtour utilisée pour estimer le fond
+BORDER = 4
+# Écart minimal au fond (distance RGB) pour qu'un pixel compte comme pièce
+MIN_THRESHOLD = 25.0
+# Fraction minimale de l'image couverte par la pièce pour valider la détection
+MIN_AREA_FRACTION = 0.005
+
+# Cercle en coordonnées pleine résolution de l'image orientée
+Circle = namedtuple("Circle", "cx cy radius score")
+
+# Disques déjà trouvés dans ce processus (cf. photo_quality), par fichier et version
+KNOWN_COINS_MAX = 4096
+_known_coins = OrderedDict()
+
+
+def load_small(image_path, size=DETECT_SIZE):
+    """
+    Décode une version réduite et orientée de la photo.
+
+    Returns:
+        Tuple (tableau float32 HxWx3, dimensions pleine résolution orientées)
+    """
+    with Image.open(image_path) as img:
+        full_size = img.size
+        img.draft("RGB", (size, size))
+        drafted = img.size
+        small = ImageOps.exif_transpose(img)
+        if small.mode != "RGB":
+            small = small.convert("RGB")
+    # Orientation à 90°: le repère orienté échange largeur et hauteur
+    if small.size != drafted:
+        full_size = full_size[::-1]
+    if max(small.size) > size:
+        small = small.reduce(math.ceil(max(small.size) / size))
+    return np.asarray(small, dtype=np.float32), full_size
+
+
+def reduce_frame(img, size=DETECT_SIZE, transpose=None):
+    """
+    Version réduite d'une image déjà décodée, sans nouveau décodage.
+
+    Args:
+        transpose: Méthode Image.Transpose qui oriente l'image (None si déjà orientée)
+
+    Returns:
+        Tableau float32 HxWx3
+    """
+    small = img.reduce(math.ceil(max(img.size) / size)) if max(img.size) > size else img
+    if transpose is not None:
+        small = small.transpose(transpose)
+    if small.mode != "RGB":
+        small = small.convert("RGB")
+    return np.asarray(small, dtype=np.float32)
+
+
+def otsu_threshold(values, bins=128):
+    """Seuil d'Otsu vectorisé sur un tableau de valeurs positives."""
+    # Histogramme à pas constant par bincount (np.histogram est ~3x plus lent)
+    low, high = float(values.min()), float(values.max())
+    step = (high - low) / bins or 1.0
+    index = np.minimum(((values - low) / step).astype(np.intp), bins - 1)
+    hist = np.bincount(index.ravel(), minlength=bins).astype(np.float64)
+    centers = low + (np.arange(bins) + 0.5) * step
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    sum_bg = np.cumsum(hist * centers)
+    mean_bg = sum_bg / np.maximum(weight_bg, 1)
+    mean_fg = (sum_bg[-1] - sum_bg) / np.maximum(weight_fg, 1)
+    between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    return centers[int(np.argmax(between))]
+
+
+def _filter3(mask, op):
+    """Filtre 3x3 séparable (op = np.logical_and pour éroder, np.logical_or pour dilater)."""
+    rows = np.pad(mask, ((1, 1), (0, 0)))
+    mask = op(op(rows[:-2], rows[1:-1]), rows[2:])
+    cols = np.pad(mask, ((0, 0), (1, 1)))
+    return op(op(cols[:, :-2], cols[:, 1:-1]), cols[:, 2:])
+
+
+def clean_mask(mask):
+    """Ouverture 3x3 (érosion puis dilatation) qui efface le bruit isolé."""
+    return _filter3(_filter3(mask, np.logical_and), np.logical_or)
+
+
+def detect_circle(pixels):
+    """
+    Trouve le disque de la pièce dans une image réduite.
+
+    Args:
+        pixels: Tableau float32 HxWx3
+
+    Returns:
+        Circle en coordonnées de l'image réduite, ou None
+    """
+    h, w, _ = pixels.shape
+    border = np.concatenate([
+        pixels[:BORDER].reshape(-1, 3), pixels[-BORDER:].reshape(-1, 3),
+        pixels[:, :BORDER].reshape(-1, 3), pixels[:, -BORDER:].reshape(-1, 3),
+    ])
+    background = np.median(border, axis=0)
+
+    # Canal par canal: sum(axis=2) sur un axe de 3 éléments est lent
+    red, green, blue = (pixels[..., c] - background[c] for c in range(3))
+    distance = np.sqrt(red * red + green * green + blue * blue)
+    threshold = max(otsu_threshold(distance), MIN_THRESHOLD)
+    mask = clean_mask(distance > threshold)
+
+    area = mask.sum()
+    if area < MIN_AREA_FRACTION * h * w:
+        return None
+
+    # Moments d'ordre 0 et 1: centre de masse (au centre des pixels)
+    ys, xs = np.nonzero(mask)
+    cx, cy = xs.mean() + 0.5, ys.mean() + 0.5
+
+    # Rayon du disque de même aire; l'étendue (percentiles, insensible aux
+    # pixels isolés) prend le relais quand des reflets trouent le masque
+    extent = max(np.ptp(np.percentile(xs, [0.5, 99.5])), np.ptp(np.percentile(ys, [0.5, 99.5]))) + 1
+    radius = max(math.sqrt(area / math.pi), extent / 2)
+
+    # Circularité: aire du masque rapportée à celle du cercle trouvé
+    score = float(min(1.0, area / (math.pi * radius * radius)))
+    return Circle(float(cx), float(cy), float(radius), score)
+
+
+def _coin_key(image_path):
+    stat = os.stat(image_path)
+    return os.fspath(image_path), stat.st_size, stat.st_mtime_ns
+
+
+def remember_coin(image_path, circle):
+    """Retient le disque trouvé sur une photo: detect_coin le renverra sans la redécoder."""
+    _known_coins[_coin_key(image_path)] = circle
+    if len(_known_coins) > KNOWN_COINS_MAX:
+        _known_coins.popitem(last=False)
+
+
+def detect_coin(image_path):
+    """
+    Détecte la pièce d'une photo (ou renvoie le disque retenu par remember_coin
+    si le fichier n'a pas changé depuis).
+
+    Returns:
+        Circle en pleine résolution dans le repère de l'image orientée, ou None
+    """
+    key = _coin_key(image_path)
+    if key in _known_coins:
+        return _known_coins[key]
+    pixels, full_size = load_small(image_path)
+    return scale_circle(detect_circle(pixels), pixels.shape, full_size)
+
+
+def detect_coin_frame(img, full_size, transpose=None):
+    """
+    Détecte la pièce sur une image déjà décodée (voir reduce_frame).
+
+    Args:
+        full_size: Dimensions de l'image orientée
+
+    Returns:
+        Circle en pleine résolution dans le repère de l'image orientée, ou None
+    """
+    pixels = reduce_frame(img, DETECT_SIZE, transpose)
+    return scale_circle(detect_circle(pixels), pixels.shape, full_size)
+
+
+def scale_circle(circle, shape, full_size):
+    """Ramène un cercle trouvé sur une image réduite (shape HxWx3) en pleine résolution."""
+    if circle is None:
+        return None
+    # Échelle propre à chaque axe: les réductions arrondissent les dimensions
+    scale_x = full_size[0] / shape[1]
+    scale_y = full_size[1] / shape[0]
+    radius = circle.radius * (scale_x + scale_y) / 2
+    return Circle(circle.cx * scale_x, circle.cy * scale_y, radius, circle.score)
+
+
+def circle_box(circle, size, margin=0.0):
+    """Boîte englobante d'un cercle, élargie de margin * diamètre et bornée à l'image."""
+    r = circle.radius * (1 + 2 * margin)
+    return (
+        max(0, int(circle.cx - r)),
+        max(0, int(circle.cy - r)),
+        min(size[0], int(math.ceil(circle.cx + r))),
+        min(size[1], int(math.ceil(circle.cy + r))),
+    )
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Détecte le disque de la pièce sur chaque photo")
+    parser.add_argument('directory', nargs='?', default='pictures/2025-11-02_19h15',
+                        help='Répertoire des photos (défaut: pictures/2025-11-02_19h15)')
+    parser.add_argument('--benchmark', action='store_true', help='Mesurer le débit (images/s sur un cœur)')
+    args = parser.parse_args()
+
+    images = sorted(Path(args.directory).glob("*.jpg"))
+    if not images:
+        print(f"❌ Aucune image trouvée dans {args.directory}")
+        return 1
+
+    start = time.perf_counter()
+    results = [(path, detect_coin(path)) for path in images]
+    elapsed = time.perf_counter() - start
+
+    if not args.benchmark:
+        for path, circle in results:
+            if circle:
+                print(f"✓ {path.name}: centre ({circle.cx:.0f}, {circle.cy:.0f}), "
+                      f"rayon {circle.radius:.0f} px, circularité {circle.score:.2f}")
+            else:
+                print(f"✗ {path.name}: aucune pièce détectée")
+
+    found = sum(1 for _, circle in results if circle)
+    print(f"\n{found}/{len(images)} pièces détectées, {len(images) / elapsed:.1f} images/s "
+          f"({elapsed * 1000 / len(images):.1f} ms/image)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
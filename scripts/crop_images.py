@@ -1,49 +1,219 @@
 #!/usr/bin/env python3
 """
 Script pour recadrer les photos de pièces de monnaie du format portrait (1848x4000)
-au format carré (1848x1848) en recadrant depuis le centre.
+au format carré (1848x1848), centré sur la pièce détectée (ou sur le centre
+de l'image si aucune pièce n'est trouvée).
+
+Les photos floues, mal exposées ou sans pièce vont dans le rapport des photos
+à refaire (voir photo_quality); avec --screen skip, elles ne sont pas recadrées.
 """
 
 import os
 import sys
+import json
+import shutil
+import hashlib
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from PIL import Image
 
+from metrics import METRICS
+
+# Manifeste des images déjà traitées (un par répertoire)
+MANIFEST_NAME = '.crop_manifest.json'
+MANIFEST_VERSION = 1
+
+# Tag EXIF Orientation et transposition correspondante (cf. ImageOps.exif_transpose)
+EXIF_ORIENTATION_TAG = 0x0112
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def get_orientation(img):
+    """Renvoie la valeur EXIF Orientation d'une image (1 si absente)."""
+    return img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+
+
+def display_size(raw_size, orientation):
+    """Dimensions de l'image une fois l'orientation EXIF appliquée."""
+    width, height = raw_size
+    if orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def plan_square_crop(size, target_size, center=None):
+    """
+    Calcule la boîte carrée de côté target_size.
+
+    Args:
+        size: Dimensions (largeur, hauteur) de l'image affichée
+        target_size: Côté du carré
+        center: Centre (x, y) visé dans le repère affiché (None = centre de
+            l'image); la boîte est décalée pour rester dans l'image
+
+    Returns:
+        Boîte (left, top, right, bottom) dans le repère affiché
+    """
+    width, height = size
+    if center is None:
+        left = (width - target_size) // 2
+        top = (height - target_size) // 2
+    else:
+        left = min(max(0, int(round(center[0] - target_size / 2))), width - target_size)
+        top = min(max(0, int(round(center[1] - target_size / 2))), height - target_size)
+    return left, top, left + target_size, top + target_size
+
+
+def display_box_to_raw(box, raw_size, orientation):
+    """
+    Convertit une boîte du repère affiché vers le repère capteur (avant EXIF).
+
+    Permet de recadrer l'image brute puis de ne tourner que la zone recadrée.
+    """
+    width, height = raw_size
+    left, top, right, bottom = box
+    inverse = {
+        1: lambda x, y: (x, y),
+        2: lambda x, y: (width - x, y),
+        3: lambda x, y: (width - x, height - y),
+        4: lambda x, y: (x, height - y),
+        5: lambda x, y: (y, x),
+        6: lambda x, y: (y, height - x),
+        7: lambda x, y: (width - y, height - x),
+        8: lambda x, y: (width - y, x),
+    }.get(orientation, lambda x, y: (x, y))
+    x1, y1 = inverse(left, top)
+    x2, y2 = inverse(right, bottom)
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
 
-def crop_image_to_square(image_path, output_path=None, target_size=1848):
+def save_atomic(img, save_path, **params):
     """
-    Recadre une image au format carré depuis le centre.
+    Enregistre une image via un fichier temporaire puis un renommage.
+
+    Un crash pendant l'encodage laisse l'original intact.
+    """
+    save_path = Path(save_path)
+    fd, tmp_name = tempfile.mkstemp(dir=save_path.parent, prefix=f'.{save_path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with METRICS.stage('encode') as event:
+                img.save(f, **params)
+                event['written'] = f.tell()
+            with METRICS.stage('save'):
+                f.flush()
+                os.fsync(f.fileno())
+        if save_path.exists():
+            shutil.copymode(save_path, tmp_name)
+        os.replace(tmp_name, save_path)
+    except BaseException:
+        if os.path.exists(tmp_name):
+            os.unlink(tmp_name)
+        raise
+
+
+def crop_square(img, target_size=1848, center=None):
+    """
+    Recadre une image ouverte au carré de target_size autour de center.
+
+    La boîte est calculée dans l'orientation du capteur: seule la zone
+    recadrée est tournée selon l'EXIF, pas l'image entière.
+
+    Args:
+        img: Image PIL ouverte (décodée ou non)
+        center: Centre (x, y) visé dans le repère de l'image orientée (None = centre)
+
+    Returns:
+        Tuple (image carrée orientée, paramètres d'enregistrement, boîte dans le repère orienté)
+    """
+    orientation = get_orientation(img)
+    width, height = display_size(img.size, orientation)
+    box = plan_square_crop((width, height), target_size, center)
+    raw_box = display_box_to_raw(box, img.size, orientation)
+
+    # Décodage explicite (sinon fait par crop) pour le mesurer à part
+    if getattr(img, 'tile', None):
+        with METRICS.stage('decode') as event:
+            img.load()
+            if img.filename:
+                event['read'] = os.path.getsize(img.filename)
+
+    # Recadrer puis orienter uniquement la zone conservée
+    with METRICS.stage('crop'):
+        cropped_img = img.crop(raw_box)
+    method = ORIENTATION_TRANSPOSE.get(orientation)
+    if method is not None:
+        with METRICS.stage('transpose'):
+            cropped_img = cropped_img.transpose(method)
+
+    exif = img.getexif()
+    if EXIF_ORIENTATION_TAG in exif:
+        exif[EXIF_ORIENTATION_TAG] = 1
+
+    params = {'format': img.format, 'quality': 95, 'optimize': True}
+    if exif:
+        params['exif'] = exif.tobytes()
+    if img.info.get('icc_profile'):
+        params['icc_profile'] = img.info['icc_profile']
+    return cropped_img, params, box
+
+
+def crop_image_to_square(image_path, output_path=None, target_size=1848, detect=True):
+    """
+    Recadre une image au format carré autour de la pièce.
     Fonctionne pour les images portrait ou paysage.
 
+    Le disque de la pièce est repéré sur une version réduite de la photo
+    (voir coin_detect); sans détection, le carré est pris au centre.
+    Le recadrage lui-même est fait par crop_square. Les données EXIF
+    (orientation remise à 1) et le profil ICC sont conservés.
+
     Args:
         image_path: Chemin vers l'image source
         output_path: Chemin de sortie (None = écrase l'original)
         target_size: Taille du carré final (défaut: 1848)
+        detect: Centrer le carré sur la pièce détectée (False = centre de l'image)
     """
+    image_path = Path(image_path)
     try:
         with Image.open(image_path) as img:
-            # Appliquer l'orientation EXIF si présente
-            from PIL import ImageOps
-            img = ImageOps.exif_transpose(img)
+            # Dimensions et orientation lues dans l'en-tête, sans décoder
+            orientation = get_orientation(img)
+            width, height = display_size(img.size, orientation)
 
-            width, height = img.size
+            # Déjà au bon format: ne pas réencoder (évite une perte JPEG)
+            if width == target_size and height == target_size and not output_path:
+                return True, f"= {image_path.name}: déjà au format {target_size}x{target_size}"
 
             # Vérifier que l'image est assez grande
             if width >= target_size and height >= target_size:
-                # Calculer les coordonnées pour recadrer depuis le centre
-                left = (width - target_size) // 2
-                top = (height - target_size) // 2
-                right = left + target_size
-                bottom = top + target_size
-
-                # Recadrer l'image
-                cropped_img = img.crop((left, top, right, bottom))
+                center = None
+                if detect:
+                    from coin_detect import detect_coin
+                    with METRICS.stage('detect') as event:
+                        circle = detect_coin(image_path)
+                        event['read'] = image_path.stat().st_size
+                    if circle:
+                        center = (circle.cx, circle.cy)
+                cropped_img, params, box = crop_square(img, target_size, center)
 
                 # Sauvegarder
                 save_path = output_path if output_path else image_path
-                cropped_img.save(save_path, quality=95, optimize=True)
+                save_atomic(cropped_img, save_path, **params)
 
-                return True, f"✓ {image_path.name}: {width}x{height} → {target_size}x{target_size}"
+                where = f" (pièce en {box[0]},{box[1]})" if center else ""
+                return True, f"✓ {image_path.name}: {width}x{height} → {target_size}x{target_size}{where}"
             else:
                 return False, f"✗ {image_path.name}: dimensions insuffisantes ({width}x{height})"
 
@@ -51,14 +221,184 @@ def crop_image_to_square(image_path, output_path=None, target_size=1848):
         return False, f"✗ {image_path.name}: erreur - {str(e)}"
 
 
-def process_directory(directory, recursive=True, dry_run=False):
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Calcule le SHA-256 du contenu d'un fichier (sans décoder l'image)."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(directory):
+    """
+    Charge le manifeste de recadrage d'un répertoire.
+
+    Returns:
+        Dict {nom de fichier: entrée} (vide si absent ou illisible)
+    """
+    manifest_path = Path(directory) / MANIFEST_NAME
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != MANIFEST_VERSION:
+        return {}
+    return data.get('files', {})
+
+
+def save_manifest(directory, entries):
+    """Écrit le manifeste d'un répertoire de façon atomique."""
+    manifest_path = Path(directory) / MANIFEST_NAME
+    tmp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': entries}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def manifest_entry(image_path, target_size):
+    """Construit l'entrée de manifeste d'une image qui vient d'être traitée."""
+    stat = image_path.stat()
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': file_sha256(image_path),
+        'target_size': target_size,
+    }
+
+
+def is_up_to_date(image_path, entry, target_size):
+    """
+    Indique si une image a déjà été recadrée à target_size.
+
+    La taille et la date de modification suffisent dans le cas courant, sans
+    ouvrir le fichier. Si seule la date a changé (copie, touch), le hash du
+    contenu tranche et l'entrée est mise à jour.
+    """
+    if not entry or entry.get('target_size') != target_size:
+        return False
+
+    stat = image_path.stat()
+    if stat.st_size != entry.get('size'):
+        return False
+    if stat.st_mtime_ns == entry.get('mtime_ns'):
+        return True
+
+    if file_sha256(image_path) == entry.get('sha256'):
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+    return False
+
+
+def screen_and_crop(image_path, screen="off", min_sharpness=None, **kwargs):
+    """
+    Recadre une image après contrôle qualité (voir photo_quality).
+
+    Selon screen: "off" sans contrôle, "report" une photo à refaire (floue,
+    mal exposée, sans pièce) est signalée mais recadrée quand même, "skip"
+    elle n'est pas recadrée. Le disque trouvé par le contrôle est réutilisé
+    par la détection.
+
+    Returns:
+        Tuple (succès, message, Quality ou None sans contrôle)
+    """
+    image_path = Path(image_path)
+    quality = None
+    warning = None
+    if screen != "off":
+        from photo_quality import assess, describe
+        try:
+            with METRICS.stage('screen') as event:
+                quality = assess(image_path, min_sharpness)
+                event['read'] = image_path.stat().st_size
+        except Exception as e:
+            return False, f"✗ {image_path.name}: erreur - {str(e)}", None
+        if quality.reasons:
+            warning = f"📸 {image_path.name}: à refaire ({describe(quality)})"
+            if screen == "skip":
+                return False, warning, quality
+    success, message = crop_image_to_square(image_path, **kwargs)
+    if warning:
+        message = f"{message}\n{warning}"
+    return success, message, quality
+
+
+def crop_with_metrics(image_path, **kwargs):
+    """Worker: screen_and_crop suivi des mesures du processus, renvoyées au principal."""
+    return screen_and_crop(image_path, **kwargs), METRICS.drain()
+
+
+def iter_crop_results(image_files, jobs=1, max_in_flight=None, target_size=1848, detect=True,
+                      screen="off", min_sharpness=None):
+    """
+    Recadre une liste d'images et renvoie les résultats dans l'ordre de la liste.
+
+    Avec jobs > 1, les recadrages sont répartis sur un pool de processus.
+    Au plus max_in_flight images sont soumises en même temps (défaut: 2 par
+    worker), ce qui borne la mémoire quelle que soit la taille de la session.
+
+    Args:
+        image_files: Liste ordonnée des images à recadrer
+        jobs: Nombre de processus (1 = séquentiel)
+        max_in_flight: Nombre maximum d'images en cours de traitement
+        target_size: Taille du carré final
+        detect: Centrer le carré sur la pièce détectée
+        screen: Contrôle qualité avant recadrage ("off", "report" ou "skip")
+        min_sharpness: Netteté minimale du contrôle (None = défaut de photo_quality)
+
+    Yields:
+        Tuples (succès, message, qualité) renvoyés par screen_and_crop
+    """
+    options = dict(target_size=target_size, detect=detect, screen=screen, min_sharpness=min_sharpness)
+    if jobs <= 1:
+        crop = partial(screen_and_crop, **options)
+        for image_file in image_files:
+            yield crop(image_file)
+        return
+
+    crop = partial(crop_with_metrics, **options)
+
+    max_in_flight = max_in_flight or jobs * 2
+    pending = deque()
+    files = iter(image_files)
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for image_file in files:
+            pending.append(executor.submit(crop, image_file))
+            if len(pending) >= max_in_flight:
+                break
+
+        while pending:
+            # Attendre la plus ancienne pour conserver l'ordre trié
+            result, events = pending.popleft().result()
+            METRICS.merge(events)
+            yield result
+            next_file = next(files, None)
+            if next_file is not None:
+                pending.append(executor.submit(crop, next_file))
+
+
+def process_directory(directory, recursive=True, dry_run=False, jobs=1,
+                      target_size=1848, force=False, detect=True, screen="report", min_sharpness=None):
     """
     Traite tous les fichiers image dans un répertoire.
 
+    Les images inchangées depuis leur dernier recadrage (d'après le manifeste
+    de leur répertoire) sont ignorées sans être ouvertes. Les photos à refaire
+    vont dans le rapport reshoot_report.csv; avec screen="skip", elles ne sont
+    pas recadrées et seront recontrôlées au prochain passage.
+
     Args:
         directory: Répertoire à traiter
         recursive: Traiter les sous-répertoires
         dry_run: Mode simulation (ne modifie pas les fichiers)
+        jobs: Nombre de processus pour le recadrage (0 = tous les cœurs)
+        target_size: Taille du carré final
+        force: Ignorer le manifeste et retraiter toutes les images
+        detect: Centrer le carré sur la pièce détectée (False = centre de l'image)
+        screen: Contrôle qualité avant recadrage ("off", "report" ou "skip")
+        min_sharpness: Netteté minimale du contrôle (None = défaut de photo_quality)
     """
     extensions = {'.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG'}
     directory = Path(directory)
@@ -77,37 +417,88 @@ def process_directory(directory, recursive=True, dry_run=False):
         print(f"Aucune image trouvée dans {directory}")
         return
 
-    print(f"{'[MODE SIMULATION] ' if dry_run else ''}Traitement de {len(image_files)} images...\n")
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
 
-    success_count = 0
-    error_count = 0
+    image_files = sorted(image_files)
+
+    # Écarter les images déjà traitées d'après les manifestes
+    manifests = {}
+    to_process = []
+    for image_file in image_files:
+        if image_file.parent not in manifests:
+            manifests[image_file.parent] = {} if force else load_manifest(image_file.parent)
+        entry = manifests[image_file.parent].get(image_file.name)
+        if not is_up_to_date(image_file, entry, target_size):
+            to_process.append(image_file)
+    skipped_count = len(image_files) - len(to_process)
+
+    if skipped_count:
+        print(f"{skipped_count} images déjà traitées ignorées (manifeste)")
 
-    for image_file in sorted(image_files):
-        if dry_run:
+    if not to_process:
+        if not dry_run:
+            # Conserver les dates rafraîchies par is_up_to_date
+            for manifest_dir, entries in manifests.items():
+                if entries:
+                    save_manifest(manifest_dir, entries)
+        print("Rien à faire")
+        return
+
+    if dry_run:
+        print(f"[MODE SIMULATION] Traitement de {len(to_process)} images...\n")
+        for image_file in to_process:
             try:
                 with Image.open(image_file) as img:
                     width, height = img.size
                     print(f"[DRY-RUN] {image_file.name}: {width}x{height}")
             except Exception as e:
                 print(f"[DRY-RUN] ✗ {image_file.name}: erreur - {str(e)}")
-        else:
-            success, message = crop_image_to_square(image_file)
+        return
+
+    workers = f" ({jobs} processus)" if jobs > 1 else ""
+    print(f"Traitement de {len(to_process)} images{workers}...\n")
+
+    success_count = 0
+    error_count = 0
+    checked = []
+    reshoot = []
+    results = iter_crop_results(to_process, jobs=jobs, target_size=target_size, detect=detect,
+                                screen=screen, min_sharpness=min_sharpness)
+
+    try:
+        for image_file, (success, message, quality) in zip(to_process, results):
             print(message)
+            if quality is not None:
+                checked.append(image_file)
+                if quality.reasons:
+                    reshoot.append((image_file, quality))
             if success:
                 success_count += 1
-            else:
+                manifests[image_file.parent][image_file.name] = manifest_entry(image_file, target_size)
+            elif not (quality and quality.reasons):
                 error_count += 1
+    finally:
+        # Sauvegarder même en cas d'interruption pour ne pas refaire le travail
+        for manifest_dir, entries in manifests.items():
+            if entries:
+                save_manifest(manifest_dir, entries)
+        if checked:
+            from photo_quality import update_report, report_row, REPORT_FILE
+            total = update_report(checked, [report_row(path, quality) for path, quality in reshoot])
 
-    if not dry_run:
-        print(f"\n{'='*60}")
-        print(f"Traitement terminé: {success_count} succès, {error_count} erreurs")
+    print(f"\n{'='*60}")
+    print(f"Traitement terminé: {success_count} succès, {error_count} erreurs, {skipped_count} ignorées")
+    if reshoot:
+        print(f"📸 {len(reshoot)} photos à refaire, voir {REPORT_FILE} ({total} au total)")
 
 
 def main():
     import argparse
+    from photo_quality import SCREEN_MODES, DEFAULT_SCREEN, MIN_SHARPNESS
 
     parser = argparse.ArgumentParser(
-        description="Recadre les photos de pièces au format carré (1848x1848) depuis le centre"
+        description="Recadre les photos de pièces au format carré (1848x1848) autour de la pièce"
     )
     parser.add_argument(
         'directory',
@@ -131,14 +522,53 @@ def main():
         default=1848,
         help='Taille du carré final (défaut: 1848)'
     )
+    parser.add_argument(
+        '--jobs', '-j',
+        type=int,
+        default=1,
+        help='Nombre de processus en parallèle (défaut: 1, 0 = tous les cœurs)'
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Ignorer le manifeste et retraiter toutes les images'
+    )
+    parser.add_argument(
+        '--center',
+        action='store_true',
+        help='Recadrer au centre de l\'image sans détecter la pièce'
+    )
+    parser.add_argument(
+        '--screen',
+        choices=SCREEN_MODES,
+        default=DEFAULT_SCREEN,
+        help='Contrôle qualité (netteté, exposition, pièce): off, report = signaler les photos à refaire '
+             f'dans le rapport, skip = ne pas les recadrer (défaut: {DEFAULT_SCREEN})'
+    )
+    parser.add_argument(
+        '--min-sharpness',
+        type=float,
+        default=None,
+        help=f'Netteté minimale du contrôle qualité (variance du laplacien, défaut: {MIN_SHARPNESS:.0f})'
+    )
 
     args = parser.parse_args()
 
+    METRICS.start('crop_images')
     process_directory(
         args.directory,
         recursive=not args.no_recursive,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        jobs=args.jobs,
+        target_size=args.size,
+        force=args.force,
+        detect=not args.center,
+        screen=args.screen,
+        min_sharpness=args.min_sharpness
     )
+    summary = METRICS.finish()
+    if summary:
+        print(f"\n{summary}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Index précalculé de la galerie (gallery/cache/index/), lu par les pages PHP.
+
+Les pages ne parcourent plus pictures/ et ne décodent plus tout
+coins_metadata.json à chaque requête: elles lisent un petit manifeste puis
+seulement les fragments des pièces affichées.
+
+- manifest.json: nombre de pièces, séances (plages d'ids), valeurs des filtres,
+  signature (taille, date) des sources lues
+- coins/NNNNN.json: SHARD_SIZE pièces d'ids consécutifs (paire de photos,
+  dimensions, déclinaisons, libellé, métadonnées)
+- facets/<champ>/<empreinte>.json: ids des pièces ayant une valeur de filtre
+
+L'index est dérivé du registre des séances, du JSON des métadonnées et de
+l'index des déclinaisons. Rien n'est relu si aucune de ces sources n'a
+changé, et seuls les fichiers dont le contenu change sont réécrits: une
+pièce analysée ou modifiée ne touche que son fragment et ses filtres.
+
+Les pages comparent les sources à leur signature dans le manifeste: après
+une édition à la main de coins_metadata.json, elles repartent des sources
+jusqu'à la prochaine mise à jour de l'index.
+
+Usage:
+    python scripts/gallery_index.py           # mise à jour
+    python scripts/gallery_index.py --force   # tout recalculer
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+INDEX_DIR = ROOT_DIR / "gallery" / "cache" / "index"
+MANIFEST_NAME = "manifest.json"
+STATE_NAME = "state.json"
+INDEX_VERSION = 2
+
+# Pièces par fragment (et par page de la grille)
+SHARD_SIZE = 100
+
+# Champs proposés comme filtres dans la galerie
+FACETS = ("country", "currency", "year")
+
+
+def shard_name(number):
+    return f"coins/{number:05d}.json"
+
+
+def facet_name(field, value):
+    """Fichier des ids d'une valeur de filtre (même empreinte côté PHP)."""
+    return f"facets/{field}/{hashlib.sha1(value.encode('utf-8')).hexdigest()[:16]}.json"
+
+
+def coin_label(coin_id, meta):
+    """Libellé affiché d'une pièce: « pays - valeur », ou son numéro tant qu'elle n'est pas analysée."""
+    if meta and meta.get("country") and meta.get("value"):
+        return f"{meta['country']} - {meta['value']}"
+    return f"Pièce #{coin_id + 1}"
+
+
+def photo_entry(path, rendition):
+    """Photo d'une pièce: chemin relatif à pictures/, dimensions et déclinaisons si connues."""
+    rendition = rendition or {}
+    return {
+        "path": path,
+        "width": rendition.get("width"),
+        "height": rendition.get("height"),
+        "renditions": rendition.get("renditions"),
+    }
+
+
+def coin_entry(coin_id, session, photos, meta):
+    return {
+        "id": coin_id,
+        "session": session,
+        "label": coin_label(coin_id, meta),
+        "photos": photos,
+        "meta": meta,
+    }
+
+
+def facet_value(meta, field):
+    value = meta.get(field) if meta else None
+    return str(value) if value not in (None, "") else None
+
+
+def source_files():
+    """Fichiers dont l'index est dérivé."""
+    from sessions import REGISTRY_FILE
+    from metadata_store import JSON_FILE
+    from build_renditions import CACHE_DIR, INDEX_NAME
+
+    return {
+        "sessions": REGISTRY_FILE,
+        "metadata": JSON_FILE,
+        "renditions": CACHE_DIR / INDEX_NAME,
+    }
+
+
+def signature(path):
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_metadata(path):
+    """Métadonnées du JSON de la galerie, par id (vide si absent ou illisible)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {coin["id"]: coin for coin in json.load(f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def compute_index(pairs, metadata, renditions):
+    """
+    Contenu de l'index à partir des sources.
+
+    Args:
+        pairs: Liste (id, séance, photo face, photo pile), noms de fichiers seuls
+        metadata: Dict {id: métadonnées}
+        renditions: Index des déclinaisons {séance/photo: entrée}
+
+    Returns:
+        Tuple (manifeste, {chemin relatif: contenu JSON})
+    """
+    count = max((coin_id for coin_id, *_ in pairs), default=-1) + 1
+    shards = [[None] * SHARD_SIZE for _ in range((count + SHARD_SIZE - 1) // SHARD_SIZE)]
+    postings = {field: {} for field in FACETS}
+    sessions = {}
+
+    for coin_id, session, face, pile in sorted(pairs):
+        meta = metadata.get(coin_id)
+        photos = [photo_entry(f"{session}/{name}", renditions.get(f"{session}/{name}")) for name in (face, pile)]
+        shards[coin_id // SHARD_SIZE][coin_id % SHARD_SIZE] = coin_entry(coin_id, session, photos, meta)
+        for field in FACETS:
+            value = facet_value(meta, field)
+            if value is not None:
+                postings[field].setdefault(value, []).append(coin_id)
+        # Plages d'ids consécutifs de la séance (une séance complétée plus tard en a plusieurs)
+        info = sessions.setdefault(session, {"name": session, "count": 0, "ids": []})
+        info["count"] += 1
+        if info["ids"] and info["ids"][-1][1] == coin_id - 1:
+            info["ids"][-1][1] = coin_id
+        else:
+            info["ids"].append([coin_id, coin_id])
+
+    files = {shard_name(number): entries for number, entries in enumerate(shards)}
+    for field, values in postings.items():
+        for value, ids in values.items():
+            files[facet_name(field, value)] = ids
+    manifest = {
+        "version": INDEX_VERSION,
+        "shard_size": SHARD_SIZE,
+        "count": count,
+        "sessions": sorted(sessions.values(), key=lambda s: s["ids"][0][0]),
+        "facets": {field: {value: len(values[value]) for value in sorted(values)}
+                   for field, values in postings.items()},
+    }
+    return manifest, files
+
+
+def write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_state(directory):
+    try:
+        with open(directory / STATE_NAME, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return state if state.get("version") == INDEX_VERSION else None
+
+
+def build_index(directory=INDEX_DIR, force=False):
+    """
+    Met à jour l'index de la galerie.
+
+    Returns:
+        Tuple (fichiers écrits, fichiers supprimés), ou None si les sources
+        n'ont pas changé depuis la dernière mise à jour
+    """
+    from sessions import SessionRegistry
+    from build_renditions import load_index
+
+    directory = Path(directory)
+    sources = source_files()
+    if not sources["sessions"].exists():
+        # Première mise à jour: enregistrer les séances présentes (comme sessions.py)
+        registry = SessionRegistry(sources["sessions"])
+        registry.scan()
+        registry.save()
+    state = load_state(directory) or {}
+    signatures = {name: signature(path) for name, path in sources.items()}
+    if not force and state.get("sources") == signatures and (directory / MANIFEST_NAME).exists():
+        return None
+
+    registry = SessionRegistry(sources["sessions"])
+    pairs = [(coin_id, face.parent.name, face.name, pile.name) for coin_id, face, pile in registry.pairs()]
+    manifest, files = compute_index(pairs, load_metadata(sources["metadata"]), load_index(sources["renditions"].parent))
+    # Relevées avant lecture, comme dans l'état: les pages voient qu'une source a changé depuis
+    manifest["sources"] = signatures
+    files[MANIFEST_NAME] = manifest
+
+    known = {} if force else state.get("files", {})
+    hashes = {}
+    written = 0
+    # Fragments et filtres avant le manifeste qui les référence
+    for name in sorted(files, key=lambda name: name == MANIFEST_NAME):
+        data = json.dumps(files[name], ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        hashes[name] = hashlib.sha256(data).hexdigest()
+        if known.get(name) != hashes[name] or not (directory / name).exists():
+            write_atomic(directory / name, data)
+            written += 1
+
+    removed = 0
+    for name in set(state.get("files", {})) - set(files):
+        try:
+            (directory / name).unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+
+    # Signatures relevées avant lecture: une source modifiée entre-temps sera relue la prochaine fois
+    write_atomic(directory / STATE_NAME, json.dumps(
+        {"version": INDEX_VERSION, "sources": signatures, "files": hashes}, separators=(",", ":")
+    ).encode("utf-8"))
+    return written, removed
+
+
+def refresh_index(directory=INDEX_DIR):
+    """Mise à jour silencieuse sauf changement, après une écriture des sources."""
+    try:
+        result = build_index(directory)
+    except Exception as e:
+        print(f"⚠️  Index de la galerie non mis à jour: {e}")
+        return
+    if result:
+        written, removed = result
+        print(f"🗂️  Index de la galerie: {written} fichiers écrits, {removed} supprimés")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Index précalculé des pages de la galerie")
+    parser.add_argument('--force', action='store_true', help='Recalculer et réécrire tout l\'index')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = build_index(force=args.force)
+    elapsed = (time.perf_counter() - start) * 1000
+    if result is None:
+        print(f"✓ Index à jour ({elapsed:.0f} ms)")
+    else:
+        written, removed = result
+        print(f"✅ Index mis à jour en {elapsed:.0f} ms: {written} fichiers écrits, {removed} supprimés")
+
+    with open(INDEX_DIR / MANIFEST_NAME, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    shards = (manifest["count"] + SHARD_SIZE - 1) // SHARD_SIZE
+    print(f"📁 {INDEX_DIR}: {manifest['count']} pièces, {len(manifest['sessions'])} séances, {shards} fragments")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+Historique des métadonnées des pièces: chaque modification d'une pièce est
+journalisée, et n'importe quel instant passé peut être reconstruit.
+
+Organisation (gallery/backups/history/):
+    objects.jsonl   versions de pièces adressées par contenu (SHA-256),
+                    chaque version distincte n'est stockée qu'une fois
+    journal.jsonl   une ligne par modification: {seq, ts, id, sha}
+                    (sha null = pièce supprimée)
+    snapshots/      états complets {id: sha} compressés, écrits toutes les
+                    SNAPSHOT_EVERY modifications pour accélérer la reconstruction
+                    (un par semaine au-delà de KEEP_ALL_DAYS)
+
+Rétention (appliquée au plus une fois par jour, ou via --prune): toutes les
+modifications des KEEP_ALL_DAYS derniers jours sont conservées; au-delà,
+seule la dernière modification de chaque pièce par jour est gardée jusqu'à
+KEEP_DAILY_DAYS jours; l'état plus ancien est replié dans un instantané de base.
+
+Usage:
+    python scripts/metadata_history.py --list
+    python scripts/metadata_history.py --coin 12
+    python scripts/metadata_history.py --at "2025-11-05 14:00" --output /tmp/coins.json
+    python scripts/metadata_history.py --at "2025-11-05 14:00" --restore
+    python scripts/metadata_history.py --import-backups
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import hashlib
+from datetime import datetime
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+BACKUP_DIR = ROOT_DIR / "gallery" / "backups"
+HISTORY_DIR = BACKUP_DIR / "history"
+
+# Politique de rétention
+KEEP_ALL_DAYS = 7
+KEEP_DAILY_DAYS = 365
+# Un instantané complet toutes les N modifications journalisées
+SNAPSHOT_EVERY = 1000
+# Intervalle minimal entre deux applications automatiques de la rétention
+PRUNE_INTERVAL = 86400
+
+DAY = 86400
+
+
+def coin_sha(coin):
+    """Adresse d'une version de pièce: SHA-256 de sa forme canonique."""
+    canonical = json.dumps(coin, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def local_day(ts):
+    """Jour local (année, mois, jour) d'un timestamp."""
+    return time.localtime(ts)[:3]
+
+
+def write_atomic(path, data):
+    """Écrit des octets dans un fichier temporaire puis le renomme."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def parse_when(text):
+    """Date 'YYYY-MM-DD[ HH:MM[:SS]]' (heure locale) ou timestamp -> timestamp."""
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+class MetadataHistory:
+    """
+    Journal des versions de chaque pièce, avec instantanés et rétention.
+
+    L'état courant (id -> sha) est reconstruit au premier besoin à partir du
+    dernier instantané et de la fin du journal.
+    """
+
+    def __init__(self, path=HISTORY_DIR, keep_all_days=KEEP_ALL_DAYS,
+                 keep_daily_days=KEEP_DAILY_DAYS, snapshot_every=SNAPSHOT_EVERY):
+        self.path = Path(path)
+        self.objects_file = self.path / "objects.jsonl"
+        self.journal_file = self.path / "journal.jsonl"
+        self.snapshots_dir = self.path / "snapshots"
+        self.state_file = self.path / "state.json"
+        self.keep_all_days = keep_all_days
+        self.keep_daily_days = keep_daily_days
+        self.snapshot_every = snapshot_every
+        self._shas = None
+        self._head = None
+        self._seq = 0
+        self._since_snapshot = 0
+
+    # Lecture du stockage
+
+    def snapshots(self):
+        """Instantanés disponibles, triés: liste de (seq, ts, chemin)."""
+        if not self.snapshots_dir.exists():
+            return []
+        result = []
+        for path in self.snapshots_dir.glob("*.json.gz"):
+            seq, ts_ms = path.name.split(".")[0].split("-")
+            result.append((int(seq), int(ts_ms) / 1000, path))
+        return sorted(result)
+
+    def read_snapshot(self, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return {int(k): v for k, v in json.load(f)["coins"].items()}
+
+    def journal(self):
+        """Entrées du journal dans l'ordre; une dernière ligne tronquée est ignorée."""
+        entries = []
+        if not self.journal_file.exists():
+            return entries
+        with open(self.journal_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+        return entries
+
+    def objects(self):
+        """Toutes les versions stockées: dict sha -> pièce."""
+        result = {}
+        if not self.objects_file.exists():
+            return result
+        with open(self.objects_file, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                result[entry["sha"]] = entry["coin"]
+        return result
+
+    def _load_head(self):
+        """Reconstruit l'état courant, le numéro de séquence et l'index des objets."""
+        if self._head is not None:
+            return
+        snapshots = self.snapshots()
+        head, seq = ({}, 0)
+        if snapshots:
+            seq = snapshots[-1][0]
+            head = self.read_snapshot(snapshots[-1][2])
+        self._since_snapshot = 0
+        for entry in self.journal():
+            if entry["seq"] <= seq:
+                continue
+            self._apply(head, entry)
+            seq = entry["seq"]
+            self._since_snapshot += 1
+        self._head, self._seq = head, seq
+        self._shas = set()
+        if self.objects_file.exists():
+            with open(self.objects_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    # Ligne: {"sha": "<64 hex>", ...}
+                    self._shas.add(line[9:73])
+
+    @staticmethod
+    def _apply(state, entry):
+        if entry["sha"] is None:
+            state.pop(entry["id"], None)
+        else:
+            state[entry["id"]] = entry["sha"]
+
+    # Écriture
+
+    def record(self, coins=(), deleted=(), ts=None):
+        """
+        Journalise les pièces modifiées (les versions inchangées sont ignorées).
+
+        Returns:
+            Nombre de modifications journalisées
+        """
+        self._load_head()
+        ts = time.time() if ts is None else ts
+        objects, entries = [], []
+        for coin in coins:
+            sha = coin_sha(coin)
+            if self._head.get(coin["id"]) == sha:
+                continue
+            if sha not in self._shas:
+                self._shas.add(sha)
+                objects.append(json.dumps({"sha": sha, "coin": coin}, ensure_ascii=False))
+            self._seq += 1
+            entries.append({"seq": self._seq, "ts": ts, "id": coin["id"], "sha": sha})
+        for coin_id in deleted:
+            if coin_id in self._head:
+                self._seq += 1
+                entries.append({"seq": self._seq, "ts": ts, "id": coin_id, "sha": None})
+        if not entries:
+            return 0
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Objets d'abord: une entrée de journal ne référence jamais un objet absent
+        if objects:
+            self._append(self.objects_file, objects)
+        self._append(self.journal_file, [json.dumps(e) for e in entries])
+        for entry in entries:
+            self._apply(self._head, entry)
+
+        self._since_snapshot += len(entries)
+        if self._since_snapshot >= self.snapshot_every:
+            self.write_snapshot(self._head, self._seq, ts)
+            self._since_snapshot = 0
+        self.maybe_prune()
+        return len(entries)
+
+    def _append(self, path, lines):
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_snapshot(self, state, seq, ts):
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        path = self.snapshots_dir / f"{seq:010d}-{int(ts * 1000)}.json.gz"
+        data = json.dumps({"seq": seq, "ts": ts, "coins": state}, separators=(",", ":"))
+        write_atomic(path, gzip.compress(data.encode("utf-8")))
+        return path
+
+    # Reconstruction
+
+    def state_at(self, ts):
+        """État {id: sha} à l'instant ts."""
+        base_seq, base_path = 0, None
+        for seq, snap_ts, path in self.snapshots():
+            if snap_ts <= ts:
+                base_seq, base_path = seq, path
+        state = self.read_snapshot(base_path) if base_path else {}
+        for entry in self.journal():
+            if entry["seq"] > base_seq and entry["ts"] <= ts:
+                self._apply(state, entry)
+        return state
+
+    def rebuild(self, ts=None):
+        """Liste des pièces (triée par id) telle qu'elle était à l'instant ts."""
+        state = self.state_at(time.time() if ts is None else ts)
+        objects = self.objects()
+        return [objects[state[coin_id]] for coin_id in sorted(state)]
+
+    def versions(self, coin_id):
+        """Versions journalisées d'une pièce: liste de (ts, pièce ou None)."""
+        objects = self.objects()
+        return [(e["ts"], objects.get(e["sha"]) if e["sha"] else None)
+                for e in self.journal() if e["id"] == coin_id]
+
+    # Rétention
+
+    def maybe_prune(self, now=None):
+        """Applique la rétention si elle n'a pas tourné depuis PRUNE_INTERVAL."""
+        now = time.time() if now is None else now
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                last = json.load(f).get("last_prune", 0)
+        except (OSError, ValueError):
+            last = 0
+        if now - last >= PRUNE_INTERVAL:
+            return self.prune(now)
+        return None
+
+    def prune(self, now=None):
+        """
+        Applique la politique de rétention puis supprime les objets orphelins.
+
+        Returns:
+            Dict de statistiques (entrées, instantanés et objets supprimés)
+        """
+        now = time.time() if now is None else now
+        keep_all_from = now - self.keep_all_days * DAY
+        keep_daily_from = now - self.keep_daily_days * DAY
+        entries = self.journal()
+        stats = {"entries": 0, "snapshots": 0, "objects": 0}
+
+        # 1. Replier tout ce qui précède la fenêtre quotidienne dans un instantané de base
+        old = [e for e in entries if e["ts"] <= keep_daily_from]
+        if old:
+            base_seq = old[-1]["seq"]
+            self.write_snapshot(self.state_at(keep_daily_from), base_seq, keep_daily_from)
+            entries = [e for e in entries if e["seq"] > base_seq]
+            stats["entries"] += len(old)
+        snapshots = self.snapshots()
+        base = max((s for s in snapshots if s[1] <= keep_daily_from), default=None)
+        for snap in snapshots:
+            if base and snap[1] < base[1]:
+                snap[2].unlink()
+                stats["snapshots"] += 1
+
+        # 2. Entre les deux fenêtres: dernière modification de chaque pièce par jour
+        last_of_day = {}
+        for entry in entries:
+            if entry["ts"] <= keep_all_from:
+                last_of_day[(entry["id"], local_day(entry["ts"]))] = entry["seq"]
+        kept = [e for e in entries
+                if e["ts"] > keep_all_from or last_of_day[(e["id"], local_day(e["ts"]))] == e["seq"]]
+        stats["entries"] += len(entries) - len(kept)
+
+        # Les instantanés ne servent qu'à accélérer la reconstruction: hors de
+        # la fenêtre complète, un par semaine suffit
+        last_snapshot_of_week = {}
+        for snap in self.snapshots():
+            if base and snap[1] <= base[1]:
+                continue
+            if snap[1] <= keep_all_from:
+                week = datetime.fromtimestamp(snap[1]).isocalendar()[:2]
+                if week in last_snapshot_of_week:
+                    last_snapshot_of_week[week][2].unlink()
+                    stats["snapshots"] += 1
+                last_snapshot_of_week[week] = snap
+
+        if stats["entries"]:
+            write_atomic(self.journal_file, "".join(json.dumps(e) + "\n" for e in kept).encode("utf-8"))
+
+        # 3. Objets encore référencés par un instantané ou le journal
+        referenced = {e["sha"] for e in kept if e["sha"]}
+        for _, _, path in self.snapshots():
+            referenced.update(self.read_snapshot(path).values())
+        objects = self.objects()
+        if set(objects) - referenced:
+            lines = [json.dumps({"sha": sha, "coin": coin}, ensure_ascii=False)
+                     for sha, coin in objects.items() if sha in referenced]
+            write_atomic(self.objects_file, "".join(line + "\n" for line in lines).encode("utf-8"))
+            stats["objects"] = len(objects) - len(lines)
+
+        if self.path.exists():
+            write_atomic(self.state_file, json.dumps({"last_prune": now}).encode("utf-8"))
+        self._head = None
+        return stats
+
+    def disk_usage(self):
+        if not self.path.exists():
+            return 0
+        return sum(p.stat().st_size for p in self.path.rglob("*") if p.is_file())
+
+
+def import_backups(history, backup_dir=BACKUP_DIR):
+    """
+    Journalise les anciennes copies complètes coins_metadata_backup_*.json.
+
+    Les copies antérieures à la dernière modification journalisée sont
+    ignorées pour garder le journal dans l'ordre chronologique.
+    """
+    entries = history.journal()
+    since = entries[-1]["ts"] if entries else 0
+    count = 0
+    for path in sorted(backup_dir.glob("coins_metadata_backup_*.json")):
+        stamp = path.stem.split("_backup_")[1]
+        ts = datetime.strptime(stamp, "%Y%m%d_%H%M%S").timestamp()
+        if ts <= since:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            coins = json.load(f)
+        previous = history.state_at(ts)
+        current = {coin["id"] for coin in coins}
+        count += history.record(coins, [i for i in previous if i not in current], ts=ts)
+    return count
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Historique des métadonnées des pièces")
+    parser.add_argument('--list', action='store_true', help='Afficher le contenu de l\'historique')
+    parser.add_argument('--coin', type=int, metavar='ID', help='Afficher les versions d\'une pièce')
+    parser.add_argument('--at', metavar='DATE', help='Reconstruire l\'état à cette date ("YYYY-MM-DD HH:MM")')
+    parser.add_argument('--output', metavar='FICHIER', help='Avec --at: écrire le JSON reconstruit dans FICHIER')
+    parser.add_argument('--restore', action='store_true',
+                        help='Avec --at: remplacer les métadonnées par l\'état reconstruit')
+    parser.add_argument('--prune', action='store_true', help='Appliquer la politique de rétention')
+    parser.add_argument('--keep-all-days', type=int, default=KEEP_ALL_DAYS,
+                        help=f'Jours pendant lesquels toutes les modifications sont gardées (défaut: {KEEP_ALL_DAYS})')
+    parser.add_argument('--keep-daily-days', type=int, default=KEEP_DAILY_DAYS,
+                        help=f'Jours pendant lesquels un état par jour est gardé (défaut: {KEEP_DAILY_DAYS})')
+    parser.add_argument('--import-backups', action='store_true',
+                        help='Journaliser les anciennes copies complètes de gallery/backups/')
+    args = parser.parse_args()
+
+    history = MetadataHistory(keep_all_days=args.keep_all_days, keep_daily_days=args.keep_daily_days)
+
+    if args.import_backups:
+        count = import_backups(history)
+        # Puis l'état actuel, postérieur à la dernière copie
+        from metadata_store import MetadataStore
+        with MetadataStore(history_dir=None) as store:
+            count += history.record(store.all())
+        print(f"✓ {count} modifications importées depuis {BACKUP_DIR}")
+
+    if args.prune:
+        stats = history.prune()
+        print(f"🧹 {stats['entries']} entrées, {stats['snapshots']} instantanés et "
+              f"{stats['objects']} versions supprimés")
+
+    if args.coin is not None:
+        for ts, coin in history.versions(args.coin):
+            when = datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
+            print(f"--- {when}")
+            print(json.dumps(coin, indent=2, ensure_ascii=False) if coin else "(supprimée)")
+
+    if args.at:
+        start = time.perf_counter()
+        coins = history.rebuild(parse_when(args.at))
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"🕐 {len(coins)} pièces reconstruites au {args.at} en {elapsed:.0f} ms")
+        if args.restore:
+            from metadata_store import MetadataStore
+            with MetadataStore() as store:
+                present = {coin["id"] for coin in coins}
+                for coin_id in [c["id"] for c in store.all() if c["id"] not in present]:
+                    store.delete(coin_id)
+                store.put_many(coins)
+                store.export_json()
+            print("✓ Métadonnées restaurées")
+            from gallery_index import refresh_index
+            refresh_index()
+        elif args.output:
+            write_atomic(Path(args.output), json.dumps(coins, indent=2, ensure_ascii=False).encode("utf-8"))
+            print(f"✓ Écrit dans {args.output}")
+
+    if args.list or not (args.import_backups or args.prune or args.coin is not None or args.at):
+        entries = history.journal()
+        print(f"📁 {history.path}: {history.disk_usage() / 1024:.0f} Ko")
+        print(f"   {len(entries)} modifications, {len(history.objects())} versions distinctes")
+        for seq, ts, _ in history.snapshots():
+            print(f"   instantané #{seq} du {datetime.fromtimestamp(ts):%Y-%m-%d %H:%M}")
+        if entries:
+            first, last = (datetime.fromtimestamp(e["ts"]) for e in (entries[0], entries[-1]))
+            print(f"   journal du {first:%Y-%m-%d %H:%M} au {last:%Y-%m-%d %H:%M}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
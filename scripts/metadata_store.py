@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Base des métadonnées des pièces (SQLite, mode WAL), indexée par id.
+
+Chaque pièce est une ligne: lecture et mise à jour d'une pièce se font par
+clé primaire, en une petite transaction, sans relire ni réécrire toute la
+collection. Le fichier gallery/coins_metadata.json lu par la galerie PHP
+est produit à la demande (export) dans le même format qu'auparavant.
+
+Les modifications faites côté PHP (edit_metadata.php) arrivent dans le
+JSON: elles sont réimportées à l'ouverture de la base dès que le fichier a
+changé depuis le dernier export.
+
+Chaque pièce modifiée est aussi journalisée dans l'historique (voir
+metadata_history), qui remplace les copies complètes de sauvegarde.
+
+Usage:
+    python scripts/metadata_store.py --stats
+    python scripts/metadata_store.py --get 12
+    python scripts/metadata_store.py --export
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+
+from metadata_history import MetadataHistory, HISTORY_DIR, coin_sha
+
+ROOT_DIR = Path(__file__).parent.parent
+STORE_FILE = ROOT_DIR / "gallery" / "coins_metadata.sqlite3"
+JSON_FILE = ROOT_DIR / "gallery" / "coins_metadata.json"
+
+
+def dumps(coin):
+    """Sérialisation d'une pièce telle que stockée (ordre des champs conservé)."""
+    return json.dumps(coin, ensure_ascii=False)
+
+
+class MetadataStore:
+    """
+    Métadonnées des pièces indexées par id, avec export JSON pour la galerie.
+
+    Le fichier JSON associé est resynchronisé à l'ouverture (import des
+    modifications externes) et à chaque appel d'export_json(). Avec
+    history_dir=None, les modifications ne sont pas historisées.
+    """
+
+    def __init__(self, path=STORE_FILE, json_path=JSON_FILE, sync=True, history_dir=HISTORY_DIR):
+        self.path = Path(path)
+        self.json_path = Path(json_path)
+        self.history = MetadataHistory(history_dir) if history_dir else None
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS coins ("
+            " id INTEGER PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated REAL NOT NULL,"
+            " synced TEXT)"
+        )
+        # Bases créées avant la colonne synced
+        if "synced" not in {row[1] for row in self.db.execute("PRAGMA table_info(coins)")}:
+            self.db.execute("ALTER TABLE coins ADD COLUMN synced TEXT")
+        # Pièces modifiées depuis une date (mise à jour des index dérivés, voir coin_search)
+        self.db.execute("CREATE INDEX IF NOT EXISTS coins_updated ON coins (updated)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.commit()
+        if sync:
+            self.sync_from_json()
+
+    # Lecture
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM coins").fetchone()[0]
+
+    def __contains__(self, coin_id):
+        return self.db.execute("SELECT 1 FROM coins WHERE id = ?", (coin_id,)).fetchone() is not None
+
+    def get(self, coin_id):
+        """Métadonnées d'une pièce, ou None."""
+        row = self.db.execute("SELECT data FROM coins WHERE id = ?", (coin_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self):
+        """Toutes les pièces, triées par id."""
+        return [json.loads(data) for (data,) in self.db.execute("SELECT data FROM coins ORDER BY id")]
+
+    def ids(self):
+        """Ids de toutes les pièces."""
+        return {coin_id for (coin_id,) in self.db.execute("SELECT id FROM coins")}
+
+    def changed_since(self, timestamp):
+        """
+        Pièces écrites depuis une date (incluse).
+
+        Returns:
+            Liste de tuples (pièce, date de mise à jour), par date croissante
+        """
+        return [(json.loads(data), updated) for data, updated in self.db.execute(
+            "SELECT data, updated FROM coins WHERE updated >= ? ORDER BY updated", (timestamp,)
+        )]
+
+    def analyzed_ids(self):
+        """Ids des pièces dont l'analyse a réussi."""
+        return {coin_id for (coin_id,) in self.db.execute(
+            "SELECT id FROM coins WHERE json_extract(data, '$.error') IS NULL"
+        )}
+
+    def count_with(self, field):
+        """Nombre de pièces où un champ est renseigné."""
+        return self.db.execute(
+            "SELECT COUNT(*) FROM coins WHERE json_extract(data, ?) IS NOT NULL", (f"$.{field}",)
+        ).fetchone()[0]
+
+    # Écriture
+
+    def put(self, coin):
+        """Insère ou remplace une pièce (transaction d'une ligne)."""
+        with self.db:
+            self._put(coin)
+        self._record([coin])
+
+    def put_many(self, coins):
+        """Insère ou remplace plusieurs pièces en une seule transaction."""
+        coins = list(coins)
+        with self.db:
+            for coin in coins:
+                self._put(coin)
+        self._record(coins)
+
+    def _record(self, coins=(), deleted=()):
+        if self.history:
+            self.history.record(coins, deleted)
+
+    def _put(self, coin, synced=None):
+        self.db.execute(
+            "INSERT INTO coins (id, data, updated, synced) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (id) DO UPDATE SET data = excluded.data, updated = excluded.updated,"
+            " synced = COALESCE(excluded.synced, synced)",
+            (coin["id"], dumps(coin), time.time(), synced)
+        )
+
+    def update(self, coin_id, fields):
+        """
+        Fusionne des champs dans une pièce existante.
+
+        Returns:
+            La pièce mise à jour, ou None si l'id est inconnu
+        """
+        with self.db:
+            coin = self.get(coin_id)
+            if coin is None:
+                return None
+            coin.update(fields)
+            self._put(coin)
+        self._record([coin])
+        return coin
+
+    def delete(self, coin_id):
+        with self.db:
+            self.db.execute("DELETE FROM coins WHERE id = ?", (coin_id,))
+        self._record(deleted=[coin_id])
+
+    # Synchronisation avec le JSON de la galerie
+
+    def _meta(self, key):
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set_meta(self, key, value):
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+    def _json_state(self, digest=None):
+        stat = self.json_path.stat()
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest}
+
+    def json_changed(self):
+        """Indique si le JSON a été modifié depuis le dernier import/export."""
+        if not self.json_path.exists():
+            return False
+        known = self._meta("json_state")
+        if known is None:
+            return True
+        state = self._json_state()
+        if (state["size"], state["mtime_ns"]) == (known["size"], known["mtime_ns"]):
+            return False
+        with open(self.json_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest() != known["sha256"]
+
+    def sync_from_json(self):
+        """
+        Importe les pièces modifiées hors de la base (édition PHP ou manuelle).
+
+        Chaque pièce garde l'empreinte de sa version lors du dernier échange
+        avec le JSON: seules les pièces modifiées dans le JSON depuis sont
+        importées, sans écraser les modifications de la base pas encore
+        exportées pour les autres.
+
+        Une pièce absente du JSON y a été supprimée: elle est retirée de la
+        base si sa version y est encore celle du dernier échange, sinon
+        (nouvelle pièce ou modification pas encore exportée) elle est gardée.
+
+        Returns:
+            Nombre de pièces importées ou supprimées
+        """
+        if not self.json_changed():
+            return 0
+        with open(self.json_path, "rb") as f:
+            raw = f.read()
+        coins = json.loads(raw)
+
+        synced = dict(self.db.execute("SELECT id, synced FROM coins"))
+        changed = []
+        with self.db:
+            for coin in coins:
+                sha = coin_sha(coin)
+                if synced.get(coin["id"]) != sha:
+                    self._put(coin, sha)
+                    changed.append(coin)
+            listed = {coin["id"] for coin in coins}
+            deleted = [coin_id for coin_id, data in self.db.execute("SELECT id, data FROM coins")
+                       if coin_id not in listed and synced[coin_id] == coin_sha(json.loads(data))]
+            self.db.executemany("DELETE FROM coins WHERE id = ?", [(coin_id,) for coin_id in deleted])
+            self._set_meta("json_state", self._json_state(hashlib.sha256(raw).hexdigest()))
+        self._record(changed, deleted)
+        return len(changed) + len(deleted)
+
+    def export_json(self, path=None):
+        """
+        Écrit toutes les pièces dans le JSON de la galerie (fichier temporaire
+        puis renommage), au format liste triée par id.
+        """
+        path = Path(path) if path else self.json_path
+        # Ne pas écraser des modifications externes pas encore importées
+        if path == self.json_path:
+            self.sync_from_json()
+        coins = self.all()
+        data = json.dumps(coins, indent=2, ensure_ascii=False).encode("utf-8")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        if path.exists():
+            os.chmod(tmp_path, path.stat().st_mode & 0o777)
+        os.replace(tmp_path, path)
+        if path == self.json_path:
+            with self.db:
+                self.db.executemany("UPDATE coins SET synced = ? WHERE id = ?",
+                                    [(coin_sha(coin), coin["id"]) for coin in coins])
+                self._set_meta("json_state", self._json_state(hashlib.sha256(data).hexdigest()))
+        return path
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Base des métadonnées des pièces")
+    parser.add_argument('--stats', action='store_true', help='Afficher le contenu de la base')
+    parser.add_argument('--get', type=int, metavar='ID', help='Afficher une pièce')
+    parser.add_argument('--export', action='store_true',
+                        help=f'Réécrire {JSON_FILE.relative_to(ROOT_DIR)} depuis la base')
+    args = parser.parse_args()
+
+    with MetadataStore() as store:
+        if args.get is not None:
+            coin = store.get(args.get)
+            if coin is None:
+                print(f"❌ Aucune pièce avec l'ID {args.get}")
+                return 1
+            print(json.dumps(coin, indent=2, ensure_ascii=False))
+        if args.export:
+            path = store.export_json()
+            print(f"✓ {len(store)} pièces exportées dans {path}")
+            from gallery_index import refresh_index
+            refresh_index()
+        if args.stats or (args.get is None and not args.export):
+            print(f"📁 {store.path}")
+            print(f"   {len(store)} pièces, {store.count_with('valuation')} avec cotation")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
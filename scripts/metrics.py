@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Instrumentation des scripts: temps par étape (réel et CPU), octets lus et
+écrits, tokens et coût réels des réponses de l'API.
+
+Les fonctions instrumentées enregistrent leurs mesures dans le collecteur
+du processus (METRICS). Un script ouvre une exécution avec start() et la
+clôt avec finish(), qui écrit:
+
+- la trace JSONL des mesures (.cache/metrics/<script>.trace.jsonl, en ajout:
+  une ligne "run" puis une ligne par mesure, reliées par l'id d'exécution),
+- un fichier texte Prometheus (.cache/metrics/<script>.prom, remplacé à
+  chaque exécution) pour le collecteur textfile de node_exporter,
+
+et renvoie le résumé à afficher: p50/p95 par étape, octets, tokens et coût.
+
+Les processus de travail renvoient leurs mesures avec leur résultat
+(drain()); le processus principal les fusionne (merge()).
+
+Usage (résumé de la dernière trace d'un script):
+    python scripts/metrics.py analyze_coins
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+METRICS_DIR = Path(".cache/metrics")
+PROM_PREFIX = "coins"
+QUANTILES = (0.5, 0.95)
+
+# Prix en dollars par million de tokens (entrée, sortie), par préfixe de modèle
+PRICES = {
+    "claude-opus-4-5": (5.0, 25.0),
+    "claude-opus-4": (15.0, 75.0),
+    "claude-sonnet-4": (3.0, 15.0),
+    "claude-3-7-sonnet": (3.0, 15.0),
+    "claude-haiku-4-5": (1.0, 5.0),
+    "claude-3-5-haiku": (0.8, 4.0),
+}
+# Écriture et lecture du cache de prompt, relatives au prix d'entrée
+CACHE_WRITE_FACTOR = 1.25
+CACHE_READ_FACTOR = 0.1
+# Remise de l'API Message Batches
+BATCH_DISCOUNT = 0.5
+
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+
+
+def model_prices(model):
+    """Prix (entrée, sortie) d'un modèle d'après le plus long préfixe connu, None si inconnu."""
+    matches = [prefix for prefix in PRICES if model and model.startswith(prefix)]
+    return PRICES[max(matches, key=len)] if matches else None
+
+
+def token_cost(model, tokens, batch=False):
+    """Coût en dollars d'un décompte de tokens {champ: nombre} (0 pour un modèle inconnu)."""
+    prices = model_prices(model)
+    if prices is None:
+        return 0.0
+    input_price, output_price = prices
+    cost = (tokens.get("input_tokens", 0) * input_price
+            + tokens.get("cache_creation_input_tokens", 0) * input_price * CACHE_WRITE_FACTOR
+            + tokens.get("cache_read_input_tokens", 0) * input_price * CACHE_READ_FACTOR
+            + tokens.get("output_tokens", 0) * output_price) / 1_000_000
+    return cost * BATCH_DISCOUNT if batch else cost
+
+
+def percentile(values, q):
+    """Quantile q d'une liste triée (interpolation linéaire entre les rangs)."""
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class Metrics:
+    """
+    Collecteur des mesures d'un processus.
+
+    Chaque mesure est un dict: {"stage", "ts", "wall", "cpu", "read",
+    "written", ...libellés} pour une étape, {"stage": "usage", "model",
+    tokens, "cost"} pour la consommation d'une réponse de l'API.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+        self.script = None
+        self.run_id = None
+        self.started = None
+        # Réponses rejouées (api_transport): coût calculé mais pas dépensé
+        self.simulated = False
+
+    def add(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    @contextmanager
+    def stage(self, name, cpu=True, **labels):
+        """
+        Mesure une étape: temps réel et temps CPU du thread courant.
+
+        cpu=False pour une étape qui attend dans la boucle asyncio, où le
+        temps CPU du thread serait celui des autres tâches. Le dict de la
+        mesure est renvoyé pour y ajouter des octets ("read", "written").
+        """
+        event = {"stage": name, "ts": round(time.time(), 3), **labels}
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield event
+        finally:
+            event["wall"] = round(time.perf_counter() - start, 6)
+            if cpu:
+                event["cpu"] = round(time.thread_time() - cpu_start, 6)
+            self.add(event)
+
+    def usage(self, model, usage, batch=False, **labels):
+        """Enregistre les tokens d'une réponse (message.usage) et leur coût réel."""
+        tokens = {field: getattr(usage, field, None) or 0 for field in TOKEN_FIELDS}
+        self.add({"stage": "usage", "ts": round(time.time(), 3), "model": model, "batch": batch,
+                  **tokens, "cost": token_cost(model, tokens, batch), **labels})
+
+    def drain(self):
+        """Renvoie et retire les mesures accumulées (côté processus de travail)."""
+        with self.lock:
+            events, self.events = self.events, []
+        return events
+
+    def merge(self, events):
+        """Ajoute les mesures renvoyées par un processus de travail."""
+        with self.lock:
+            self.events.extend(events)
+
+    def start(self, script, simulated=False):
+        """
+        Ouvre une exécution: les mesures précédentes sont oubliées.
+
+        simulated=True pour un rejeu: le coût est affiché comme simulé.
+        """
+        self.drain()
+        self.script = script
+        self.simulated = simulated
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+
+    def finish(self, output_dir=METRICS_DIR):
+        """
+        Clôt l'exécution: écrit la trace et le fichier Prometheus.
+
+        Returns:
+            Résumé à afficher, ou None si rien n'a été mesuré
+        """
+        events = self.drain()
+        if not events or self.script is None:
+            return None
+        output_dir = Path(output_dir)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        duration = time.time() - self.started
+        stats = aggregate(events)
+
+        trace = output_dir / f"{self.script}.trace.jsonl"
+        with open(trace, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"run": self.run_id, "script": self.script, "started": round(self.started, 3),
+                                "duration": round(duration, 3), "argv": sys.argv[1:],
+                                "simulated": self.simulated}) + "\n")
+            for event in events:
+                f.write(json.dumps({"run": self.run_id, **event}, ensure_ascii=False) + "\n")
+
+        prom = output_dir / f"{self.script}.prom"
+        tmp_path = prom.with_name(prom.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(prometheus_text(self.script, stats, self.started, duration))
+        os.replace(tmp_path, prom)
+
+        return format_summary(stats, duration, self.simulated) + f"\n📈 Métriques: {prom} (trace {trace})"
+
+
+def aggregate(events):
+    """
+    Agrège des mesures par étape et par modèle.
+
+    Returns:
+        Dict {"stages": {étape: {"wall" (trié), "cpu", "read", "written"}},
+        "models": {modèle: {tokens, "requests", "cost"}}}
+    """
+    stages = defaultdict(lambda: {"wall": [], "cpu": 0.0, "read": 0, "written": 0})
+    models = defaultdict(lambda: dict.fromkeys(TOKEN_FIELDS + ("requests", "cost"), 0))
+    for event in events:
+        if event["stage"] == "usage":
+            model = models[event["model"]]
+            for field in TOKEN_FIELDS + ("cost",):
+                model[field] += event.get(field, 0)
+            model["requests"] += 1
+            continue
+        stage = stages[event["stage"]]
+        stage["wall"].append(event["wall"])
+        stage["cpu"] += event.get("cpu", 0.0)
+        stage["read"] += event.get("read", 0)
+        stage["written"] += event.get("written", 0)
+    for stage in stages.values():
+        stage["wall"].sort()
+    return {"stages": dict(stages), "models": dict(models)}
+
+
+def prometheus_text(script, stats, started, duration):
+    """Fichier texte au format d'exposition Prometheus pour une exécution."""
+    p = PROM_PREFIX
+    lines = [
+        f"# HELP {p}_stage_seconds Durée réelle des étapes",
+        f"# TYPE {p}_stage_seconds summary",
+    ]
+    for name, stage in sorted(stats["stages"].items()):
+        labels = f'script="{script}",stage="{name}"'
+        for q in QUANTILES:
+            lines.append(f'{p}_stage_seconds{{{labels},quantile="{q}"}} {percentile(stage["wall"], q):.6f}')
+        lines.append(f"{p}_stage_seconds_sum{{{labels}}} {sum(stage['wall']):.6f}")
+        lines.append(f"{p}_stage_seconds_count{{{labels}}} {len(stage['wall'])}")
+
+    lines += [f"# HELP {p}_stage_cpu_seconds_total Temps CPU des étapes",
+              f"# TYPE {p}_stage_cpu_seconds_total counter"]
+    for name, stage in sorted(stats["stages"].items()):
+        lines.append(f'{p}_stage_cpu_seconds_total{{script="{script}",stage="{name}"}} {stage["cpu"]:.6f}')
+
+    lines += [f"# HELP {p}_stage_bytes_total Octets lus et écrits par étape",
+              f"# TYPE {p}_stage_bytes_total counter"]
+    for name, stage in sorted(stats["stages"].items()):
+        for direction in ("read", "written"):
+            if stage[direction]:
+                lines.append(f'{p}_stage_bytes_total{{script="{script}",stage="{name}",direction="{direction}"}} '
+                             f'{stage[direction]}')
+
+    if stats["models"]:
+        lines += [f"# HELP {p}_api_requests_total Réponses de l'API reçues",
+                  f"# TYPE {p}_api_requests_total counter"]
+        lines += [f'{p}_api_requests_total{{script="{script}",model="{model}"}} {usage["requests"]}'
+                  for model, usage in sorted(stats["models"].items())]
+        lines += [f"# HELP {p}_api_tokens_total Tokens facturés par type",
+                  f"# TYPE {p}_api_tokens_total counter"]
+        for model, usage in sorted(stats["models"].items()):
+            for field in TOKEN_FIELDS:
+                kind = field.removesuffix("_tokens").removesuffix("_input")
+                lines.append(f'{p}_api_tokens_total{{script="{script}",model="{model}",type="{kind}"}} '
+                             f'{usage[field]}')
+        lines += [f"# HELP {p}_api_cost_dollars_total Coût réel des réponses en dollars",
+                  f"# TYPE {p}_api_cost_dollars_total counter"]
+        lines += [f'{p}_api_cost_dollars_total{{script="{script}",model="{model}"}} {usage["cost"]:.6f}'
+                  for model, usage in sorted(stats["models"].items())]
+
+    lines += [
+        f"# HELP {p}_run_duration_seconds Durée de la dernière exécution",
+        f"# TYPE {p}_run_duration_seconds gauge",
+        f'{p}_run_duration_seconds{{script="{script}"}} {duration:.3f}',
+        f"# HELP {p}_run_timestamp_seconds Début de la dernière exécution",
+        f"# TYPE {p}_run_timestamp_seconds gauge",
+        f'{p}_run_timestamp_seconds{{script="{script}"}} {started:.3f}',
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def format_summary(stats, duration, simulated=False):
+    """Tableau des étapes (p50/p95, cumul, CPU, octets) et coût réel (ou simulé) par modèle."""
+    lines = [f"⏱️  {'Étape':<10} {'n':>6} {'p50 (ms)':>9} {'p95 (ms)':>9} {'cumul (s)':>10} "
+             f"{'CPU (s)':>8} {'lu (Mo)':>8} {'écrit (Mo)':>10}"]
+    for name, stage in sorted(stats["stages"].items(), key=lambda item: -sum(item[1]["wall"])):
+        wall = stage["wall"]
+        lines.append(f"   {name:<10} {len(wall):>6} {percentile(wall, 0.5) * 1000:>9.1f} "
+                     f"{percentile(wall, 0.95) * 1000:>9.1f} {sum(wall):>10.2f} {stage['cpu']:>8.2f} "
+                     f"{stage['read'] / 1024 / 1024:>8.1f} {stage['written'] / 1024 / 1024:>10.1f}")
+    lines.append(f"   Durée totale: {duration:.1f} s (cumuls sur tous les processus et requêtes)")
+
+    total = 0.0
+    for model, usage in sorted(stats["models"].items()):
+        total += usage["cost"]
+        cached = usage["cache_creation_input_tokens"] + usage["cache_read_input_tokens"]
+        lines.append(f"💰 {model}: {usage['requests']} réponses, {usage['input_tokens']} tokens d'entrée"
+                     f"{f' (+{cached} en cache)' if cached else ''}, {usage['output_tokens']} de sortie, "
+                     f"${usage['cost']:.4f}")
+    if stats["models"]:
+        requests = sum(usage["requests"] for usage in stats["models"].values())
+        label = "Coût simulé (rejeu, rien n'a été dépensé)" if simulated else "Coût réel"
+        lines.append(f"💰 {label}: ${total:.4f} (${total / requests:.5f} par réponse)")
+    return "\n".join(lines)
+
+
+def read_trace(path, run=None):
+    """
+    Relit une trace JSONL et renvoie les mesures d'une exécution.
+
+    Returns:
+        Tuple (ligne "run", liste des mesures); la dernière exécution par défaut
+    """
+    runs = {}
+    last = None
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if "script" in entry:
+                runs[entry["run"]] = (entry, [])
+                last = entry["run"]
+            elif entry.get("run") in runs:
+                runs[entry["run"]][1].append(entry)
+    return runs.get(run or last, (None, []))
+
+
+# Collecteur du processus courant
+METRICS = Metrics()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Résumé d'une exécution d'après sa trace de métriques")
+    parser.add_argument('script', help='Nom du script (ex: analyze_coins, crop_images, pipeline)')
+    parser.add_argument('--run', help='Id de l\'exécution (défaut: la dernière)')
+    args = parser.parse_args()
+
+    trace = METRICS_DIR / f"{args.script}.trace.jsonl"
+    if not trace.exists():
+        print(f"❌ Aucune trace: {trace}")
+        return 1
+    header, events = read_trace(trace, args.run)
+    if header is None:
+        print(f"❌ Exécution introuvable dans {trace}")
+        return 1
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(header["started"]))
+    print(f"📋 {args.script} {header['run']} ({started}, {' '.join(header['argv']) or 'sans option'})")
+    print(format_summary(aggregate(events), header["duration"], header.get("simulated", False)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""
+Index de hash perceptuels (dHash 64 bits) de toutes les photos, pour
+repérer une pièce déjà photographiée lors d'une séance précédente.
+
+Le hash est calculé sur le disque de la pièce détecté (voir coin_detect),
+ce qui le rend insensible au cadrage; il reste sensible à la rotation de
+la pièce entre deux séances.
+
+Une correspondance n'est qu'un candidat: 64 bits ne séparent pas deux pièces
+du même type d'années différentes (5 cents 1978 et 1979 à distance 5), et
+une corrélation des disques alignés non plus (0,977 entre ces deux pièces,
+0,978 entre une photo et sa copie tournée de 6°). Les métadonnées, dont
+l'année, ne sont donc jamais reprises sans nouvelle analyse.
+
+Les hash sont rangés dans une table SQLite à index multiples (multi-index
+hashing): chacun est découpé en 4 blocs de 16 bits indexés séparément. Deux
+hash à distance de Hamming <= r ont au moins un bloc à distance <= r // 4,
+donc une recherche n'examine que les quelques lignes partageant un bloc
+voisin au lieu de toute la collection.
+
+Usage:
+    python scripts/phash_index.py pictures -j 0
+    python scripts/phash_index.py --query pictures/2025-11-02_19h15/20251102_185248.jpg
+    python scripts/phash_index.py --benchmark 100000
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from coin_detect import load_small, detect_circle
+from build_renditions import image_key, EXTENSIONS, PICTURES_DIR
+
+INDEX_FILE = Path(".cache/phash_index.sqlite3")
+
+# Découpage du hash 64 bits pour l'indexation
+CHUNKS = 4
+CHUNK_BITS = 16
+# Distance de Hamming maximale pour signaler deux photos comme la même pièce
+# possible. Séance réelle (198 photos, toutes de pièces distinctes): 8 paires de
+# photos à distance <= 6, dont un schilling et un 2 francs à 3
+DUPLICATE_DISTANCE = 2
+
+# Coefficients de luminance (ITU-R 601)
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def dhash(image_path):
+    """
+    Hash perceptuel (différences horizontales 9x8) du disque de la pièce.
+
+    Returns:
+        Entier 64 bits
+    """
+    pixels, _ = load_small(image_path)
+    return dhash_pixels(pixels)
+
+
+def dhash_pixels(pixels):
+    """dHash d'une image déjà réduite (tableau float32 HxWx3, voir coin_detect)."""
+    circle = detect_circle(pixels)
+    gray = pixels @ LUMA
+    if circle:
+        h, w = gray.shape
+        r = circle.radius
+        gray = gray[max(0, int(circle.cy - r)):min(h, int(circle.cy + r) + 1),
+                    max(0, int(circle.cx - r)):min(w, int(circle.cx + r) + 1)]
+    small = Image.fromarray(gray.astype(np.uint8)).resize((9, 8), Image.Resampling.BOX)
+    a = np.asarray(small, dtype=np.int16)
+    bits = (a[:, 1:] > a[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def photo_key(path):
+    """Clé d'une photo: chemin relatif à pictures/, ou chemin absolu hors de pictures/."""
+    try:
+        return image_key(path)
+    except ValueError:
+        return Path(path).resolve().as_posix()
+
+
+def key_exists(key):
+    """Indique si la photo désignée par une clé existe encore."""
+    return (PICTURES_DIR / key).exists()
+
+
+def split_hash(value):
+    """Découpe un hash 64 bits en CHUNKS blocs de CHUNK_BITS bits."""
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (CHUNK_BITS * i)) & mask for i in range(CHUNKS)]
+
+
+def chunk_neighbours(chunk, radius):
+    """Valeurs d'un bloc à distance de Hamming <= radius (0, 1 ou 2)."""
+    values = {chunk}
+    for _ in range(radius):
+        values |= {v ^ (1 << bit) for v in values for bit in range(CHUNK_BITS)}
+    return sorted(values)
+
+
+def hash_file(path):
+    """Worker: stat et hash d'une photo."""
+    try:
+        stat = path.stat()
+        return path, stat.st_size, stat.st_mtime_ns, dhash(path), None
+    except Exception as e:
+        return path, None, None, None, str(e)
+
+
+class PhashIndex:
+    """
+    Index SQLite des hash perceptuels, mis à jour de façon incrémentale.
+
+    Une photo dont la taille et la date n'ont pas changé n'est pas relue.
+    Chaque photo peut porter les métadonnées de la pièce analysée et le
+    chemin de l'autre photo de la paire.
+    """
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        chunk_columns = "".join(f" b{i} INTEGER NOT NULL," for i in range(CHUNKS))
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            " key TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " hash TEXT NOT NULL,"
+            f"{chunk_columns}"
+            " partner TEXT,"
+            " metadata TEXT)"
+        )
+        for i in range(CHUNKS):
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS images_b{i} ON images (b{i})")
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def stale(self, image_paths):
+        """Photos absentes de l'index ou modifiées depuis leur indexation."""
+        known = {key: (size, mtime) for key, size, mtime in
+                 self.db.execute("SELECT key, size, mtime_ns FROM images")}
+        result = []
+        for path in image_paths:
+            stat = path.stat()
+            if known.get(photo_key(path)) != (stat.st_size, stat.st_mtime_ns):
+                result.append(path)
+        return result
+
+    def add(self, key, size, mtime_ns, value):
+        """Insère ou remplace le hash d'une photo (ses métadonnées sont oubliées)."""
+        self.db.execute(
+            f"INSERT OR REPLACE INTO images (key, size, mtime_ns, hash, {', '.join(f'b{i}' for i in range(CHUNKS))})"
+            f" VALUES (?, ?, ?, ?{', ?' * CHUNKS})",
+            (key, size, mtime_ns, f"{value:016x}", *split_hash(value))
+        )
+
+    def update(self, image_paths, jobs=1, verbose=False):
+        """
+        Indexe les photos nouvelles ou modifiées.
+
+        Returns:
+            Nombre de photos hashées
+        """
+        stale = self.stale(image_paths)
+        if not stale:
+            return 0
+
+        if jobs > 1:
+            executor = ProcessPoolExecutor(max_workers=jobs)
+            results = executor.map(hash_file, stale, chunksize=16)
+        else:
+            executor = None
+            results = map(hash_file, stale)
+
+        count = 0
+        try:
+            with self.db:
+                for path, size, mtime_ns, value, error in results:
+                    if error:
+                        print(f"✗ {path.name}: erreur - {error}")
+                        continue
+                    self.add(photo_key(path), size, mtime_ns, value)
+                    count += 1
+                    if verbose and count % 500 == 0:
+                        print(f"   {count}/{len(stale)} photos indexées", flush=True)
+        finally:
+            if executor:
+                executor.shutdown()
+        return count
+
+    def prune(self):
+        """Oublie les photos supprimées du disque."""
+        gone = [(key,) for (key,) in self.db.execute("SELECT key FROM images") if not key_exists(key)]
+        with self.db:
+            self.db.executemany("DELETE FROM images WHERE key = ?", gone)
+        return len(gone)
+
+    def get_hash(self, key):
+        row = self.db.execute("SELECT hash FROM images WHERE key = ?", (key,)).fetchone()
+        return int(row[0], 16) if row else None
+
+    def query(self, value, max_distance=DUPLICATE_DISTANCE, exclude=(), with_metadata=False):
+        """
+        Photos à distance de Hamming <= max_distance d'un hash.
+
+        Returns:
+            Liste triée de tuples (distance, clé, partenaire, métadonnées)
+        """
+        radius = max_distance // CHUNKS
+        clauses, params = [], []
+        for i, chunk in enumerate(split_hash(value)):
+            neighbours = chunk_neighbours(chunk, radius)
+            clauses.append(f"b{i} IN ({', '.join('?' * len(neighbours))})")
+            params.extend(neighbours)
+        sql = f"SELECT key, hash, partner, metadata FROM images WHERE ({' OR '.join(clauses)})"
+        if with_metadata:
+            sql += " AND metadata IS NOT NULL"
+
+        matches = []
+        for key, stored, partner, metadata in self.db.execute(sql, params):
+            distance = (int(stored, 16) ^ value).bit_count()
+            if distance <= max_distance and key not in exclude:
+                matches.append((distance, key, partner, metadata))
+        matches.sort()
+        return matches
+
+    def attach(self, face_path, pile_path, metadata):
+        """Associe le résultat d'analyse d'une pièce à ses deux photos."""
+        if "error" in metadata:
+            return
+        result = json.dumps({k: v for k, v in metadata.items()
+                             if k not in ("id", "images", "possible_duplicate_of")}, ensure_ascii=False)
+        face, pile = photo_key(face_path), photo_key(pile_path)
+        with self.db:
+            self.db.execute("UPDATE images SET partner = ?, metadata = ? WHERE key = ?", (pile, result, face))
+            self.db.execute("UPDATE images SET partner = ?, metadata = ? WHERE key = ?", (face, result, pile))
+
+    def find_duplicate(self, face_path, pile_path, max_distance=DUPLICATE_DISTANCE):
+        """
+        Cherche une pièce déjà analysée dont les deux photos ressemblent à cette paire.
+
+        Les deux faces doivent correspondre aux deux photos d'une même paire
+        connue (dans un ordre ou dans l'autre). Le résultat est un candidat à
+        vérifier, pas une identité (voir l'en-tête du module).
+
+        Returns:
+            Tuple (métadonnées, clé de la photo correspondante) ou None
+        """
+        face, pile = photo_key(face_path), photo_key(pile_path)
+        face_hash, pile_hash = self.get_hash(face), self.get_hash(pile)
+        if face_hash is None or pile_hash is None:
+            return None
+
+        exclude = {face, pile}
+        pile_matches = {key: distance for distance, key, _, _ in
+                        self.query(pile_hash, max_distance, exclude, with_metadata=True)}
+        for distance, key, partner, metadata in self.query(face_hash, max_distance, exclude, with_metadata=True):
+            if partner in pile_matches:
+                return json.loads(metadata), key
+        return None
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def benchmark(count, max_distance, queries=200):
+    """Mesure les recherches sur un index synthétique de count hash aléatoires."""
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp, PhashIndex(Path(tmp) / "bench.sqlite3") as index:
+        rng = random.Random(42)
+        values = [rng.getrandbits(64) for _ in range(count)]
+        start = time.perf_counter()
+        with index.db:
+            for n, value in enumerate(values):
+                index.add(f"bench/{n}.jpg", 0, 0, value)
+        print(f"🧪 {count} hash insérés en {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        found = 0
+        for value in values[:queries]:
+            # Requête bruitée: quelques bits inversés par rapport à l'original
+            noisy = value
+            for bit in rng.sample(range(64), max_distance):
+                noisy ^= 1 << bit
+            found += any(d <= max_distance for d, *_ in index.query(noisy, max_distance))
+        elapsed = time.perf_counter() - start
+        print(f"🔎 {queries} recherches (distance {max_distance}): {elapsed * 1000 / queries:.2f} ms/recherche, "
+              f"{found}/{queries} retrouvés")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Index des hash perceptuels des photos de pièces")
+    parser.add_argument('directory', nargs='?', default='pictures',
+                        help='Répertoire des photos, sous-répertoires compris (défaut: pictures)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Nombre de processus en parallèle (défaut: 1, 0 = tous les cœurs)')
+    parser.add_argument('--distance', type=int, default=DUPLICATE_DISTANCE,
+                        help=f'Distance de Hamming maximale entre doublons (défaut: {DUPLICATE_DISTANCE})')
+    parser.add_argument('--query', metavar='IMAGE', help='Afficher les photos proches de IMAGE')
+    parser.add_argument('--benchmark', type=int, metavar='N',
+                        help='Mesurer les recherches sur N hash synthétiques')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.distance)
+        return 0
+
+    with PhashIndex() as index:
+        if args.query:
+            path = Path(args.query)
+            index.update([path])
+            matches = index.query(index.get_hash(photo_key(path)), args.distance, exclude={photo_key(path)})
+            for distance, key, _, metadata in matches:
+                marker = " (analysée)" if metadata else ""
+                print(f"{distance:>2}  {key}{marker}")
+            if not matches:
+                print("Aucune photo proche")
+            return 0
+
+        pictures_dir = Path(args.directory)
+        if not pictures_dir.exists():
+            print(f"Erreur: le répertoire {pictures_dir} n'existe pas")
+            return 1
+
+        images = sorted(f for f in pictures_dir.rglob('*') if f.suffix in EXTENSIONS and f.is_file())
+        jobs = args.jobs or os.cpu_count() or 1
+        start = time.perf_counter()
+        count = index.update(images, jobs, verbose=True)
+        removed = index.prune()
+        print(f"✅ {count} photos hashées en {time.perf_counter() - start:.1f}s, "
+              f"{len(images) - count} déjà à jour, {removed} oubliées")
+        print(f"📁 {index.path}: {len(index)} photos")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Contrôle qualité vectorisé (NumPy) des photos avant recadrage et analyse.
+
+La photo est décodée en mode draft JPEG (1/8 de la résolution) puis réduite
+à QUALITY_SIZE pixels de grand côté. Sur cette copie:
+
+- présence de la pièce: disque trouvé par coin_detect.detect_circle, assez
+  grand et pas coupé par le bord du cadre,
+- netteté: variance du laplacien de la luminance sur la boîte de la pièce,
+- exposition: part du fond bouché (noir), et part brûlée (blanc) du fond ou
+  de la pièce (reflets), d'après l'histogramme de la luminance. Les pixels
+  sombres de la pièce ne comptent pas: une patine foncée n'est pas un défaut.
+
+Les seuils sont calés sur une séance réelle (198 photos, 2025-11-02_19h15):
+aucune photo lisible n'est rejetée, avec une marge d'un facteur 4 au moins
+sur chaque mesure.
+
+Une photo rejetée part dans le rapport des photos à refaire
+(reshoot_report.csv). En mode "report" (défaut des scripts), elle est
+traitée quand même; en mode "skip", elle n'est ni recadrée ni envoyée à l'API.
+
+Coût mesuré sur une machine lente: ~24 ms de décodage draft et ~10 ms de
+calcul NumPy (dont ~8 ms de détection) par photo 1848x1848. Le décodage remplace celui de la détection:
+le disque trouvé est retenu par coin_detect et resservi au recadrage comme à
+la préparation des images, si bien que le contrôle ajoute surtout le calcul.
+
+Usage (contrôle d'un répertoire et mesure du débit):
+    python scripts/photo_quality.py pictures/2025-11-02_19h15
+    python scripts/photo_quality.py pictures/2025-11-02_19h15 --min-sharpness 40 --report
+"""
+
+import os
+import sys
+import csv
+import math
+import time
+from collections import namedtuple
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from coin_detect import detect_circle, scale_circle, remember_coin, DETECT_SIZE
+from phash_index import LUMA
+
+ROOT_DIR = Path(__file__).parent.parent
+REPORT_FILE = ROOT_DIR / "reshoot_report.csv"
+REPORT_COLUMNS = ("session", "photo", "coin", "reasons", "sharpness", "dark", "bright", "coin_size", "checked")
+
+# Grand côté de la copie analysée
+QUALITY_SIZE = 512
+# Variance minimale du laplacien (niveaux de gris 0-255, copie réduite). Séance
+# réelle: 425 au minimum (bronze patiné), médiane ~3500; flou gaussien de rayon 4
+# sur une photo nette: ~50
+MIN_SHARPNESS = 100.0
+# Niveaux considérés comme bouchés / brûlés, et part maximale du fond (ou de la
+# pièce, pour les reflets) concernée. Séance réelle: 0,4 % et 0,8 % au plus
+DARK_LEVEL = 16
+BRIGHT_LEVEL = 240
+MAX_CLIPPED = 0.1
+# Diamètre minimal de la pièce rapporté au petit côté (séance réelle: 30 % au moins).
+# La circularité du masque n'est pas un critère: les reflets le trouent sur des
+# photos parfaitement lisibles (jusqu'à 0,47)
+MIN_COIN_SIZE = 0.15
+# Débord toléré du disque hors du cadre, en fraction du rayon
+MAX_OVERFLOW = 0.1
+
+# Usage du contrôle par crop_images.py et analyze_coins.py: désactivé, rapport
+# seul (photos traitées quand même), ou photos rejetées écartées
+SCREEN_MODES = ("off", "report", "skip")
+DEFAULT_SCREEN = "report"
+
+# Mesures d'une photo; circle en pleine résolution dans le repère orienté (None sans pièce)
+Quality = namedtuple("Quality", "reasons sharpness dark bright coin_size circle")
+
+
+def load_screen(image_path, size=QUALITY_SIZE):
+    """
+    Décode la copie réduite et orientée d'une photo au plus petit coût.
+
+    Returns:
+        Tuple (tableau float32 HxWx3, dimensions pleine résolution orientées)
+    """
+    with Image.open(image_path) as img:
+        full_size = img.size
+        # Échelle JPEG 1/8: le décodeur saute l'essentiel du calcul
+        img.draft("RGB", (max(1, img.size[0] // 8), max(1, img.size[1] // 8)))
+        drafted = img.size
+        small = ImageOps.exif_transpose(img)
+        if small.mode != "RGB":
+            small = small.convert("RGB")
+    if small.size != drafted:
+        full_size = full_size[::-1]
+    if max(small.size) > size:
+        small = small.reduce(math.ceil(max(small.size) / size))
+    return np.asarray(small, dtype=np.float32), full_size
+
+
+def laplacian_variance(gray):
+    """Variance du laplacien 4-voisins (différences par tranches, sans convolution)."""
+    if gray.shape[0] < 3 or gray.shape[1] < 3:
+        return 0.0
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]) - 4 * gray[1:-1, 1:-1]
+    return float(lap.var())
+
+
+def screen_pixels(pixels, min_sharpness=MIN_SHARPNESS):
+    """
+    Mesure la qualité d'une copie réduite.
+
+    Returns:
+        Quality (circle dans le repère de la copie réduite); reasons vide si la photo est bonne
+    """
+    h, w, _ = pixels.shape
+    gray = pixels @ LUMA
+    reasons = []
+
+    # Détection à la taille de coin_detect, sur une vue sous-échantillonnée (sans copie)
+    factor = max(1, math.ceil(max(h, w) / DETECT_SIZE))
+    small = pixels[::factor, ::factor]
+    circle = scale_circle(detect_circle(small), small.shape, (small.shape[1] * factor, small.shape[0] * factor))
+    coin_size = 0.0
+    coin = np.zeros((h, w), dtype=bool)
+    if circle is None:
+        reasons.append("pièce absente")
+        region = gray
+    else:
+        coin_size = 2 * circle.radius / min(h, w)
+        overflow = max(circle.radius - circle.cx, circle.cx + circle.radius - w,
+                       circle.radius - circle.cy, circle.cy + circle.radius - h)
+        if coin_size < MIN_COIN_SIZE:
+            reasons.append(f"pièce trop petite ({coin_size:.0%} du cadre)")
+        if overflow > MAX_OVERFLOW * circle.radius:
+            reasons.append("pièce coupée par le bord")
+        r = circle.radius
+        region = gray[max(0, int(circle.cy - r)):int(math.ceil(circle.cy + r)),
+                      max(0, int(circle.cx - r)):int(math.ceil(circle.cx + r))]
+        ys, xs = np.ogrid[:h, :w]
+        coin = (xs + 0.5 - circle.cx) ** 2 + (ys + 0.5 - circle.cy) ** 2 <= r * r
+
+    sharpness = laplacian_variance(region)
+    if sharpness < min_sharpness:
+        reasons.append(f"floue (netteté {sharpness:.0f} < {min_sharpness:.0f})")
+
+    # Histogrammes du fond (ligne 0) et de la pièce (ligne 1) en un seul passage
+    levels = np.clip(gray, 0, 255).astype(np.uint8)
+    hist = np.bincount((levels + 256 * coin).ravel(), minlength=512).reshape(2, 256)
+    totals = np.maximum(hist.sum(axis=1), 1)
+    dark = float(hist[0, :DARK_LEVEL + 1].sum() / totals[0])
+    bright = float((hist[:, BRIGHT_LEVEL:].sum(axis=1) / totals).max())
+    if bright > MAX_CLIPPED:
+        reasons.append(f"surexposée ({bright:.0%} brûlé)")
+    if dark > MAX_CLIPPED:
+        reasons.append(f"sous-exposée ({dark:.0%} du fond bouché)")
+    return Quality(reasons, sharpness, dark, bright, coin_size, circle)
+
+
+def assess(image_path, min_sharpness=None):
+    """
+    Contrôle qualité d'une photo.
+
+    Args:
+        image_path: Chemin de la photo
+        min_sharpness: Netteté minimale (None = MIN_SHARPNESS)
+
+    Returns:
+        Quality, avec le disque de la pièce ramené en pleine résolution
+    """
+    pixels, full_size = load_screen(image_path)
+    quality = screen_pixels(pixels, MIN_SHARPNESS if min_sharpness is None else min_sharpness)
+    circle = scale_circle(quality.circle, pixels.shape, full_size)
+    # Le recadrage et la préparation des images réutilisent ce disque sans redécoder
+    remember_coin(image_path, circle)
+    return quality._replace(circle=circle)
+
+
+def describe(quality):
+    """Raisons du rejet, en une ligne."""
+    return ", ".join(quality.reasons)
+
+
+def report_row(path, quality, coin_id=None, today=None):
+    """Ligne du rapport des photos à refaire."""
+    return {
+        "session": path.parent.name,
+        "photo": path.name,
+        "coin": "" if coin_id is None else coin_id + 1,
+        "reasons": describe(quality),
+        "sharpness": f"{quality.sharpness:.0f}",
+        "dark": f"{quality.dark:.3f}",
+        "bright": f"{quality.bright:.3f}",
+        "coin_size": f"{quality.coin_size:.2f}",
+        "checked": (today or date.today()).isoformat(),
+    }
+
+
+def update_report(checked, rejected, path=REPORT_FILE):
+    """
+    Met à jour le rapport des photos à refaire.
+
+    Les photos contrôlées lors de cette exécution remplacent leurs anciennes
+    lignes: une photo refaite et désormais bonne disparaît du rapport.
+
+    Args:
+        checked: Chemins des photos contrôlées
+        rejected: Lignes (report_row) des photos rejetées
+
+    Returns:
+        Nombre de photos dans le rapport
+    """
+    path = Path(path)
+    keys = {(p.parent.name, p.name) for p in checked}
+    rows = []
+    if path.exists():
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            rows = [row for row in csv.DictReader(f) if (row["session"], row["photo"]) not in keys]
+    rows += rejected
+    rows.sort(key=lambda row: (row["session"], row["photo"]))
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
+    return len(rows)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Contrôle qualité des photos (netteté, exposition, pièce)")
+    parser.add_argument('directory', nargs='?', default='pictures/2025-11-02_19h15',
+                        help='Répertoire des photos (défaut: pictures/2025-11-02_19h15)')
+    parser.add_argument('--min-sharpness', type=float, default=MIN_SHARPNESS,
+                        help=f'Netteté minimale (variance du laplacien, défaut: {MIN_SHARPNESS:.0f})')
+    parser.add_argument('--report', action='store_true', help=f'Mettre à jour {REPORT_FILE.name}')
+    args = parser.parse_args()
+
+    images = sorted(Path(args.directory).glob("*.jpg"))
+    if not images:
+        print(f"❌ Aucune image trouvée dans {args.directory}")
+        return 1
+
+    start = time.perf_counter()
+    results = [(path, assess(path, args.min_sharpness)) for path in images]
+    elapsed = time.perf_counter() - start
+
+    for path, quality in results:
+        status = f"📸 à refaire: {describe(quality)}" if quality.reasons else "✓"
+        print(f"{path.name}: netteté {quality.sharpness:6.0f}, brûlé {quality.bright:5.1%}, "
+              f"bouché {quality.dark:5.1%}, pièce {quality.coin_size:4.0%}  {status}")
+
+    rejected = [report_row(path, quality) for path, quality in results if quality.reasons]
+    print(f"\n{len(images) - len(rejected)}/{len(images)} photos bonnes, "
+          f"{elapsed * 1000 / len(images):.1f} ms/photo")
+    if args.report:
+        total = update_report(images, rejected)
+        print(f"📋 {REPORT_FILE}: {total} photos à refaire")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
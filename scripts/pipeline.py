@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Pipeline de la photo brute à la pièce prête pour la galerie, en un seul décodage.
+
+Chaque photo est décodée une seule fois, dans un processus de travail. Cette
+image en mémoire sert à la détection de la pièce, au recadrage carré
+(crop_square, comme crop_images.py), aux déclinaisons de la galerie, au hash
+perceptuel et au JPEG préparé pour l'API. Seul le carré recadré est réencodé
+sur disque: rien n'est relu ni redécodé ensuite.
+
+Les étapes sont reliées par des files bornées:
+
+    paires ─▶ générateur ordonné sur le pool de processus (≤ 2 photos par processus en vol)
+           ─▶ asyncio.Queue (≤ 2 paires par requête) ─▶ analyse asyncio (analyze_coin_async)
+
+Le cache des résultats est consulté avant l'appel à l'API, comme dans
+analyze_coins.py. Une pièce déjà photographiée lors d'une autre séance est
+seulement signalée (possible_duplicate_of): elle est analysée quand même.
+
+Usage:
+    python scripts/pipeline.py -j 0 -c 8
+    python scripts/pipeline.py --session 2025-11-02_19h15 --all
+    python scripts/pipeline.py --no-analyze
+"""
+
+import io
+import os
+import sys
+import time
+import asyncio
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from PIL import Image
+
+from crop_images import (get_orientation, display_size, crop_square, save_atomic,
+                         load_manifest, save_manifest, manifest_entry, is_up_to_date, file_sha256,
+                         ORIENTATION_TRANSPOSE)
+from coin_detect import detect_coin_frame, reduce_frame, detect_circle, scale_circle, circle_box
+from build_renditions import (load_index, save_index, renditions_from_frame, index_entry, image_key,
+                              is_fresh, CACHE_DIR)
+from preprocess_images import encode_frame, encode_b64_stream, DETECT_MARGIN
+from phash_index import PhashIndex, dhash_pixels, photo_key
+from sessions import SessionRegistry, pending_pairs, CROP_SIZE
+from gallery_index import refresh_index
+from metrics import METRICS
+
+# Photos soumises au pool par processus, et paires prêtes en attente par requête d'analyse
+IN_FLIGHT_PER_JOB = 2
+QUEUED_PER_REQUEST = 2
+
+
+def process_photo(task, target_size=CROP_SIZE, detect=True, preprocess=None, cache_dir=CACHE_DIR):
+    """
+    Worker: traite une photo à partir d'un unique décodage.
+
+    Args:
+        task: Tuple (chemin, recadrer, décliner)
+        preprocess: Réglages {"max_edge", "quality"} du JPEG préparé pour l'API,
+            None pour ne pas le produire
+
+    Returns:
+        Dict: path, ok, message, crop (entrée de manifeste), rendition
+        (entrée d'index), phash (taille, date, hash), payload (base64),
+        timings (secondes par étape), metrics (mesures du processus, cf. metrics.py)
+    """
+    path, crop, renditions = task
+    result = {"path": path, "ok": False, "crop": None, "rendition": None, "phash": None, "payload": None}
+    timings = result["timings"] = Counter()
+    try:
+        start = time.perf_counter()
+        with Image.open(path) as img:
+            orientation = get_orientation(img)
+            transpose = ORIENTATION_TRANSPOSE.get(orientation)
+            width, height = display_size(img.size, orientation)
+            icc_profile = img.info.get("icc_profile")
+            with METRICS.stage("decode") as event:
+                img.load()
+                event["read"] = path.stat().st_size
+            timings["decode"] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            if (width, height) == (target_size, target_size) or not crop:
+                with METRICS.stage("transpose"):
+                    frame = img.transpose(transpose) if transpose is not None else img.copy()
+                result["message"] = f"= {path.name}: déjà au format {width}x{height}"
+                written = False
+            elif width >= target_size and height >= target_size:
+                circle = None
+                if detect:
+                    with METRICS.stage("detect"):
+                        circle = detect_coin_frame(img, (width, height), transpose)
+                center = (circle.cx, circle.cy) if circle else None
+                frame, params, box = crop_square(img, target_size, center)
+                save_atomic(frame, path, **params)
+                where = f" (pièce en {box[0]},{box[1]})" if center else ""
+                result["message"] = f"✓ {path.name}: {width}x{height} → {target_size}x{target_size}{where}"
+                written = True
+            else:
+                result["message"] = f"✗ {path.name}: dimensions insuffisantes ({width}x{height})"
+                return result
+            timings["crop"] += time.perf_counter() - start
+
+        digest = None
+        if crop:
+            result["crop"] = manifest_entry(path, target_size)
+            digest = result["crop"]["sha256"]
+
+        start = time.perf_counter()
+        if renditions or written:
+            digest = digest or file_sha256(path)
+            with METRICS.stage("renditions"):
+                files = renditions_from_frame(frame, digest, icc_profile, cache_dir)
+            result["rendition"] = index_entry(path, digest, files, frame.size)
+        timings["renditions"] += time.perf_counter() - start
+
+        # Pièce repérée sur le carré: hash perceptuel et cadrage du JPEG envoyé
+        start = time.perf_counter()
+        pixels = reduce_frame(frame)
+        stat = path.stat()
+        result["phash"] = (stat.st_size, stat.st_mtime_ns, dhash_pixels(pixels))
+        if preprocess:
+            circle = scale_circle(detect_circle(pixels), pixels.shape, frame.size)
+            box = circle_box(circle, frame.size, DETECT_MARGIN) if circle else None
+            data, _ = encode_frame(frame, box, **preprocess)
+            result["payload"] = encode_b64_stream(io.BytesIO(data))
+        timings["payload"] += time.perf_counter() - start
+
+        result["ok"] = True
+    except Exception as e:
+        result["message"] = f"✗ {path.name}: erreur - {str(e)}"
+    finally:
+        result["metrics"] = METRICS.drain()
+    return result
+
+
+class Pipeline:
+    """
+    Exécution du pipeline sur une liste de paires (id, face, pile).
+
+    Les manifestes de recadrage, l'index des déclinaisons et l'index
+    perceptuel sont tenus dans le processus principal, au fil des résultats;
+    tout ce qui n'est pas du calcul d'image tourne dans la boucle asyncio.
+    """
+
+    def __init__(self, pairs, jobs=1, concurrency=4, analyze=True, detect=True,
+                 preprocess=None, cache=None, index=None, target_size=CROP_SIZE, cascade=False):
+        self.pairs = pairs
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.analyze = analyze
+        self.preprocess = preprocess
+        self.cache = cache
+        self.index = index
+        self.target_size = target_size
+        self.cascade = cascade
+        self.worker = partial(process_photo, target_size=target_size, detect=detect,
+                              preprocess=preprocess if analyze else None)
+        self.manifests = {}
+        self.images = load_index()
+        self.results = []
+        self.cached = {}
+        self.timings = Counter()
+        self.photos = 0
+        self.errors = 0
+
+    def tasks(self):
+        """
+        Générateur des photos à soumettre au pool, paire par paire.
+
+        Une paire dont le résultat est déjà en cache et dont les photos sont à
+        jour n'est pas décodée.
+        """
+        for coin_id, face, pile in self.pairs:
+            flags = []
+            for photo in (face, pile):
+                entries = self.manifests.setdefault(photo.parent, load_manifest(photo.parent))
+                crop = not is_up_to_date(photo, entries.get(photo.name), self.target_size)
+                flags.append((crop, crop or not is_fresh(photo, self.images.get(image_key(photo)))))
+
+            if self.analyze and self.cache and not any(crop for crop, _ in flags):
+                from analyze_coins import cache_key_for, cached_result
+                key = cache_key_for(self.cache, face, pile, self.preprocess, self.cascade)
+                metadata = cached_result(self.cache, key, face, pile, coin_id)
+                if metadata:
+                    self.cached[coin_id] = metadata
+                    if not any(renditions for _, renditions in flags):
+                        continue
+
+            for photo, (crop, renditions) in zip((face, pile), flags):
+                yield photo, crop, renditions
+
+    def record(self, result):
+        """Enregistre le résultat d'une photo dans les manifestes et les index."""
+        path = result["path"]
+        self.photos += 1
+        self.timings.update(result["timings"])
+        METRICS.merge(result.pop("metrics"))
+        print(result["message"])
+        if not result["ok"]:
+            self.errors += 1
+            return
+        if result["crop"]:
+            self.manifests[path.parent][path.name] = result["crop"]
+        if result["rendition"]:
+            self.images[image_key(path)] = result["rendition"]
+        if self.index:
+            with self.index.db:
+                self.index.add(photo_key(path), *result["phash"])
+
+    async def prepare(self, queue):
+        """
+        Étape image: soumet les photos au pool de processus dans l'ordre, avec
+        au plus IN_FLIGHT_PER_JOB photos en vol par processus, et pousse chaque
+        paire complète dans la file d'analyse (bloquant quand elle est pleine).
+        """
+        loop = asyncio.get_running_loop()
+        partners = {}
+        for pair in self.pairs:
+            partners[pair[1]] = partners[pair[2]] = pair
+        waiting = {}
+        pending = deque()
+
+        async def collect(future):
+            result = await future
+            self.record(result)
+            waiting[result["path"]] = result
+            coin_id, face, pile = partners[result["path"]]
+            if face in waiting and pile in waiting:
+                await self.ready(queue, (coin_id, face, pile), waiting.pop(face), waiting.pop(pile))
+
+        with ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            for task in self.tasks():
+                pending.append(loop.run_in_executor(executor, self.worker, task))
+                if len(pending) >= self.jobs * IN_FLIGHT_PER_JOB:
+                    await collect(pending.popleft())
+            while pending:
+                await collect(pending.popleft())
+
+        # Paires servies par le cache sans passer par le pool
+        for pair in self.pairs:
+            if pair[0] in self.cached:
+                await self.ready(queue, pair)
+
+    async def ready(self, queue, pair, face_result=None, pile_result=None):
+        """Met une paire prête dans la file d'analyse: images préparées, résultat en cache ou erreur."""
+        if not self.analyze:
+            return
+        from analyze_coins import error_entry
+
+        coin_id, face, pile = pair
+        metadata = self.cached.pop(coin_id, None)
+        payload = None
+        if metadata is None:
+            failed = [r for r in (face_result, pile_result) if not r["ok"]]
+            if failed:
+                metadata = error_entry(face, pile, coin_id, failed[0]["message"])
+            else:
+                payload = (face_result["payload"], pile_result["payload"])
+        await queue.put((coin_id, face, pile, payload, metadata))
+
+    async def analyze_worker(self, client, queue):
+        """Étape réseau: analyse les paires de la file jusqu'à la sentinelle None."""
+        from analyze_coins import analyze_coin_async, find_duplicates, error_entry, format_result
+
+        while (item := await queue.get()) is not None:
+            coin_id, face, pile, payload, metadata = item
+            if metadata is None:
+                # Un doublon possible est signalé, jamais repris sans analyse
+                candidates = find_duplicates(self.index, [(coin_id, face, pile)]) if self.index else {}
+                try:
+                    metadata = await analyze_coin_async(client, face, pile, coin_id, self.preprocess,
+                                                        self.cache, payload, self.cascade)
+                except Exception as e:
+                    metadata = error_entry(face, pile, coin_id, e)
+                if coin_id in candidates:
+                    metadata["possible_duplicate_of"] = candidates[coin_id]
+                if self.index:
+                    self.index.attach(face, pile, metadata)
+            self.results.append(metadata)
+            print(f"[{len(self.results)}/{len(self.pairs)}] Pièce #{coin_id+1}: {format_result(metadata)}",
+                  flush=True)
+
+    async def run(self):
+        """Fait tourner les étapes: pool de processus → file bornée → requêtes asyncio."""
+        queue = asyncio.Queue(maxsize=max(1, self.concurrency * QUEUED_PER_REQUEST))
+
+        async def feed():
+            try:
+                await self.prepare(queue)
+            finally:
+                if self.analyze:
+                    for _ in range(self.concurrency):
+                        await queue.put(None)
+
+        try:
+            if not self.analyze:
+                await feed()
+                return
+            from anthropic import AsyncAnthropic
+            from analyze_coins import API_KEY_ENV
+
+            async with AsyncAnthropic(api_key=os.getenv(API_KEY_ENV)) as client:
+                await asyncio.gather(feed(), *(self.analyze_worker(client, queue) for _ in range(self.concurrency)))
+        finally:
+            self.save()
+
+    def save(self):
+        """Écrit les manifestes, l'index des déclinaisons et les résultats d'analyse."""
+        for directory, entries in self.manifests.items():
+            if entries:
+                save_manifest(directory, entries)
+        save_index(self.images)
+        if self.results:
+            from analyze_coins import write_metadata
+            from metadata_store import MetadataStore
+
+            with MetadataStore() as store:
+                write_metadata(sorted(self.results, key=lambda r: r["id"]), store)
+        refresh_index()
+
+    def summary(self, elapsed):
+        """Résumé: débit et temps cumulé par étape dans les processus de travail."""
+        stages = ", ".join(f"{name} {seconds:.1f} s" for name, seconds in self.timings.items())
+        ok = sum(1 for r in self.results if "error" not in r)
+        line = (f"✅ {len(self.pairs)} paires, {self.photos} photos décodées "
+                f"({self.photos / elapsed:.1f}/s, {self.errors} erreurs)")
+        if self.analyze:
+            line += f", {ok}/{len(self.results)} analysées"
+        line = f"{line} en {elapsed:.1f} s\n   Étapes (cumul des processus): {stages or '-'}"
+        if self.cascade:
+            from analyze_coins import cascade_summary
+            line += f"\n{cascade_summary(self.results) or '🪜 Cascade: aucune pièce envoyée'}"
+        return line
+
+
+def run_pipeline(pairs, jobs=1, concurrency=4, analyze=True, detect=True, preprocess=None,
+                 use_cache=True, dedup=True, cascade=False):
+    """
+    Traite des paires de bout en bout et affiche le résumé.
+
+    Returns:
+        Liste des résultats d'analyse
+    """
+    from result_cache import ResultCache
+
+    if analyze and preprocess is None:
+        from analyze_coins import DEFAULT_PREPROCESS
+        preprocess = DEFAULT_PREPROCESS
+
+    cache = ResultCache() if analyze and use_cache else None
+    index = PhashIndex() if dedup else None
+    pipeline = Pipeline(pairs, jobs, concurrency, analyze, detect, preprocess, cache, index, cascade=cascade)
+    start = time.perf_counter()
+    try:
+        asyncio.run(pipeline.run())
+    finally:
+        if cache:
+            cache.close()
+        if index:
+            index.close()
+    print(pipeline.summary(time.perf_counter() - start))
+    return pipeline.results
+
+
+def main():
+    import argparse
+    from preprocess_images import DEFAULT_MAX_EDGE, DEFAULT_QUALITY
+
+    parser = argparse.ArgumentParser(
+        description="Recadrage, déclinaisons et analyse des pièces en un seul décodage par photo"
+    )
+    parser.add_argument('--session', metavar='NOM', help='Traiter une seule séance (défaut: toutes)')
+    parser.add_argument('--all', action='store_true',
+                        help='Traiter toutes les paires, pas seulement celles en attente')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Processus pour le décodage et les images (défaut: 1, 0 = tous les cœurs)')
+    parser.add_argument('--concurrency', '-c', type=int, default=4,
+                        help='Requêtes d\'analyse simultanées (défaut: 4)')
+    parser.add_argument('--no-analyze', action='store_true', help='Recadrer et décliner sans analyser')
+    parser.add_argument('--center', action='store_true',
+                        help='Recadrer au centre de l\'image sans détecter la pièce')
+    parser.add_argument('--max-edge', type=int, default=DEFAULT_MAX_EDGE,
+                        help=f'Grand côté des images envoyées à l\'API (défaut: {DEFAULT_MAX_EDGE})')
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY,
+                        help=f'Qualité JPEG des images envoyées (défaut: {DEFAULT_QUALITY})')
+    parser.add_argument('--cascade', action='store_true',
+                        help='Modèle rapide d\'abord, modèle fort pour les seules réponses douteuses')
+    parser.add_argument('--no-cache', action='store_true', help='Ne pas consulter le cache des résultats')
+    parser.add_argument('--no-dedup', action='store_true',
+                        help='Ne pas signaler les pièces déjà photographiées lors d\'une autre séance '
+                             '(un doublon est seulement marqué possible_duplicate_of)')
+    args = parser.parse_args()
+
+    analyze = not args.no_analyze
+    if analyze:
+        from analyze_coins import API_KEY_ENV  # charge aussi .env
+        if not os.getenv(API_KEY_ENV):
+            print(f"❌ Erreur: Variable d'environnement {API_KEY_ENV} non définie (ou --no-analyze)")
+            return 1
+
+    registry = SessionRegistry()
+    registry.scan()
+    registry.save()
+    if args.all:
+        pairs = registry.pairs(args.session)
+    else:
+        pairs = [pair for pair in pending_pairs(registry, analyze)
+                 if args.session in (None, pair[1].parent.name)]
+    if not pairs:
+        print("✅ Rien à faire (--all pour tout retraiter)")
+        return 0
+
+    jobs = args.jobs or os.cpu_count() or 1
+    print(f"🪙 {len(pairs)} paires, {jobs} processus, {args.concurrency if analyze else 0} requêtes simultanées\n")
+    METRICS.start("pipeline")
+    try:
+        run_pipeline(pairs, jobs, args.concurrency, analyze, not args.center,
+                     {"max_edge": args.max_edge, "quality": args.quality},
+                     not args.no_cache, not args.no_dedup, args.cascade)
+    finally:
+        summary = METRICS.finish()
+        if summary:
+            print(f"\n{summary}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
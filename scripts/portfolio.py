@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Valorisation de la collection à partir des cotations des pièces.
+
+Le prix d'une cotation est un texte libre ("2.50", "1-3") dans sa devise:
+il est lu une fois en colonnes numériques prix bas / prix haut par l'index
+de recherche (coin_search, conservé dans .cache/ et rattrapé pièce par
+pièce), puis converti dans une devise de référence par une table de taux
+locale. Les totaux par pays, monnaie, état ou devise de cotation et
+l'ancienneté des cotations (last_updated) sont calculés sur ces colonnes
+par np.bincount, sans boucle Python sur les pièces.
+
+Table de taux: RATES ci-dessous (valeur d'une unité en euros), complétée
+ou corrigée par exchange_rates.json à la racine du projet s'il existe,
+ou par --rates FICHIER.
+
+Usage:
+    python scripts/portfolio.py
+    python scripts/portfolio.py --by country condition --base USD
+    python scripts/portfolio.py --stale-days 180 --json
+    python scripts/portfolio.py --benchmark 100000
+"""
+
+import sys
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+RATES_FILE = ROOT_DIR / "exchange_rates.json"
+
+# Valeur d'une unité de chaque devise en euros (ordre de grandeur, à ajuster dans RATES_FILE)
+RATES = {
+    "EUR": 1.0,
+    "USD": 0.92,
+    "GBP": 1.17,
+    "CHF": 1.06,
+    "CAD": 0.67,
+    "AUD": 0.60,
+    "JPY": 0.0061,
+    "SEK": 0.087,
+    "DKK": 0.134,
+    "NOK": 0.085,
+    "PLN": 0.23,
+    "CZK": 0.040,
+    "HUF": 0.0025,
+}
+
+# Regroupements possibles et leur libellé
+GROUPS = {
+    "country": "Pays",
+    "currency": "Monnaie",
+    "condition": "État",
+    "price_currency": "Devise de la cotation",
+}
+
+# Bornes (jours) des tranches d'ancienneté des cotations
+AGE_BOUNDS = (30, 180, 365, 730)
+
+
+def load_rates(path=RATES_FILE):
+    """Table des taux: RATES, complétée par un fichier JSON {devise: valeur en euros} s'il existe."""
+    rates = dict(RATES)
+    path = Path(path)
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as f:
+            rates.update({currency.upper(): float(rate) for currency, rate in json.load(f).items()})
+    return rates
+
+
+def age_labels(bounds=AGE_BOUNDS):
+    labels = [f"≤ {bounds[0]} j"]
+    labels += [f"{low + 1}-{high} j" for low, high in zip(bounds, bounds[1:])]
+    return labels + [f"> {bounds[-1]} j"]
+
+
+class Portfolio:
+    """
+    Colonnes de valorisation de la collection: codes des champs de
+    regroupement, prix bas/haut convertis dans la devise de référence (NaN
+    sans cotation ou sans taux connu) et date de la cotation.
+    """
+
+    def __init__(self, index, rates=None, base="EUR"):
+        """
+        Args:
+            index: SearchIndex (coin_search) de la collection
+            rates: Table {devise: valeur en euros} (défaut: load_rates())
+            base: Devise de référence des montants
+        """
+        rates = load_rates() if rates is None else rates
+        base = base.upper()
+        if base not in rates:
+            raise ValueError(f"Devise de référence sans taux: {base}")
+        present = index.present[:index.size]
+        # Vues sur les colonnes de l'index tant qu'aucune pièce n'a été retirée
+        rows = slice(0, index.size) if present.all() else np.flatnonzero(present)
+        self.base = base
+        self.ids = index.ids[rows]
+        # Libellés et clé de regroupement par champ: code + 1, 0 pour une valeur absente
+        self.labels = {field: ["?"] + index.vocab[field] for field in GROUPS}
+        self.keys = {field: index.codes(field)[rows] + 1 for field in GROUPS}
+
+        # Facteur de conversion par clé de devise
+        factors = np.array([np.nan] + [rates.get(c.upper(), np.nan) / rates[base]
+                                        for c in index.vocab["price_currency"]])
+        factor = factors[self.keys["price_currency"]]
+        self.native_low = index.price_low[rows]
+        self.low = self.native_low * factor
+        self.high = index.price_high[rows] * factor
+        self.valued = ~np.isnan(self.native_low)
+        self.converted = ~np.isnan(self.low)
+        self.days = index.valued[rows]
+        self.dated = ~np.isnan(self.days)
+
+        # Agrégats par bincount pondéré sur toutes les lignes (0 hors cotation)
+        # plutôt que par sélection booléenne: pas de copie ni de branchement par pièce
+        self.weights = {
+            "valued": self.valued.astype(np.float64),
+            "priced": self.converted.astype(np.float64),
+            "low": np.where(self.converted, self.low, 0.0),
+            "high": np.where(self.converted, self.high, 0.0),
+            "dated": self.dated.astype(np.float64),
+            "days": np.where(self.dated, self.days, 0.0),
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def summary(self):
+        """Totaux de la collection, et cotations sans taux de conversion par devise."""
+        weights = self.weights
+        labels = self.labels["price_currency"]
+        missing = np.bincount(self.keys["price_currency"], weights=weights["valued"] - weights["priced"],
+                              minlength=len(labels))
+        converted = int(weights["priced"].sum())
+        low = float(weights["low"].sum())
+        high = float(weights["high"].sum())
+        return {
+            "coins": len(self),
+            "valued": int(weights["valued"].sum()),
+            "converted": converted,
+            "unconverted": {labels[code]: int(n) for code, n in enumerate(missing.tolist()) if n},
+            "low": low,
+            "high": high,
+            "mean": (low + high) / 2 / converted if converted else None,
+        }
+
+    def group(self, field, today=None, stale_days=365):
+        """
+        Agrégats par valeur d'un champ, du plus gros montant au plus petit.
+
+        Returns:
+            Liste de dicts (valeur, pièces, cotées, bas, haut, moyenne,
+            âge moyen des cotations en jours, cotations plus vieilles que stale_days)
+        """
+        today = self._today(today)
+        labels = self.labels[field]
+        key = self.keys[field]
+        size = len(labels)
+
+        count = np.bincount(key, minlength=size)
+        sums = {name: np.bincount(key, weights=weights, minlength=size) for name, weights in self.weights.items()}
+        # Dates NaN (sans cotation datée): comparaison fausse, non comptées
+        stale = np.bincount(key, weights=self.days < today - stale_days, minlength=size)
+        valued, priced, low, high, age_count = (sums[name] for name in ("valued", "priced", "low", "high", "dated"))
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = (low + high) / 2 / priced
+            mean_age = today - sums["days"] / age_count
+        groups = []
+        for code in np.flatnonzero(count).tolist():
+            groups.append({
+                "value": labels[code],
+                "coins": int(count[code]),
+                "valued": int(valued[code]),
+                "low": float(low[code]),
+                "high": float(high[code]),
+                "mean": float(mean[code]) if priced[code] else None,
+                "age": float(mean_age[code]) if age_count[code] else None,
+                "stale": int(stale[code]),
+            })
+        groups.sort(key=lambda g: (-g["high"], -g["coins"], g["value"]))
+        return groups
+
+    def staleness(self, today=None, bounds=AGE_BOUNDS):
+        """
+        Ancienneté des cotations par tranche: nombre de cotations et montant
+        (prix haut) qu'elles représentent; dernière tranche: cotations sans date.
+        """
+        ages = self._today(today) - self.days
+        # Tranche: nombre de bornes dépassées; cotations sans date dans la case suivant la dernière tranche
+        bucket = np.zeros(len(self), np.intp)
+        for bound in bounds:
+            bucket += ages > bound
+        bucket[~self.dated] = len(bounds) + 1
+        counts = np.bincount(bucket, weights=self.weights["valued"], minlength=len(bounds) + 2)
+        amounts = np.bincount(bucket, weights=self.weights["high"], minlength=len(bounds) + 2)
+        labels = age_labels(bounds) + ["sans date"]
+        return [{"age": label, "valued": int(n), "high": float(amount)}
+                for label, n, amount in zip(labels, counts.tolist(), amounts.tolist())]
+
+    def report(self, fields=("country",), today=None, stale_days=365):
+        """Rapport complet: totaux, regroupements demandés et ancienneté."""
+        return {
+            "base": self.base,
+            "summary": self.summary(),
+            "groups": {field: self.group(field, today, stale_days) for field in fields},
+            "staleness": self.staleness(today),
+        }
+
+    @staticmethod
+    def _today(today):
+        """Jour de référence (jours depuis 1970)."""
+        day = np.datetime64("today", "D") if today is None else np.datetime64(str(today), "D")
+        return float(day.astype(np.int64))
+
+
+def money(amount):
+    return f"{amount:,.2f}".replace(",", " ")
+
+
+def print_report(report, top=20, stale_days=365):
+    base = report["base"]
+    summary = report["summary"]
+    print(f"💰 {summary['valued']}/{summary['coins']} pièces cotées: "
+          f"{money(summary['low'])} - {money(summary['high'])} {base}")
+    if summary["mean"] is not None:
+        print(f"   Moyenne par pièce cotée: {money(summary['mean'])} {base}")
+    if summary["unconverted"]:
+        missing = ", ".join(f"{currency} ({n})" for currency, n in summary["unconverted"].items())
+        print(f"⚠️  Cotations sans taux de conversion, non comptées: {missing}")
+
+    for field, groups in report["groups"].items():
+        print(f"\n📊 Par {GROUPS[field].lower()} ({len(groups)})")
+        print(f"   {'':<24} {'pièces':>7} {'cotées':>7} {'bas':>12} {'haut':>12} {'âge moy.':>9} "
+              f"{f'> {stale_days} j':>8}")
+        for group in groups[:top]:
+            age = f"{group['age']:.0f} j" if group["age"] is not None else "-"
+            print(f"   {group['value'][:24]:<24} {group['coins']:>7} {group['valued']:>7} "
+                  f"{money(group['low']):>12} {money(group['high']):>12} {age:>9} {group['stale']:>8}")
+        if len(groups) > top:
+            print(f"   ... {len(groups) - top} autres (--top)")
+
+    print(f"\n🕰️  Ancienneté des cotations")
+    for bucket in report["staleness"]:
+        if bucket["valued"]:
+            print(f"   {bucket['age']:<12} {bucket['valued']:>7} cotations  {money(bucket['high']):>12} {base}")
+
+
+def benchmark(n, fields):
+    """Rapport complet sur n pièces fictives (coin_search.synthetic_coins)."""
+    from coin_search import SearchIndex, synthetic_coins
+
+    index = SearchIndex.build(synthetic_coins(n))
+    rates = load_rates()
+    start = time.perf_counter()
+    portfolio = Portfolio(index, rates)
+    print(f"🏗️  Colonnes de valorisation: {n} pièces en {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    steps = {
+        "totaux": lambda: portfolio.summary(),
+        "ancienneté": lambda: portfolio.staleness(),
+        **{f"par {GROUPS[field].lower()}": lambda field=field: portfolio.group(field) for field in fields},
+        "rapport complet": lambda: Portfolio(index, rates).report(fields),
+    }
+    runs = 50
+    for label, step in steps.items():
+        step()
+        start = time.perf_counter()
+        for _ in range(runs):
+            step()
+        print(f"   {label:<28} {(time.perf_counter() - start) / runs * 1000:.2f} ms")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Valorisation de la collection à partir des cotations")
+    parser.add_argument('--by', nargs='+', choices=list(GROUPS), default=['country', 'condition'],
+                        help='Regroupements (défaut: country condition)')
+    parser.add_argument('--base', default='EUR', help='Devise de référence (défaut: EUR)')
+    parser.add_argument('--rates', type=Path, default=RATES_FILE,
+                        help='Table de taux JSON {devise: valeur en euros}')
+    parser.add_argument('--stale-days', type=int, default=365,
+                        help='Âge au-delà duquel une cotation est à revoir (défaut: 365 jours)')
+    parser.add_argument('--top', type=int, default=20, help='Lignes affichées par regroupement')
+    parser.add_argument('--json', action='store_true', help='Rapport en JSON')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='Banc d\'essai sur N pièces fictives')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.by)
+        return 0
+
+    from coin_search import open_index
+
+    try:
+        rates = load_rates(args.rates)
+    except (OSError, ValueError, AttributeError) as e:
+        print(f"❌ Table de taux illisible ({args.rates}): {e}")
+        return 1
+
+    start = time.perf_counter()
+    index = open_index()
+    try:
+        portfolio = Portfolio(index, rates, args.base)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    report = portfolio.report(args.by, stale_days=args.stale_days)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report, args.top, args.stale_days)
+        print(f"\n⏱️  {elapsed:.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
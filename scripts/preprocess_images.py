@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Préparation des photos avant envoi à l'API: détection du disque de la pièce,
+recadrage serré, réduction à un grand côté donné et réencodage JPEG.
+
+Le base64 est produit par blocs au lieu de garder plusieurs copies
+complètes de l'image en mémoire.
+
+Usage (rapport de comparaison avec l'envoi des JPEG bruts):
+    python scripts/preprocess_images.py pictures/2025-11-02_19h15 --limit 20
+"""
+
+import io
+import os
+import sys
+import time
+import math
+import base64
+from pathlib import Path
+from PIL import Image, ImageOps
+
+from crop_images import get_orientation, display_size
+from coin_detect import detect_coin, circle_box
+from metrics import METRICS
+
+# Grand côté par défaut: ~1.15 Mpx en carré, taille traitée par l'API sans redimensionnement
+DEFAULT_MAX_EDGE = 1092
+DEFAULT_QUALITY = 85
+
+# Marge autour du disque détecté
+DETECT_MARGIN = 0.06
+
+# Blocs de 3 octets * 64 Kio: chaque bloc s'encode sans padding intermédiaire
+B64_CHUNK = 3 * 64 * 1024
+
+# Limites appliquées par l'API avant de compter les tokens image (≈ largeur * hauteur / 750)
+API_MAX_EDGE = 1568
+API_MAX_PIXELS = 1_150_000
+
+
+def encode_b64_stream(fileobj, chunk_size=B64_CHUNK):
+    """
+    Encode un flux binaire en base64 par blocs.
+
+    Seuls un bloc brut et la chaîne finale coexistent en mémoire, au lieu des
+    copies bytes -> base64 bytes -> str de l'encodage en une fois.
+    """
+    parts = []
+    with METRICS.stage("base64") as event:
+        read = 0
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            read += len(chunk)
+            parts.append(base64.standard_b64encode(chunk).decode("ascii"))
+        event["read"] = read
+        return "".join(parts)
+
+
+def detect_coin_box(image_path, margin=DETECT_MARGIN):
+    """
+    Repère le disque de la pièce (voir coin_detect) et renvoie sa boîte
+    englobante, élargie de margin.
+
+    Returns:
+        Boîte (left, top, right, bottom) en pleine résolution dans le repère
+        de l'image orientée, ou None si aucune pièce n'est trouvée
+    """
+    with METRICS.stage("detect") as event:
+        circle = detect_coin(image_path)
+        event["read"] = os.path.getsize(image_path)
+    if circle is None:
+        return None
+    with Image.open(image_path) as img:
+        full_size = display_size(img.size, get_orientation(img))
+    return circle_box(circle, full_size, margin)
+
+
+def prepare_image(image_path, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_QUALITY):
+    """
+    Produit le JPEG envoyé à l'API pour une photo: pièce recadrée, grand
+    côté limité à max_edge.
+
+    Le décodeur JPEG travaille directement à la plus petite échelle (1/2,
+    1/4, 1/8) qui conserve max_edge pixels sur la pièce.
+
+    Returns:
+        Tuple (octets JPEG, (largeur, hauteur))
+    """
+    box = detect_coin_box(image_path)
+
+    with Image.open(image_path) as img:
+        full_size = display_size(img.size, get_orientation(img))
+        side = max(box[2] - box[0], box[3] - box[1]) if box else max(full_size)
+        scale = min(1.0, max_edge / side)
+        img.draft("RGB", (math.ceil(img.size[0] * scale), math.ceil(img.size[1] * scale)))
+        with METRICS.stage("decode") as event:
+            img.load()
+            event["read"] = os.path.getsize(image_path)
+        with METRICS.stage("transpose"):
+            frame = ImageOps.exif_transpose(img)
+
+    if box:
+        ratio = frame.size[0] / full_size[0]
+        box = tuple(int(round(v * ratio)) for v in box)
+    return encode_frame(frame, box, max_edge, quality)
+
+
+def encode_frame(frame, box=None, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_QUALITY):
+    """
+    Recadre une image décodée et orientée sur box, la réduit à max_edge et
+    l'encode en JPEG (sans modifier frame).
+
+    Returns:
+        Tuple (octets JPEG, (largeur, hauteur))
+    """
+    with METRICS.stage("crop"):
+        if box:
+            frame = frame.crop(box)
+        else:
+            frame = frame.copy()
+        if frame.mode != "RGB":
+            frame = frame.convert("RGB")
+    with METRICS.stage("resize"):
+        frame.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    with METRICS.stage("encode") as event:
+        frame.save(buffer, format="JPEG", quality=quality, optimize=True)
+        event["written"] = buffer.tell()
+    return buffer.getvalue(), frame.size
+
+
+def encode_prepared(image_path, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_QUALITY):
+    """Prépare une photo et renvoie directement son encodage base64."""
+    data, _ = prepare_image(image_path, max_edge, quality)
+    return encode_b64_stream(io.BytesIO(data))
+
+
+def estimate_image_tokens(size):
+    """Estimation des tokens facturés pour une image, après le redimensionnement côté API."""
+    width, height = size
+    scale = min(1.0, API_MAX_EDGE / max(width, height), math.sqrt(API_MAX_PIXELS / (width * height)))
+    return int(width * scale * height * scale / 750)
+
+
+def payload_report(images, max_edge, quality):
+    """
+    Compare l'envoi des JPEG bruts et des images préparées.
+
+    Returns:
+        Liste de dicts par photo (octets base64, temps d'encodage, tokens estimés)
+    """
+    rows = []
+    for image_path in images:
+        start = time.perf_counter()
+        with open(image_path, "rb") as f:
+            raw_b64 = encode_b64_stream(f)
+        raw_ms = (time.perf_counter() - start) * 1000
+        with Image.open(image_path) as img:
+            raw_size = display_size(img.size, get_orientation(img))
+
+        start = time.perf_counter()
+        data, prepared_size = prepare_image(image_path, max_edge, quality)
+        prepared_b64 = encode_b64_stream(io.BytesIO(data))
+        prepared_ms = (time.perf_counter() - start) * 1000
+
+        rows.append({
+            "name": image_path.name,
+            "raw_bytes": len(raw_b64),
+            "raw_ms": raw_ms,
+            "raw_tokens": estimate_image_tokens(raw_size),
+            "prepared_bytes": len(prepared_b64),
+            "prepared_ms": prepared_ms,
+            "prepared_tokens": estimate_image_tokens(prepared_size),
+            "prepared_size": prepared_size,
+        })
+    return rows
+
+
+def time_api_calls(images, max_edge, quality):
+    """Mesure l'aller-retour API réel (ou vers le serveur de test) pour les deux chemins."""
+    from anthropic import Anthropic
+    from analyze_coins import build_request, encode_image, API_KEY_ENV
+
+    client = Anthropic(api_key=os.getenv(API_KEY_ENV))
+    timings = {"raw": [], "prepared": []}
+    pairs = [(images[i], images[i + 1]) for i in range(0, len(images) - 1, 2)]
+
+    for face, pile in pairs:
+        for mode in timings:
+            start = time.perf_counter()
+            if mode == "raw":
+                face_b64, pile_b64 = encode_image(face), encode_image(pile)
+            else:
+                face_b64 = encode_prepared(face, max_edge, quality)
+                pile_b64 = encode_prepared(pile, max_edge, quality)
+            message = client.messages.create(**build_request(face_b64, pile_b64))
+            timings[mode].append((time.perf_counter() - start, message.usage.input_tokens))
+    return timings
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Rapport: octets et latence des images brutes vs préparées pour l'API"
+    )
+    parser.add_argument('directory', nargs='?', default='pictures/2025-11-02_19h15',
+                        help='Répertoire des photos (défaut: pictures/2025-11-02_19h15)')
+    parser.add_argument('--max-edge', type=int, default=DEFAULT_MAX_EDGE,
+                        help=f'Grand côté des images préparées (défaut: {DEFAULT_MAX_EDGE})')
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY,
+                        help=f'Qualité JPEG des images préparées (défaut: {DEFAULT_QUALITY})')
+    parser.add_argument('--limit', type=int, default=20, help='Nombre de photos analysées (défaut: 20)')
+    parser.add_argument('--live', action='store_true',
+                        help='Mesurer aussi la latence réelle des appels API (payant hors serveur de test)')
+    args = parser.parse_args()
+
+    images = sorted(Path(args.directory).glob("*.jpg"))[:args.limit]
+    if not images:
+        print(f"❌ Aucune image trouvée dans {args.directory}")
+        return 1
+
+    rows = payload_report(images, args.max_edge, args.quality)
+
+    print(f"{'Photo':<22} {'Brut (Ko)':>10} {'Préparé (Ko)':>13} {'Tokens':>14} {'Encodage (ms)':>15}")
+    print("-" * 78)
+    for r in rows:
+        print(f"{r['name']:<22} {r['raw_bytes'] / 1024:>10.0f} {r['prepared_bytes'] / 1024:>13.0f} "
+              f"{r['raw_tokens']:>6} → {r['prepared_tokens']:<5} {r['raw_ms']:>6.1f} → {r['prepared_ms']:<6.1f}")
+
+    raw_total = sum(r["raw_bytes"] for r in rows)
+    prepared_total = sum(r["prepared_bytes"] for r in rows)
+    print("-" * 78)
+    print(f"Octets envoyés: {raw_total / 1024 / 1024:.1f} Mo → {prepared_total / 1024 / 1024:.1f} Mo "
+          f"(x{raw_total / max(prepared_total, 1):.1f} plus léger)")
+    print(f"Tokens image estimés: {sum(r['raw_tokens'] for r in rows)} → {sum(r['prepared_tokens'] for r in rows)}")
+
+    if args.live:
+        timings = time_api_calls(images, args.max_edge, args.quality)
+        print("\nAppels API (paire face/pile):")
+        for mode, values in timings.items():
+            if values:
+                avg = sum(t for t, _ in values) / len(values)
+                tokens = sum(n for _, n in values) / len(values)
+                print(f"  {mode:<9} {avg * 1000:8.0f} ms en moyenne, {tokens:.0f} tokens d'entrée")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Cache persistant des résultats d'analyse, indexé par le contenu des photos.
+
+La clé combine le SHA-256 des deux JPEG (face et pile), le modèle, la
+version du prompt et les réglages de préparation des images: une paire déjà
+analysée dans les mêmes conditions n'est jamais renvoyée à l'API.
+
+Usage (statistiques et purge):
+    python scripts/result_cache.py --stats
+    python scripts/result_cache.py --clear
+"""
+
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+
+from crop_images import file_sha256
+
+CACHE_FILE = Path(".cache/analysis_cache.sqlite3")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Champs propres à la paire analysée, recalculés à chaque utilisation
+PAIR_FIELDS = ("id", "images")
+
+
+def prompt_version(prompt):
+    """Version courte d'un prompt: change dès que son texte change."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def cache_key(face_hash, pile_hash, model, version, variant=None):
+    """Clé de cache d'une paire de photos pour un modèle et un prompt donnés."""
+    variant_text = json.dumps(variant, sort_keys=True) if variant else ""
+    raw = "|".join((face_hash, pile_hash, model, version, variant_text))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache SQLite des métadonnées extraites, avec éviction LRU par taille.
+
+    Les compteurs hits/misses portent sur la durée de vie de l'instance.
+    """
+
+    def __init__(self, path=CACHE_FILE, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.db.commit()
+
+    def key_for(self, face_path, pile_path, model, version, variant=None):
+        """Calcule la clé d'une paire à partir du contenu des fichiers."""
+        return cache_key(file_sha256(face_path), file_sha256(pile_path), model, version, variant)
+
+    def get(self, key):
+        """Renvoie le résultat en cache (sans id ni images) ou None."""
+        row = self.db.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        with self.db:
+            self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, metadata):
+        """Enregistre un résultat réussi puis applique la limite de taille."""
+        if "error" in metadata:
+            return
+        result = json.dumps({k: v for k, v in metadata.items() if k not in PAIR_FIELDS}, ensure_ascii=False)
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (key, result, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, result, len(result), now, now)
+            )
+        self.evict()
+
+    def evict(self):
+        """Supprime les entrées les moins récemment utilisées au-delà de max_bytes."""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return 0
+        removed = 0
+        with self.db:
+            for key, size in self.db.execute("SELECT key, size FROM results ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        return removed
+
+    def total_bytes(self):
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def stats(self):
+        """Statistiques du cache et de la session courante."""
+        entries = self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": self.total_bytes(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def summary(self):
+        """Résumé d'une ligne pour l'affichage en fin de traitement."""
+        s = self.stats()
+        lookups = s["hits"] + s["misses"]
+        rate = f" ({s['hits'] / lookups:.0%})" if lookups else ""
+        return (f"💾 Cache: {s['hits']} hits, {s['misses']} misses{rate}, "
+                f"{s['entries']} entrées, {s['bytes'] / 1024:.0f} Ko")
+
+    def clear(self):
+        with self.db:
+            self.db.execute("DELETE FROM results")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cache des résultats d'analyse des pièces")
+    parser.add_argument('--stats', action='store_true', help='Afficher le contenu du cache')
+    parser.add_argument('--clear', action='store_true', help='Vider le cache')
+    args = parser.parse_args()
+
+    with ResultCache() as cache:
+        if args.clear:
+            cache.clear()
+            print("✓ Cache vidé")
+        s = cache.stats()
+        print(f"📁 {cache.path}")
+        print(f"   {s['entries']} entrées, {s['bytes'] / 1024:.0f} Ko / {s['max_bytes'] / 1024 / 1024:.0f} Mo")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Séances de photos: découverte, registre des paires et mode surveillance.
+
+Chaque sous-répertoire daté de pictures/ (AAAA-MM-JJ_HHhMM) est une séance.
+Le registre gallery/sessions.json attribue à chaque paire de photos (face,
+pile) un id de pièce définitif, dans l'ordre d'arrivée: les ids restent
+contigus d'une séance à l'autre et ceux déjà attribués ne changent jamais,
+même quand une séance s'agrandit. La galerie PHP lit ce registre.
+
+Un balayage ne relit que les séances dont le répertoire a changé depuis le
+précédent (date de modification). Le mode surveillance (inotify, ou
+scrutation à défaut) attend la fin des copies puis envoie uniquement les
+nouvelles paires au recadrage, aux déclinaisons et à l'analyse.
+
+Le répertoire des photos se change avec la variable COINS_PICTURES_DIR.
+
+Usage:
+    python scripts/sessions.py                  # état des séances
+    python scripts/sessions.py --watch -c 4     # ingestion continue
+    python scripts/sessions.py --watch --no-analyze
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import select
+import struct
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+PICTURES_ROOT = Path(os.environ.get("COINS_PICTURES_DIR") or ROOT_DIR / "pictures")
+REGISTRY_FILE = ROOT_DIR / "gallery" / "sessions.json"
+REGISTRY_VERSION = 1
+SESSION_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}_\d{2}h\d{2}$")
+# Taille du carré de recadrage (cf. crop_images.py)
+CROP_SIZE = 1848
+# Secondes sans nouvel événement (et depuis la dernière écriture d'un fichier)
+# avant de traiter une séance
+DEBOUNCE = 2.0
+# Intervalle de scrutation quand inotify n'est pas disponible
+POLL_INTERVAL = 2.0
+
+
+def is_session(name):
+    return bool(SESSION_PATTERN.match(name))
+
+
+def discover_sessions(root=PICTURES_ROOT):
+    """Répertoires de séance sous root, triés par date."""
+    root = Path(root)
+    if not root.is_dir():
+        return []
+    return sorted(Path(entry.path) for entry in os.scandir(root) if entry.is_dir() and is_session(entry.name))
+
+
+def list_photos(directory):
+    """Noms des photos JPEG d'une séance, triés (fichiers cachés et temporaires exclus)."""
+    return sorted(
+        entry.name for entry in os.scandir(directory)
+        if entry.is_file() and not entry.name.startswith(".") and entry.name.lower().endswith(".jpg")
+    )
+
+
+class SessionRegistry:
+    """
+    Registre des séances et des paires de photos, avec leurs ids de pièce.
+
+    Les paires sont formées dans l'ordre des noms parmi les photos pas encore
+    appariées: une photo seule attend sa pile au balayage suivant.
+    """
+
+    def __init__(self, path=REGISTRY_FILE, root=PICTURES_ROOT):
+        self.path = Path(path)
+        self.root = Path(root)
+        self.next_id = 0
+        self.sessions = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == REGISTRY_VERSION:
+            self.next_id = data["next_id"]
+            self.sessions = data["sessions"]
+
+    def scan(self, names=None):
+        """
+        Enregistre les nouvelles paires des séances (toutes, ou celles nommées).
+
+        Returns:
+            Liste de tuples (id, face, pile) des paires ajoutées
+        """
+        if names is None:
+            directories = discover_sessions(self.root)
+        else:
+            directories = sorted(self.root / name for name in names if (self.root / name).is_dir())
+
+        added = []
+        for directory in directories:
+            mtime_ns = directory.stat().st_mtime_ns
+            info = self.sessions.setdefault(directory.name, {"mtime_ns": None, "pairs": []})
+            if info["mtime_ns"] == mtime_ns:
+                continue
+
+            paired = {name for _, face, pile in info["pairs"] for name in (face, pile)}
+            new = [name for name in list_photos(directory) if name not in paired]
+            for face, pile in zip(new[0::2], new[1::2]):
+                info["pairs"].append([self.next_id, face, pile])
+                added.append((self.next_id, directory / face, directory / pile))
+                self.next_id += 1
+
+            # Une date trop récente peut encore couvrir une écriture en cours
+            # (résolution du système de fichiers): la séance sera relue
+            settled = time.time_ns() - mtime_ns > DEBOUNCE * 1e9
+            info["mtime_ns"] = mtime_ns if settled else None
+        return added
+
+    def pairs(self, session=None):
+        """Paires enregistrées (d'une séance ou de toutes), triées par id."""
+        coins = [
+            (coin_id, self.root / name / face, self.root / name / pile)
+            for name, info in self.sessions.items() if session in (None, name)
+            for coin_id, face, pile in info["pairs"]
+        ]
+        return sorted(coins)
+
+    def save(self):
+        """
+        Écrit le registre de façon atomique (compact), seulement s'il a changé:
+        sa date sert à savoir si l'index de la galerie est à jour.
+        """
+        data = json.dumps({"version": REGISTRY_VERSION, "next_id": self.next_id, "sessions": self.sessions},
+                          separators=(",", ":"), sort_keys=True).encode("utf-8")
+        try:
+            if self.path.read_bytes() == data:
+                return
+        except FileNotFoundError:
+            pass
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+
+# Surveillance des répertoires
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+EVENT_HEADER = struct.Struct("iIII")
+
+ROOT_EVENTS = IN_CREATE | IN_MOVED_TO | IN_ONLYDIR
+SESSION_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ONLYDIR
+
+
+class InotifyWatcher:
+    """
+    Surveillance par inotify (Linux, via ctypes): pictures/ pour les
+    nouvelles séances, chaque séance pour les photos écrites ou déplacées.
+    """
+
+    def __init__(self, root=PICTURES_ROOT):
+        import ctypes
+        import ctypes.util
+
+        self.root = Path(root)
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.watches = {}
+        self._add(self.root, ROOT_EVENTS, None)
+        for directory in discover_sessions(self.root):
+            self._add(directory, SESSION_EVENTS, directory.name)
+
+    def _add(self, path, mask, name):
+        import ctypes
+
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch", str(path))
+        self.watches[wd] = name
+
+    def wait(self, timeout):
+        """Attend des événements au plus timeout secondes; renvoie les séances touchées."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        try:
+            buffer = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(buffer):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            name = os.fsdecode(name)
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Événements perdus: tout relire
+                changed.update(directory.name for directory in discover_sessions(self.root))
+            elif self.watches.get(wd, "") is None:
+                if mask & IN_ISDIR and is_session(name):
+                    self._add(self.root / name, SESSION_EVENTS, name)
+                    changed.add(name)
+            elif wd in self.watches:
+                changed.add(self.watches[wd])
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Repli sans inotify: compare les dates de modification des répertoires de séance."""
+
+    def __init__(self, root=PICTURES_ROOT, interval=POLL_INTERVAL):
+        self.root = Path(root)
+        self.interval = interval
+        self.mtimes = self._mtimes()
+
+    def _mtimes(self):
+        mtimes = {}
+        for directory in discover_sessions(self.root):
+            try:
+                mtimes[directory.name] = directory.stat().st_mtime_ns
+            except FileNotFoundError:
+                pass
+        return mtimes
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        mtimes = self._mtimes()
+        changed = {name for name, mtime in mtimes.items() if self.mtimes.get(name) != mtime}
+        self.mtimes = mtimes
+        return changed
+
+    def close(self):
+        pass
+
+
+def open_watcher(root=PICTURES_ROOT, poll=False):
+    """inotify si disponible, sinon scrutation."""
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(root)
+        except (OSError, AttributeError) as e:
+            print(f"⚠️  inotify indisponible ({e}), scrutation toutes les {POLL_INTERVAL:.0f} s")
+    return PollingWatcher(root)
+
+
+def settled(pairs, now=None):
+    """Indique si toutes les photos des paires sont écrites depuis au moins DEBOUNCE secondes."""
+    now = now or time.time()
+    try:
+        return all(now - path.stat().st_mtime >= DEBOUNCE for _, face, pile in pairs for path in (face, pile))
+    except FileNotFoundError:
+        return False
+
+
+# Traitement des nouvelles paires
+
+def ingest(pairs, analyze=True, concurrency=4, jobs=1, detect=True):
+    """
+    Recadrage, déclinaisons puis analyse d'un lot de nouvelles paires, en un
+    seul décodage par photo (voir pipeline.py).
+    """
+    from pipeline import run_pipeline
+
+    run_pipeline(pairs, jobs, concurrency, analyze, detect)
+
+
+def watch(registry, watcher, analyze=True, concurrency=4, jobs=1, detect=True):
+    """
+    Boucle de surveillance: une séance touchée est relue après DEBOUNCE
+    secondes sans événement, et ses nouvelles paires sont traitées dès que
+    leurs fichiers ne bougent plus.
+    """
+    # Rattraper ce qui est arrivé hors surveillance
+    queue = registry.scan()
+    registry.save()
+    changed = set()
+    last_event = 0.0
+
+    while True:
+        events = watcher.wait(DEBOUNCE / 4 if changed or queue else 60)
+        now = time.monotonic()
+        if events:
+            changed |= events
+            last_event = now
+            continue
+
+        if changed and now - last_event >= DEBOUNCE:
+            added = registry.scan(changed)
+            changed.clear()
+            if added:
+                registry.save()
+                print(f"📷 {len(added)} nouvelles paires ({', '.join(sorted({face.parent.name for _, face, _ in added}))})")
+                queue += added
+
+        # Photos supprimées avant leur traitement
+        queue = [pair for pair in queue if pair[1].exists() and pair[2].exists()]
+        if queue and settled(queue):
+            batch, queue = queue, []
+            try:
+                ingest(batch, analyze, concurrency, jobs, detect)
+            except Exception as e:
+                print(f"❌ Échec du traitement de {len(batch)} paires: {e}")
+
+
+def session_progress(registry, name):
+    """
+    Avancement d'une séance d'après les manifestes de recadrage et la base
+    des métadonnées.
+
+    Returns:
+        Tuple (paires, photos présentes, ids des paires recadrées, ids des paires analysées)
+    """
+    from crop_images import load_manifest, is_up_to_date
+    from metadata_store import MetadataStore
+
+    with MetadataStore() as store:
+        analyzed = store.analyzed_ids()
+    pairs = registry.pairs(name)
+    directory = registry.root / name
+    manifest = load_manifest(directory) if directory.is_dir() else {}
+    photos = [path for _, face, pile in pairs for path in (face, pile) if path.exists()]
+    cropped = {path for path in photos if is_up_to_date(path, manifest.get(path.name), CROP_SIZE)}
+    return (
+        pairs,
+        photos,
+        {coin_id for coin_id, face, pile in pairs if face in cropped and pile in cropped},
+        {coin_id for coin_id, _, _ in pairs if coin_id in analyzed},
+    )
+
+
+def pending_pairs(registry, analyze=True):
+    """Paires existantes pas encore recadrées (ou analysées, avec analyze)."""
+    pending = []
+    for name in sorted(registry.sessions):
+        pairs, _, cropped, analyzed = session_progress(registry, name)
+        pending += [pair for pair in pairs
+                    if pair[1].exists() and pair[2].exists()
+                    and (pair[0] not in cropped or (analyze and pair[0] not in analyzed))]
+    return pending
+
+
+def print_status(registry):
+    """État des séances: paires, photos recadrées et pièces analysées."""
+    print(f"📁 {registry.root}: {len(registry.sessions)} séances, {registry.next_id} pièces")
+    for name in sorted(registry.sessions):
+        pairs, photos, cropped, analyzed = session_progress(registry, name)
+        cropped = sum(2 for coin_id, _, _ in pairs if coin_id in cropped)
+        done = len(analyzed)
+        ids = f"#{pairs[0][0] + 1}-{pairs[-1][0] + 1}" if pairs else "-"
+        print(f"   {name}: {len(pairs)} pièces ({ids}), {cropped}/{len(photos)} photos recadrées, "
+              f"{done}/{len(pairs)} analysées")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Séances de photos: registre des paires et ingestion continue")
+    parser.add_argument('--watch', action='store_true',
+                        help='Surveiller pictures/ et traiter les nouvelles paires au fil de l\'eau')
+    parser.add_argument('--no-analyze', action='store_true',
+                        help='Avec --watch: recadrer et décliner sans analyser')
+    parser.add_argument('--concurrency', '-c', type=int, default=4,
+                        help='Requêtes d\'analyse simultanées (défaut: 4)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Processus de recadrage (défaut: 1, 0 = tous les cœurs)')
+    parser.add_argument('--center', action='store_true',
+                        help='Recadrer au centre de l\'image sans détecter la pièce')
+    parser.add_argument('--poll', action='store_true', help='Scruter les répertoires au lieu d\'utiliser inotify')
+    args = parser.parse_args()
+
+    if not PICTURES_ROOT.is_dir():
+        print(f"❌ Répertoire des photos introuvable: {PICTURES_ROOT}")
+        return 1
+
+    registry = SessionRegistry()
+    added = registry.scan()
+    registry.save()
+    from gallery_index import refresh_index
+    refresh_index()
+
+    if not args.watch:
+        if added:
+            print(f"📷 {len(added)} nouvelles paires enregistrées")
+        print_status(registry)
+        return 0
+
+    analyze = not args.no_analyze
+    if analyze:
+        from analyze_coins import API_KEY_ENV  # charge aussi .env
+        if not os.getenv(API_KEY_ENV):
+            print(f"⚠️  {API_KEY_ENV} non définie: recadrage et déclinaisons seulement")
+            analyze = False
+
+    # Rattraper les paires arrivées ou laissées en plan hors surveillance
+    pending = pending_pairs(registry, analyze)
+    jobs = args.jobs or os.cpu_count() or 1
+    watcher = open_watcher(PICTURES_ROOT, args.poll)
+    print(f"👀 Surveillance de {PICTURES_ROOT} ({type(watcher).__name__}), Ctrl+C pour arrêter")
+    try:
+        if pending:
+            print(f"↩️  {len(pending)} paires en attente de traitement")
+            ingest(pending, analyze, args.concurrency, jobs, not args.center)
+        watch(registry, watcher, analyze, args.concurrency, jobs, not args.center)
+    except KeyboardInterrupt:
+        print("\n⏹️  Surveillance arrêtée")
+    finally:
+        watcher.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Faux serveur de l'API Messages pour tester l'analyse sans réseau ni coût.
+
+Répond à POST /v1/messages après un délai configurable avec une réponse
+au format de l'API contenant un JSON de pièce fictif. Imite aussi l'API
+Message Batches (création, suivi, résultats JSONL): un lot passe à l'état
+"ended" après --batch-delay secondes. --illegible fait répondre une année
+illisible aux modèles rapides (haiku) pour une part des requêtes, afin
+d'exercer l'escalade de la cascade (analyze_coins.py --cascade).
+
+Usage:
+    python scripts/stub_messages_server.py --port 8089 --delay 2
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8089 ANTHROPIC_API_KEY=test \\
+        python scripts/analyze_coins.py --concurrency 16
+"""
+
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Réponse renvoyée pour chaque pièce
+FAKE_COIN = {
+    "country": "Italie",
+    "currency": "Lire",
+    "value": "200 Lire",
+    "year": "1978",
+    "notes": "Réponse du serveur de test"
+}
+
+
+def coin_text(server, model):
+    """Texte de la réponse: la pièce fictive, parfois sans année pour un modèle rapide."""
+    coin = FAKE_COIN
+    if "haiku" in model and random.random() < server.illegible:
+        coin = {**FAKE_COIN, "year": None}
+    return json.dumps(coin, ensure_ascii=False)
+
+
+def make_message(model, text):
+    """Construit un objet Message tel que renvoyé par l'API."""
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": model,
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 1600, "output_tokens": 80}
+    }
+
+
+def iso(ts):
+    """Horodatage RFC 3339 tel que renvoyé par l'API."""
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def make_batch(server, batch):
+    """Construit l'objet MessageBatch correspondant à l'état courant d'un lot."""
+    ended = time.time() - batch["created"] >= server.batch_delay
+    count = len(batch["results"])
+    host, port = server.server_address[:2]
+    return {
+        "id": batch["id"],
+        "type": "message_batch",
+        "processing_status": "ended" if ended else "in_progress",
+        "request_counts": {
+            "processing": 0 if ended else count,
+            "succeeded": count if ended else 0,
+            "errored": 0,
+            "canceled": 0,
+            "expired": 0
+        },
+        "created_at": iso(batch["created"]),
+        "expires_at": iso(batch["created"] + 86400),
+        "ended_at": iso(batch["created"] + server.batch_delay) if ended else None,
+        "archived_at": None,
+        "cancel_initiated_at": None,
+        "results_url": f"http://{host}:{port}/v1/messages/batches/{batch['id']}/results" if ended else None
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Gestionnaire HTTP imitant l'endpoint Messages."""
+
+    server_version = "StubMessages/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_not_found(self):
+        self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if parts[:3] != ["v1", "messages", "batches"] or len(parts) < 4:
+            self.send_not_found()
+            return
+
+        batch = self.server.batches.get(parts[3])
+        if batch is None:
+            self.send_not_found()
+            return
+
+        if len(parts) == 4:
+            self.send_json(200, make_batch(self.server, batch))
+        elif parts[4:] == ["results"]:
+            lines = "".join(json.dumps(r) + "\n" for r in batch["results"]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/binary")
+            self.send_header("Content-Length", str(len(lines)))
+            self.end_headers()
+            self.wfile.write(lines)
+        else:
+            self.send_not_found()
+
+    def create_batch(self):
+        request = self.read_json()
+        batch_id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        results = [
+            {
+                "custom_id": item["custom_id"],
+                "result": {"type": "succeeded", "message": make_message(
+                    item["params"].get("model", "stub"), coin_text(self.server, item["params"].get("model", "stub")))}
+            }
+            for item in request.get("requests", [])
+        ]
+        batch = {"id": batch_id, "created": time.time(), "results": results}
+        with self.server.lock:
+            self.server.batches[batch_id] = batch
+            self.server.requests += 1
+        self.send_json(200, make_batch(self.server, batch))
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path == "/v1/messages/batches":
+            self.create_batch()
+            return
+        if path != "/v1/messages":
+            self.send_not_found()
+            return
+
+        request = self.read_json()
+        with self.server.lock:
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+            self.server.requests += 1
+        try:
+            time.sleep(self.server.delay)
+            model = request.get("model", "stub")
+            self.send_json(200, make_message(model, coin_text(self.server, model)))
+        finally:
+            with self.server.lock:
+                self.server.in_flight -= 1
+
+
+def make_server(host="127.0.0.1", port=8089, delay=1.0, verbose=False, batch_delay=5.0, illegible=0.0):
+    """Crée le serveur (port 0 = port libre choisi par le système)."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.batch_delay = batch_delay
+    server.illegible = illegible
+    server.batches = {}
+    server.verbose = verbose
+    server.lock = threading.Lock()
+    server.in_flight = 0
+    server.max_in_flight = 0
+    server.requests = 0
+    return server
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Faux serveur de l'API Messages (tests hors ligne)")
+    parser.add_argument('--host', default='127.0.0.1', help='Adresse d\'écoute (défaut: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8089, help='Port d\'écoute (défaut: 8089)')
+    parser.add_argument('--delay', type=float, default=1.0, help='Délai de réponse en secondes (défaut: 1.0)')
+    parser.add_argument('--batch-delay', type=float, default=5.0,
+                        help='Durée de traitement simulée d\'un lot en secondes (défaut: 5.0)')
+    parser.add_argument('--illegible', type=float, default=0.0,
+                        help='Part des réponses des modèles rapides sans année lisible (défaut: 0)')
+    parser.add_argument('--verbose', action='store_true', help='Afficher chaque requête')
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.delay, args.verbose, args.batch_delay, args.illegible)
+    print(f"🧪 Serveur de test sur http://{args.host}:{server.server_port} (délai {args.delay}s)")
+    print(f"   ANTHROPIC_BASE_URL=http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"\n{server.requests} requêtes servies, {server.max_in_flight} simultanées au maximum")
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""
+File de travail partagée pour répartir recadrage et analyse sur plusieurs
+processus et plusieurs machines.
+
+La file est un répertoire sur un volume partagé (NFS, SMB...), sans serveur
+ni base: SQLite en WAL n'y est pas fiable, les opérations atomiques du
+système de fichiers le sont. Pour chaque type de travail (crop, analyze):
+
+    tasks/<id>.json     tâche à faire (photo ou paire, chemins relatifs à pictures/)
+    leases/<id>.lease   bail d'un worker: créé en O_EXCL, date de modification
+                        rafraîchie par un battement de cœur
+    done/<id>.json      résultat, publié de façon atomique avant de rendre le bail
+                        (le premier gagne; celui d'un bail perdu est écarté)
+    merged/<id>.json    résultat intégré (manifestes ou base des métadonnées)
+
+Un bail non rafraîchi depuis LEASE_TTL secondes (worker planté, machine
+éteinte) est repris par le premier worker qui passe. Un worker ne prend
+jamais une tâche qui a déjà son résultat: une pièce n'est payée qu'une fois.
+
+L'intégration (merge) se fait sous un bail dédié, par une seule machine à la
+fois: les résultats sont appliqués (recadrages dans les manifestes, analyses
+dans la base via write_metadata) puis déplacés dans merged/. Après un crash
+au milieu d'une intégration, les résultats non déplacés sont réappliqués à
+l'identique: chacun compte une seule fois.
+
+Le répertoire de la file se change avec la variable COINS_QUEUE_DIR (les
+photos avec COINS_PICTURES_DIR, cf. sessions.py).
+
+Usage:
+    python scripts/work_queue.py enqueue crop
+    python scripts/work_queue.py enqueue analyze --session 2025-11-02_19h15
+    python scripts/work_queue.py work analyze -j 4 --cascade      # sur chaque machine
+    python scripts/work_queue.py merge analyze                    # sur la machine de la galerie
+    python scripts/work_queue.py status
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+from sessions import ROOT_DIR, PICTURES_ROOT, CROP_SIZE
+from metrics import METRICS
+
+QUEUE_ROOT = Path(os.environ.get("COINS_QUEUE_DIR") or ROOT_DIR / "queue")
+KINDS = ("crop", "analyze")
+# Bail repris sans battement de cœur depuis LEASE_TTL secondes, rafraîchi 4 fois par période
+LEASE_TTL = 120.0
+HEARTBEATS_PER_TTL = 4
+# Attente entre deux recherches quand les tâches restantes sont prises par d'autres
+POLL_INTERVAL = 5.0
+MERGE_LEASE = "_merge"
+
+
+def worker_name():
+    """Identifiant du worker courant: machine et processus."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def write_new(path, data):
+    """
+    Écrit un JSON via un fichier temporaire du même répertoire puis un lien:
+    un fichier existant n'est jamais remplacé, le premier écrit gagne.
+
+    Returns:
+        False si le fichier existait déjà
+    """
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    try:
+        os.link(tmp_path, path)
+        return True
+    except FileExistsError:
+        return False
+    finally:
+        os.unlink(tmp_path)
+
+
+def read_json(path):
+    """JSON d'un fichier de la file, None s'il a disparu entre-temps."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class WorkQueue:
+    """
+    File d'un type de travail sur le volume partagé.
+
+    Les baux détenus par ce processus sont rafraîchis par le thread lancé
+    par heartbeat().
+    """
+
+    def __init__(self, kind, root=QUEUE_ROOT, ttl=LEASE_TTL):
+        self.kind = kind
+        self.root = Path(root) / kind
+        self.ttl = ttl
+        self.worker = worker_name()
+        self.held = set()
+        self.lock = threading.Lock()
+        self.backlog = []
+        for name in ("tasks", "leases", "done", "merged"):
+            (self.root / name).mkdir(parents=True, exist_ok=True)
+
+    def path(self, area, task_id):
+        suffix = ".lease" if area == "leases" else ".json"
+        return self.root / area / f"{task_id}{suffix}"
+
+    def ids(self, area):
+        suffix = ".lease" if area == "leases" else ".json"
+        return sorted(entry.name[:-len(suffix)] for entry in os.scandir(self.root / area)
+                      if entry.name.endswith(suffix) and not entry.name.startswith("."))
+
+    # Tâches
+
+    def enqueue(self, tasks):
+        """
+        Ajoute des tâches {id: contenu}; une tâche déjà en file (en attente,
+        en cours ou terminée mais pas intégrée) n'est pas dupliquée, même si
+        plusieurs machines alimentent la file en même temps.
+
+        Returns:
+            Nombre de tâches ajoutées
+        """
+        added = 0
+        for task_id, payload in tasks.items():
+            path = self.path("tasks", task_id)
+            tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            try:
+                # Le lien échoue si la tâche existe: pas de remplacement silencieux
+                os.link(tmp_path, path)
+                added += 1
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(tmp_path)
+        return added
+
+    def pending(self):
+        """Ids des tâches sans résultat (libres ou sous bail)."""
+        done = set(self.ids("done"))
+        return [task_id for task_id in self.ids("tasks") if task_id not in done]
+
+    # Baux
+
+    def acquire(self, task_id):
+        """Prend le bail d'une tâche (ou d'un bail expiré); False s'il est détenu ailleurs."""
+        for _ in range(2):
+            try:
+                fd = os.open(self.path("leases", task_id), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self.break_stale(task_id):
+                    return False
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"worker": self.worker, "acquired": time.time()}, f)
+            with self.lock:
+                self.held.add(task_id)
+            return True
+        return False
+
+    def break_stale(self, task_id):
+        """
+        Supprime un bail expiré.
+
+        Le bail est d'abord renommé (un seul worker y parvient), puis sa date
+        est revérifiée: si un autre worker l'a repris entre-temps, il est remis
+        en place.
+        """
+        lease = self.path("leases", task_id)
+        try:
+            if time.time() - lease.stat().st_mtime < self.ttl:
+                return False
+            stale = lease.with_name(f".{lease.name}.{uuid.uuid4().hex[:8]}.stale")
+            os.rename(lease, stale)
+        except FileNotFoundError:
+            return True
+        if time.time() - stale.stat().st_mtime < self.ttl:
+            try:
+                os.link(stale, lease)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return False
+        owner = read_json(stale) or {}
+        os.unlink(stale)
+        print(f"♻️  {self.kind}/{task_id}: bail expiré de {owner.get('worker', '?')} repris", flush=True)
+        return True
+
+    def owns(self, task_id):
+        owner = read_json(self.path("leases", task_id))
+        return bool(owner) and owner.get("worker") == self.worker
+
+    def release(self, task_id):
+        """Rend le bail d'une tâche s'il est encore à ce worker."""
+        with self.lock:
+            self.held.discard(task_id)
+        if self.owns(task_id):
+            self.path("leases", task_id).unlink(missing_ok=True)
+
+    def beat(self):
+        """Rafraîchit les baux détenus; un bail repris par un autre worker est abandonné."""
+        with self.lock:
+            held = list(self.held)
+        for task_id in held:
+            if self.owns(task_id):
+                os.utime(self.path("leases", task_id))
+            else:
+                with self.lock:
+                    self.held.discard(task_id)
+                print(f"⚠️  {self.kind}/{task_id}: bail perdu", flush=True)
+
+    @contextmanager
+    def heartbeat(self):
+        """Rafraîchit les baux détenus en arrière-plan; les rend tous à la sortie."""
+        stop = threading.Event()
+        interval = self.ttl / HEARTBEATS_PER_TTL
+
+        def run():
+            while not stop.wait(interval):
+                self.beat()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            with self.lock:
+                held = list(self.held)
+            for task_id in held:
+                self.release(task_id)
+
+    # Travail
+
+    def claim(self):
+        """
+        Prend la prochaine tâche libre (ou abandonnée).
+
+        La liste des tâches n'est relue qu'une fois parcourue, en commençant
+        à une position propre au worker pour limiter la concurrence sur les
+        mêmes baux.
+
+        Returns:
+            Tuple (id, contenu), ou None si toutes les tâches restantes sont prises
+        """
+        if not self.backlog:
+            pending = self.pending()
+            start = hash(self.worker) % len(pending) if pending else 0
+            self.backlog = pending[start:] + pending[:start]
+        while self.backlog:
+            task_id = self.backlog.pop(0)
+            if not self.acquire(task_id):
+                continue
+            # Terminée ou intégrée pendant la recherche: ne pas refaire (ni repayer)
+            payload = read_json(self.path("tasks", task_id))
+            if payload is None or self.path("done", task_id).exists():
+                self.release(task_id)
+                continue
+            return task_id, payload
+        return None
+
+    def complete(self, task_id, result):
+        """
+        Enregistre le résultat d'une tâche puis rend son bail.
+
+        Un worker resté bloqué au-delà de son bail a pu être relayé: son
+        résultat tardif est écarté, celui du worker qui a repris la tâche (ou
+        le premier publié) est conservé.
+
+        Returns:
+            True si le résultat est enregistré
+        """
+        if not self.owns(task_id):
+            with self.lock:
+                self.held.discard(task_id)
+            print(f"⚠️  {self.kind}/{task_id}: bail perdu, résultat tardif écarté", flush=True)
+            return False
+        published = write_new(self.path("done", task_id), result)
+        if not published:
+            print(f"⚠️  {self.kind}/{task_id}: résultat déjà enregistré, résultat tardif écarté", flush=True)
+        self.release(task_id)
+        return published
+
+    def merge(self, apply):
+        """
+        Intègre les résultats terminés, sous le bail d'intégration.
+
+        apply reçoit la liste [(id, contenu de la tâche, résultat)] et doit
+        être idempotent: une intégration interrompue est reprise à l'identique.
+
+        Returns:
+            Nombre de résultats intégrés, ou None si une autre machine intègre déjà
+        """
+        if not self.acquire(MERGE_LEASE):
+            return None
+        with self.heartbeat():
+            items = []
+            for task_id in self.ids("done"):
+                result = read_json(self.path("done", task_id))
+                if result is not None:
+                    items.append((task_id, read_json(self.path("tasks", task_id)), result))
+            if items:
+                apply(items)
+            # Tâche supprimée avant de déplacer le résultat: un crash entre les deux ne
+            # peut que réappliquer ce résultat, jamais relancer la tâche
+            for task_id, _, _ in items:
+                self.path("tasks", task_id).unlink(missing_ok=True)
+                os.replace(self.path("done", task_id), self.path("merged", task_id))
+            return len(items)
+
+    def status(self):
+        """Compteurs: tâches en attente, sous bail (actif ou expiré), terminées, intégrées."""
+        now = time.time()
+        leased = stale = 0
+        for task_id in self.ids("leases"):
+            if task_id == MERGE_LEASE:
+                continue
+            try:
+                age = now - self.path("leases", task_id).stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if age < self.ttl:
+                leased += 1
+            else:
+                stale += 1
+        pending = len(self.pending())
+        return {"pending": pending - leased - stale, "leased": leased, "stale": stale,
+                "done": len(self.ids("done")), "merged": len(self.ids("merged"))}
+
+
+def relative(path):
+    """Chemin d'une photo relatif au répertoire des photos (identique sur toutes les machines)."""
+    return Path(path).resolve().relative_to(PICTURES_ROOT.resolve()).as_posix()
+
+
+# Recadrage
+
+def crop_tasks(session=None, force=False, target_size=CROP_SIZE):
+    """Tâches de recadrage des photos pas encore recadrées d'après les manifestes."""
+    from crop_images import load_manifest, is_up_to_date
+    from sessions import discover_sessions, list_photos
+
+    tasks = {}
+    for directory in discover_sessions():
+        if session and directory.name != session:
+            continue
+        manifest = {} if force else load_manifest(directory)
+        for name in list_photos(directory):
+            path = directory / name
+            if not is_up_to_date(path, manifest.get(name), target_size):
+                tasks[f"{directory.name}__{name}"] = {"path": relative(path)}
+    return tasks
+
+
+def crop_task(payload, target_size=CROP_SIZE, detect=True):
+    """Worker: recadre une photo et renvoie son entrée de manifeste."""
+    from crop_images import crop_image_to_square, manifest_entry
+
+    path = PICTURES_ROOT / payload["path"]
+    success, message = crop_image_to_square(path, target_size=target_size, detect=detect)
+    print(message, flush=True)
+    return {"path": payload["path"], "ok": success, "message": message,
+            "entry": manifest_entry(path, target_size) if success else None}
+
+
+def merge_crops(items):
+    """Intègre les recadrages dans les manifestes de leurs répertoires."""
+    from crop_images import load_manifest, save_manifest
+
+    manifests = {}
+    for _, _, result in items:
+        if not result["ok"]:
+            continue
+        path = PICTURES_ROOT / result["path"]
+        entries = manifests.setdefault(path.parent, load_manifest(path.parent))
+        entries[path.name] = result["entry"]
+    for directory, entries in manifests.items():
+        save_manifest(directory, entries)
+
+
+# Analyse
+
+def analyze_tasks(session=None, reanalyze=False):
+    """Tâches d'analyse des paires du registre (par défaut, celles pas encore analysées)."""
+    from sessions import SessionRegistry
+    from metadata_store import MetadataStore
+
+    registry = SessionRegistry()
+    registry.scan()
+    registry.save()
+    analyzed = set()
+    if not reanalyze:
+        with MetadataStore() as store:
+            analyzed = store.analyzed_ids()
+    return {f"coin-{coin_id}": {"id": coin_id, "face": relative(face), "pile": relative(pile)}
+            for coin_id, face, pile in registry.pairs(session) if coin_id not in analyzed}
+
+
+class AnalyzeWorker:
+    """Worker d'analyse: un client et le cache des résultats local à la machine."""
+
+    def __init__(self, preprocess=None, cascade=False, use_cache=True):
+        from anthropic import Anthropic
+        from analyze_coins import API_KEY_ENV
+        from result_cache import ResultCache
+
+        self.client = Anthropic(api_key=os.getenv(API_KEY_ENV))
+        self.preprocess = preprocess
+        self.cascade = cascade
+        self.cache = ResultCache() if use_cache else None
+
+    def __call__(self, payload):
+        from analyze_coins import analyze_coin, error_entry, format_result
+
+        face, pile = PICTURES_ROOT / payload["face"], PICTURES_ROOT / payload["pile"]
+        try:
+            metadata = analyze_coin(self.client, face, pile, payload["id"], self.preprocess, self.cache,
+                                    cascade=self.cascade)
+        except Exception as e:
+            metadata = error_entry(face, pile, payload["id"], e)
+        print(f"Pièce #{payload['id'] + 1}: {format_result(metadata)}", flush=True)
+        return metadata
+
+    def close(self):
+        if self.cache:
+            self.cache.close()
+
+
+def merge_analyses(items):
+    """Intègre les analyses dans la base des métadonnées et le JSON de la galerie."""
+    from analyze_coins import write_metadata
+    from metadata_store import MetadataStore
+
+    with MetadataStore() as store:
+        write_metadata(sorted((result for _, _, result in items), key=lambda r: r["id"]), store)
+
+
+MERGERS = {"crop": merge_crops, "analyze": merge_analyses}
+
+
+def run_worker(kind, options, root=QUEUE_ROOT, poll=POLL_INTERVAL):
+    """
+    Boucle d'un worker: prend, traite et termine des tâches jusqu'à ce qu'il
+    n'en reste plus aucune sans résultat (y compris celles d'autres workers,
+    reprises si leur bail expire).
+
+    Returns:
+        Tuple (tâches traitées, mesures du processus)
+    """
+    queue = WorkQueue(kind, root, options["ttl"])
+    if kind == "crop":
+        handler, close = (lambda payload: crop_task(payload, options["size"], options["detect"])), None
+    else:
+        handler = AnalyzeWorker(options["preprocess"], options["cascade"], options["cache"])
+        close = handler.close
+
+    count = 0
+    try:
+        with queue.heartbeat():
+            while True:
+                task = queue.claim()
+                if task is None:
+                    if not queue.pending():
+                        break
+                    time.sleep(poll)
+                    continue
+                task_id, payload = task
+                if queue.complete(task_id, handler(payload)):
+                    count += 1
+    finally:
+        if close:
+            close()
+    return count, METRICS.drain()
+
+
+def work(kind, options, jobs=1, root=QUEUE_ROOT):
+    """Lance jobs workers sur cette machine et renvoie le nombre de tâches traitées."""
+    if jobs <= 1:
+        count, _ = run_worker(kind, options, root)
+        return count
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    count = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for done, events in executor.map(run_worker, [kind] * jobs, [options] * jobs, [root] * jobs):
+            count += done
+            METRICS.merge(events)
+    return count
+
+
+def print_status(root=QUEUE_ROOT, ttl=LEASE_TTL):
+    print(f"📬 File {root}")
+    for kind in KINDS:
+        counts = WorkQueue(kind, root, ttl).status()
+        print(f"   {kind:<8} {counts['pending']} en attente, {counts['leased']} en cours, "
+              f"{counts['stale']} baux expirés, {counts['done']} à intégrer, {counts['merged']} intégrées")
+
+
+def main():
+    import argparse
+    from preprocess_images import DEFAULT_MAX_EDGE, DEFAULT_QUALITY
+
+    parser = argparse.ArgumentParser(
+        description="File de travail partagée (recadrage, analyse) entre processus et machines"
+    )
+    parser.add_argument('action', choices=('enqueue', 'work', 'merge', 'status'))
+    parser.add_argument('kind', nargs='?', choices=KINDS, help='Type de travail (sauf pour status)')
+    parser.add_argument('--queue', type=Path, default=QUEUE_ROOT, help=f'Répertoire de la file (défaut: {QUEUE_ROOT})')
+    parser.add_argument('--session', metavar='NOM', help='enqueue: une seule séance (défaut: toutes)')
+    parser.add_argument('--all', action='store_true',
+                        help='enqueue: tout mettre en file, même ce qui est déjà recadré ou analysé')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='work: processus workers sur cette machine (défaut: 1, 0 = tous les cœurs)')
+    parser.add_argument('--merge', action='store_true', help='work: intégrer les résultats une fois la file vide')
+    parser.add_argument('--lease-ttl', type=float, default=LEASE_TTL,
+                        help=f'Secondes sans battement de cœur avant reprise d\'un bail (défaut: {LEASE_TTL:.0f})')
+    parser.add_argument('--size', type=int, default=CROP_SIZE, help=f'Taille du carré (défaut: {CROP_SIZE})')
+    parser.add_argument('--center', action='store_true', help='Recadrer au centre sans détecter la pièce')
+    parser.add_argument('--cascade', action='store_true', help='Analyse en cascade (cf. analyze_coins.py)')
+    parser.add_argument('--max-edge', type=int, default=DEFAULT_MAX_EDGE,
+                        help=f'Grand côté des images envoyées (défaut: {DEFAULT_MAX_EDGE}, 0 = photos brutes)')
+    parser.add_argument('--quality', type=int, default=DEFAULT_QUALITY,
+                        help=f'Qualité JPEG des images envoyées (défaut: {DEFAULT_QUALITY})')
+    parser.add_argument('--no-cache', action='store_true', help='Ne pas consulter le cache local des résultats')
+    args = parser.parse_args()
+
+    if args.action == 'status':
+        print_status(args.queue, args.lease_ttl)
+        return 0
+    if args.kind is None:
+        parser.error(f"{args.action}: préciser le type de travail ({' ou '.join(KINDS)})")
+
+    queue = WorkQueue(args.kind, args.queue, args.lease_ttl)
+    if args.action == 'enqueue':
+        if args.kind == 'crop':
+            tasks = crop_tasks(args.session, args.all, args.size)
+        else:
+            tasks = analyze_tasks(args.session, args.all)
+        added = queue.enqueue(tasks)
+        print(f"📥 {added} tâches {args.kind} ajoutées ({len(tasks) - added} déjà en file)")
+        return 0
+
+    if args.action == 'work':
+        if args.kind == 'analyze':
+            from analyze_coins import API_KEY_ENV  # charge aussi .env
+            if not os.getenv(API_KEY_ENV):
+                print(f"❌ Erreur: Variable d'environnement {API_KEY_ENV} non définie")
+                return 1
+        options = {
+            "ttl": args.lease_ttl, "size": args.size, "detect": not args.center, "cascade": args.cascade, "cache": not args.no_cache,
+            "preprocess": {"max_edge": args.max_edge, "quality": args.quality} if args.max_edge else None,
+        }
+        jobs = args.jobs or os.cpu_count() or 1
+        print(f"👷 {worker_name()}: {jobs} workers {args.kind} sur {queue.root}\n", flush=True)
+        METRICS.start(f"work_queue_{args.kind}")
+        try:
+            count = work(args.kind, options, jobs, args.queue)
+            print(f"\n✅ {count} tâches traitées par cette machine")
+        finally:
+            summary = METRICS.finish()
+            if summary:
+                print(f"\n{summary}")
+        if not args.merge:
+            return 0
+
+    merged = queue.merge(MERGERS[args.kind])
+    if merged is None:
+        print("⏳ Intégration déjà en cours sur une autre machine")
+    else:
+        print(f"🔗 {merged} résultats {args.kind} intégrés")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())